@@ -3,9 +3,9 @@ from .messaging_pyx import Context, Poller, SubSocket, PubSocket  # pylint: disa
 from .messaging_pyx import MultiplePublishersError, MessagingError  # pylint: disable=no-name-in-module, import-error
 import os
 import capnp
+import numpy as np
 
 from typing import Optional, List, Union
-from collections import deque
 
 from cereal import log
 from cereal.services import service_list
@@ -141,9 +141,6 @@ class SubMaster:
     self.updated = {s: False for s in services}
     self.rcv_time = {s: 0. for s in services}
     self.rcv_frame = {s: 0 for s in services}
-    self.alive = {s: False for s in services}
-    self.freq_ok = {s: False for s in services}
-    self.recv_dts = {s: deque([0.0] * AVG_FREQ_HISTORY, maxlen=AVG_FREQ_HISTORY) for s in services}
     self.sock = {}
     self.freq = {}
     self.data = {}
@@ -172,6 +169,38 @@ class SubMaster:
       self.logMonoTime[s] = 0
       self.valid[s] = data.valid
 
+    self.init_health(services)
+
+  def init_health(self, services: List[str]) -> None:
+    # alive and freq_ok are kept in arrays indexed by service id, the dicts are only
+    # written when a value changes. Receive dts are ring buffers with a running sum.
+    self.services = list(services)
+    self.service_idx = {s: i for i, s in enumerate(self.services)}
+    self.alive = {s: False for s in services}
+    self.freq_ok = {s: False for s in services}
+
+    n = len(self.services)
+    freq = np.array([self.freq[s] for s in self.services], dtype=np.float64)
+    # arbitrary small number to avoid float comparison. If freq is 0, the checks always pass
+    checked = freq > 1e-5
+    # alive if delay is within 10x the expected frequency
+    self._alive_dt = np.full(n, np.inf)
+    self._alive_dt[checked] = 10. / freq[checked]
+    # TODO: check if update frequency is high enough to not drop messages
+    # freq_ok if average frequency is higher than 90% of expected frequency
+    self._expected_dt = np.full(n, np.inf)
+    self._expected_dt[checked] = 1 / (freq[checked] * 0.90)
+    self._track_dts = [bool(c) and s not in self.non_polled_services and s not in self.ignore_average_freq
+                       for s, c in zip(self.services, checked)]
+
+    self._rcv_time = np.zeros(n)
+    self._alive = np.zeros(n, dtype=bool)
+    self._dts = np.zeros((n, AVG_FREQ_HISTORY))
+    self._dts_pos = [0] * n
+    self._dts_sum = np.zeros(n)
+    self._last_updated: List[str] = []
+    self._health_init = False
+
   def __getitem__(self, s: str) -> capnp.lib.capnp._DynamicStructReader:
     return self.data[s]
 
@@ -187,19 +216,27 @@ class SubMaster:
 
   def update_msgs(self, cur_time: float, msgs: List[capnp.lib.capnp._DynamicStructReader]) -> None:
     self.frame += 1
-    self.updated = dict.fromkeys(self.updated, False)
+    for s in self._last_updated:
+      self.updated[s] = False
+    self._last_updated = []
+
+    new_dts = []
     for msg in msgs:
       if msg is None:
         continue
 
       s = msg.which()
+      i = self.service_idx[s]
       self.updated[s] = True
+      self._last_updated.append(s)
 
-      if self.rcv_time[s] > 1e-5 and self.freq[s] > 1e-5 and (s not in self.non_polled_services) \
-        and (s not in self.ignore_average_freq):
-        self.recv_dts[s].append(cur_time - self.rcv_time[s])
+      prev_rcv_time = self.rcv_time[s]
+      if prev_rcv_time > 1e-5 and self._track_dts[i]:
+        self._add_dt(i, cur_time - prev_rcv_time)
+        new_dts.append(i)
 
       self.rcv_time[s] = cur_time
+      self._rcv_time[i] = cur_time
       self.rcv_frame[s] = self.frame
       self.data[s] = getattr(msg, s)
       self.logMonoTime[s] = msg.logMonoTime
@@ -210,20 +247,26 @@ class SubMaster:
         self.alive[s] = True
 
     if not SIMULATION:
-      for s in self.data:
-        # arbitrary small number to avoid float comparison. If freq is 0, we can skip the check
-        if self.freq[s] > 1e-5:
-          # alive if delay is within 10x the expected frequency
-          self.alive[s] = (cur_time - self.rcv_time[s]) < (10. / self.freq[s])
-
-          # TODO: check if update frequency is high enough to not drop messages
-          # freq_ok if average frequency is higher than 90% of expected frequency
-          avg_dt = sum(self.recv_dts[s]) / AVG_FREQ_HISTORY
-          expected_dt = 1 / (self.freq[s] * 0.90)
-          self.freq_ok[s] = (avg_dt < expected_dt)
-        else:
-          self.freq_ok[s] = True
-          self.alive[s] = True
+      alive = (cur_time - self._rcv_time) < self._alive_dt
+      for i in np.flatnonzero(alive != self._alive):
+        self.alive[self.services[i]] = bool(alive[i])
+      self._alive = alive
+
+      # the average dt only moves when a service received
+      if not self._health_init:
+        self._health_init = True
+        new_dts = range(len(self.services))
+      for i in new_dts:
+        self.freq_ok[self.services[i]] = bool(self._dts_sum[i] / AVG_FREQ_HISTORY < self._expected_dt[i])
+
+  def _add_dt(self, i: int, dt: float) -> None:
+    pos = self._dts_pos[i]
+    self._dts_sum[i] += dt - self._dts[i, pos]
+    self._dts[i, pos] = dt
+    self._dts_pos[i] = (pos + 1) % AVG_FREQ_HISTORY
+    if self._dts_pos[i] == 0:
+      # resum once per lap so rounding errors don't accumulate
+      self._dts_sum[i] = self._dts[i].sum()
 
   def all_alive(self, service_list=None) -> bool:
     if service_list is None:  # check all
@@ -0,0 +1,76 @@
+import os
+import select
+import struct
+from cffi import FFI
+
+ffi = FFI()
+ffi.cdef("""
+int inotify_init1(int flags);
+int inotify_add_watch(int fd, const char *pathname, uint32_t mask);
+int inotify_rm_watch(int fd, int wd);
+""")
+libc = ffi.dlopen(None)
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+_EVENT = struct.Struct("iIII")
+
+
+class Inotify:
+  """Minimal wrapper of the Linux inotify API, read() returns (wd, mask, cookie, name) tuples."""
+  def __init__(self):
+    self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    if self.fd == -1:
+      raise OSError(ffi.errno, f"{os.strerror(ffi.errno)}: inotify_init1")
+
+  def fileno(self):
+    return self.fd
+
+  def add_watch(self, path, mask):
+    wd = libc.inotify_add_watch(self.fd, path.encode(), mask)
+    if wd == -1:
+      raise OSError(ffi.errno, f"{os.strerror(ffi.errno)}: inotify_add_watch({path})")
+    return wd
+
+  def rm_watch(self, wd):
+    libc.inotify_rm_watch(self.fd, wd)
+
+  def read(self, timeout=None):
+    """Waits up to timeout secs for events, None waits forever."""
+    if not select.select([self.fd], [], [], timeout)[0]:
+      return []
+
+    events = []
+    while True:
+      try:
+        buf = os.read(self.fd, 64 * 1024)
+      except BlockingIOError:
+        break
+      pos = 0
+      while pos < len(buf):
+        wd, mask, cookie, length = _EVENT.unpack_from(buf, pos)
+        pos += _EVENT.size
+        name = buf[pos:pos + length].rstrip(b'\0').decode()
+        pos += length
+        events.append((wd, mask, cookie, name))
+    return events
+
+  def close(self):
+    if self.fd != -1:
+      os.close(self.fd)
+      self.fd = -1
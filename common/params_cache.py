@@ -0,0 +1,91 @@
+import os
+import threading
+from decimal import Decimal
+
+from common.inotify import Inotify, IN_CLOSE_WRITE, IN_CREATE, IN_DELETE, IN_MOVED_FROM, IN_MOVED_TO, IN_Q_OVERFLOW
+from common.params import Params
+from selfdrive.swaglog import cloudlog
+
+
+class CachedParams:
+  """Read-through cache of params for the control loops. A thread follows changes to
+     the params directory with inotify and drops the cached values of changed keys,
+     so reads of unchanged keys are dict lookups. Without inotify nothing is cached."""
+  EVENTS = IN_CLOSE_WRITE | IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+
+  def __init__(self, params=None):
+    self.params = Params() if params is None else params
+    self.values = {}  # (key, type, arg) -> value
+    self.versions = {}  # key -> number of changes seen
+    self.enabled = False
+    self.lock = threading.Lock()
+
+    try:
+      self.inotify = Inotify()
+      self.inotify.add_watch(self.params.get_param_path(), self.EVENTS)
+    except OSError:
+      cloudlog.exception("params cache: inotify unavailable, not caching")
+      return
+
+    self.enabled = True
+    threading.Thread(target=self._watch, daemon=True).start()
+
+  def _watch(self):
+    while True:
+      events = self.inotify.read()
+      with self.lock:
+        if any(mask & IN_Q_OVERFLOW for _, mask, _, _ in events):
+          self.versions = {k: v + 1 for k, v in self.versions.items()}
+          self.values.clear()
+          continue
+
+        # writes go through hidden temp files that are renamed to the key
+        changed = {name for _, _, _, name in events if not name.startswith(".")}
+        for key in changed:
+          self.versions[key] = self.versions.get(key, 0) + 1
+        if changed:
+          self.values = {k: v for k, v in self.values.items() if k[0] not in changed}
+
+  def _cached(self, key, kind, arg, parse):
+    try:
+      return self.values[(key, kind, arg)]
+    except KeyError:
+      pass
+
+    version = self.versions.get(key, 0)
+    value = parse(self.params.get(key))
+    if self.enabled:
+      with self.lock:
+        # the key may have changed while it was read
+        if self.versions.get(key, 0) == version:
+          self.values[(key, kind, arg)] = value
+    return value
+
+  def get(self, key, encoding=None):
+    return self._cached(key, "str", encoding, lambda v: v.decode(encoding) if v is not None and encoding is not None else v)
+
+  def get_bool(self, key):
+    return self._cached(key, "bool", None, lambda v: v == b"1")
+
+  def get_int(self, key, default=0):
+    return self._cached(key, "int", default, lambda v: default if v is None else int(v))
+
+  def get_float(self, key, default=0.):
+    return self._cached(key, "float", default, lambda v: default if v is None else float(v))
+
+  def get_scaled(self, key, scale, default=0.):
+    """float(Decimal(value) * Decimal(scale)), as the int-valued tuning params are stored."""
+    return self._cached(key, "scaled", (scale, default), lambda v: default if v is None else float(Decimal(v.decode()) * Decimal(scale)))
+
+
+_cached_params = None
+_pid = None
+
+
+def cached_params():
+  """The CachedParams of this process."""
+  global _cached_params, _pid
+  if _cached_params is None or _pid != os.getpid():
+    _cached_params = CachedParams()
+    _pid = os.getpid()
+  return _cached_params
@@ -20,6 +20,7 @@ cdef extern from "selfdrive/common/params.h":
     int put(string, string) nogil
     int putBool(string, bool) nogil
     bool checkKey(string) nogil
+    string getParamPath(string) nogil
     void clearAll(ParamKeyType)
 
 
@@ -43,6 +44,9 @@ cdef class Params:
   def clear_all(self, tx_type=ParamKeyType.ALL):
     self.p.clearAll(tx_type)
 
+  def get_param_path(self, key=""):
+    return self.p.getParamPath(ensure_bytes(key)).decode()
+
   def check_key(self, key):
     key = ensure_bytes(key)
     if not self.p.checkKey(key):
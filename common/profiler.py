@@ -1,45 +1,128 @@
+import os
+import json
 import time
+import tempfile
+from contextlib import contextmanager, nullcontext
+
+import numpy as np
+
+from common.file_helpers import atomic_write_in_dir, mkdirs_exists_ok
+
+# Timings are kept in a ring buffer per checkpoint. Profilers with a name put the
+# buffers in shared memory, so they can be read live with selfdrive/debug/profiler_stats.py
+PROFILER_WINDOW = int(os.getenv("PROFILER_WINDOW", "1000"))
+PROFILER_DIR = os.getenv("PROFILER_DIR", "/dev/shm/profiler" if os.path.isdir("/dev/shm") else os.path.join(tempfile.gettempdir(), "profiler"))
+MAX_CHECKPOINTS = 64
+
+_NULL_SCOPE = nullcontext()
+
+
+def _paths(name):
+  return os.path.join(PROFILER_DIR, name + ".npy"), os.path.join(PROFILER_DIR, name + ".json")
+
+
+def _stats(names, buf):
+  # column 0 is the number of samples recorded, the ring buffer follows
+  stats = {}
+  for n, idx in names.items():
+    cnt = int(buf[idx, 0])
+    if cnt == 0:
+      continue
+    samples = buf[idx, 1:1 + min(cnt, buf.shape[1] - 1)] * 1000.
+    p50, p99 = np.percentile(samples, [50, 99])
+    stats[n] = {'count': cnt, 'mean': float(samples.mean()), 'p50': float(p50), 'p99': float(p99), 'max': float(samples.max())}
+  return stats
+
+
+def read_stats(name):
+  """Stats in ms of a running named Profiler, from its shared memory buffers."""
+  buf_path, names_path = _paths(name)
+  with open(names_path) as f:
+    meta = json.load(f)
+  return _stats(meta['names'], np.load(buf_path, mmap_mode='r'))
+
 
 class Profiler():
-  def __init__(self, enabled=False):
-    self.enabled = enabled
-    self.cp = {}
-    self.cp_ignored = []
-    self.iter = 0
-    self.start_time = time.time()
-    self.last_time = self.start_time
-    self.tot = 0.
+  def __init__(self, enabled=False, name=None, window=PROFILER_WINDOW):
+    self.name = name
+    self.window = window
+    self.reset(enabled)
 
   def reset(self, enabled=False):
     self.enabled = enabled
-    self.cp = {}
+    self.names = {}
     self.cp_ignored = []
+    self.scopes = []
     self.iter = 0
-    self.start_time = time.time()
+    self.start_time = time.monotonic()
     self.last_time = self.start_time
+    self.tot = 0.
+
+    self.buf = None
+    if enabled:
+      if self.name is not None:
+        mkdirs_exists_ok(PROFILER_DIR)
+        self.buf = np.lib.format.open_memmap(_paths(self.name)[0], mode='w+', dtype=np.float64, shape=(MAX_CHECKPOINTS, self.window + 1))
+      else:
+        self.buf = np.zeros((MAX_CHECKPOINTS, self.window + 1))
+
+  def _record(self, name, dt, ignore=False):
+    idx = self.names.get(name)
+    if idx is None:
+      if len(self.names) == MAX_CHECKPOINTS:
+        return
+      idx = self.names[name] = len(self.names)
+      if ignore:
+        self.cp_ignored.append(name)
+      if self.name is not None:
+        with atomic_write_in_dir(_paths(self.name)[1], mode="w", overwrite=True) as f:
+          json.dump({'names': self.names, 'ignored': self.cp_ignored}, f)
+
+    cnt = int(self.buf[idx, 0])
+    self.buf[idx, 1 + cnt % self.window] = dt
+    self.buf[idx, 0] = cnt + 1
+    if not ignore and not self.scopes:
+      self.tot += dt
 
   def checkpoint(self, name, ignore=False):
     # ignore flag needed when benchmarking threads with ratekeeper
     if not self.enabled:
       return
-    tt = time.time()
-    if name not in self.cp:
-      self.cp[name] = 0.
-      if ignore:
-        self.cp_ignored.append(name)
-    self.cp[name] += tt - self.last_time
-    if not ignore:
-      self.tot += tt - self.last_time
+    tt = time.monotonic()
+    if self.scopes:
+      name = self.scopes[-1] + "/" + name
+    self._record(name, tt - self.last_time, ignore)
     self.last_time = tt
 
+  def scope(self, name):
+    """Context manager timing a block, checkpoints and scopes inside it are nested under its name."""
+    if not self.enabled:
+      return _NULL_SCOPE
+    return self._scope(name)
+
+  @contextmanager
+  def _scope(self, name):
+    if self.scopes:
+      name = self.scopes[-1] + "/" + name
+    start = self.last_time = time.monotonic()
+    self.scopes.append(name)
+    try:
+      yield
+    finally:
+      self.scopes.pop()
+      self.last_time = time.monotonic()
+      self._record(name, self.last_time - start)
+
+  def stats(self):
+    if not self.enabled:
+      return {}
+    return _stats(self.names, self.buf)
+
   def display(self):
     if not self.enabled:
       return
     self.iter += 1
     print("******* Profiling %d *******" % self.iter)
-    for n, ms in sorted(self.cp.items(), key=lambda x: -x[1]):
-      if n in self.cp_ignored:
-        print("%30s: %9.2f  avg: %7.2f  percent: %3.0f   IGNORED" % (n, ms*1000.0, ms*1000.0/self.iter, ms/self.tot*100))
-      else:
-        print("%30s: %9.2f  avg: %7.2f  percent: %3.0f" % (n, ms*1000.0, ms*1000.0/self.iter, ms/self.tot*100))
+    for n, s in sorted(self.stats().items(), key=lambda x: -x[1]['mean']):
+      print("%30s: p50: %7.2f  p99: %7.2f  max: %7.2f%s" % (n, s['p50'], s['p99'], s['max'], "   IGNORED" if n in self.cp_ignored else ""))
     print(f"Iter clock: {self.tot / self.iter:2.6f}   TOTAL: {self.tot:2.2f}")
@@ -46,6 +46,9 @@ public:
   bool ignore_checksum = false;
   bool ignore_counter = false;
 
+  size_t values_offset = 0;
+  std::vector<bool> keep_all;  // signals that collect all_vals, empty for all of them
+
   bool parse(uint64_t sec, const std::vector<uint8_t> &dat);
   bool update_counter_generic(int64_t v, int cnt_size);
 };
@@ -58,6 +61,13 @@ private:
   const DBC *dbc = NULL;
   std::unordered_map<uint32_t, MessageState> message_states;
 
+  void init_values();
+  void update_values(const MessageState &state);
+  #ifndef DYNAMIC_CAPNP
+  void parse_frame(uint64_t sec, const cereal::CanData::Reader &cmsg);
+  #endif
+  void update_bus_timeout(uint64_t sec, bool bus_empty);
+
 public:
   bool can_valid = false;
   bool bus_timeout = false;
@@ -65,17 +75,26 @@ public:
   uint64_t last_nonempty_sec = 0;
   uint64_t bus_timeout_threshold = 0;
 
+  // latest value of every parsed signal, refreshed in place whenever its message is parsed
+  std::vector<double> values;
+
   CANParser(int abus, const std::string& dbc_name,
             const std::vector<MessageParseOptions> &options,
             const std::vector<SignalParseOptions> &sigoptions);
   CANParser(int abus, const std::string& dbc_name, bool ignore_checksum, bool ignore_counter);
   #ifndef DYNAMIC_CAPNP
   void update_string(const std::string &data, bool sendcan);
+  static void update_string_multi(const std::vector<CANParser*> &parsers, const std::string &data, bool sendcan);
   void UpdateCans(uint64_t sec, const capnp::List<cereal::CanData>::Reader& cans);
   #endif
   void UpdateCans(uint64_t sec, const capnp::DynamicStruct::Reader& cans);
   void UpdateValid(uint64_t sec);
   std::vector<SignalValue> query_latest();
+
+  void set_history(const std::vector<SignalParseOptions> &sigoptions);
+  std::vector<SignalIndex> signal_indices();
+  std::vector<uint32_t> query_updated();
+  std::vector<SignalValue> query_history();
 };
 
 class CANPacker {
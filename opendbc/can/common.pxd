@@ -64,6 +64,11 @@ cdef extern from "common_dbc.h":
     double value
     vector[double] all_values
 
+  cdef struct SignalIndex:
+    uint32_t address
+    const char* name
+    size_t index
+
   cdef struct SignalPackValue:
     string name
     double value
@@ -77,7 +82,14 @@ cdef extern from "common.h":
     bool bus_timeout
     CANParser(int, string, vector[MessageParseOptions], vector[SignalParseOptions])
     void update_string(string, bool)
+    @staticmethod
+    void update_string_multi(vector[CANParser*], string, bool)
+    vector[double] values
     vector[SignalValue] query_latest()
+    void set_history(vector[SignalParseOptions])
+    vector[SignalIndex] signal_indices()
+    vector[uint32_t] query_updated()
+    vector[SignalValue] query_history()
 
   cdef cppclass CANPacker:
    CANPacker(string)
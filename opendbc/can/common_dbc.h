@@ -29,6 +29,12 @@ struct SignalValue {
   std::vector<double> all_values;  // all values from this cycle
 };
 
+struct SignalIndex {
+  uint32_t address;
+  const char* name;
+  size_t index;  // position of the signal in CANParser::values
+};
+
 enum SignalType {
   DEFAULT,
   HONDA_CHECKSUM,
@@ -74,7 +74,9 @@ bool MessageState::parse(uint64_t sec, const std::vector<uint8_t> &dat) {
 
     // TODO: these may get updated if the invalid or checksum gets checked later
     vals[i] = tmp * sig.factor + sig.offset;
-    all_vals[i].push_back(vals[i]);
+    if (keep_all.empty() || keep_all[i]) {
+      all_vals[i].push_back(vals[i]);
+    }
   }
   seen = sec;
 
@@ -165,6 +167,8 @@ CANParser::CANParser(int abus, const std::string& dbc_name,
       }
     }
   }
+
+  init_values();
 }
 
 CANParser::CANParser(int abus, const std::string& dbc_name, bool ignore_checksum, bool ignore_counter)
@@ -193,6 +197,21 @@ CANParser::CANParser(int abus, const std::string& dbc_name, bool ignore_checksum
 
     message_states[state.address] = state;
   }
+
+  init_values();
+}
+
+void CANParser::init_values() {
+  size_t num_values = 0;
+  for (auto& kv : message_states) {
+    kv.second.values_offset = num_values;
+    num_values += kv.second.vals.size();
+  }
+  values.assign(num_values, 0);
+}
+
+void CANParser::update_values(const MessageState &state) {
+  std::copy(state.vals.begin(), state.vals.end(), values.begin() + state.values_offset);
 }
 
 #ifndef DYNAMIC_CAPNP
@@ -216,6 +235,67 @@ void CANParser::update_string(const std::string &data, bool sendcan) {
   UpdateValid(last_sec);
 }
 
+void CANParser::update_string_multi(const std::vector<CANParser*> &parsers, const std::string &data, bool sendcan) {
+  // same as update_string on every parser, but the event is only read once
+  if (parsers.empty()) return;
+
+  kj::Array<capnp::word> &buf = parsers[0]->aligned_buf;
+  const size_t buf_size = (data.length() / sizeof(capnp::word)) + 1;
+  if (buf.size() < buf_size) {
+    buf = kj::heapArray<capnp::word>(buf_size);
+  }
+  memcpy(buf.begin(), data.data(), data.length());
+
+  capnp::FlatArrayMessageReader cmsg(buf.slice(0, buf_size));
+  cereal::Event::Reader event = cmsg.getRoot<cereal::Event>();
+
+  const uint64_t sec = event.getLogMonoTime();
+  auto cans = sendcan ? event.getSendcan() : event.getCan();
+
+  std::vector<bool> bus_empty(parsers.size(), true);
+  for (int i = 0; i < cans.size(); i++) {
+    auto cmsg = cans[i];
+    for (int j = 0; j < parsers.size(); j++) {
+      if (cmsg.getSrc() != parsers[j]->bus) continue;
+      bus_empty[j] = false;
+      parsers[j]->parse_frame(sec, cmsg);
+    }
+  }
+
+  for (int j = 0; j < parsers.size(); j++) {
+    parsers[j]->last_sec = sec;
+    parsers[j]->update_bus_timeout(sec, bus_empty[j]);
+    parsers[j]->UpdateValid(sec);
+  }
+}
+
+void CANParser::parse_frame(uint64_t sec, const cereal::CanData::Reader &cmsg) {
+  auto state_it = message_states.find(cmsg.getAddress());
+  if (state_it == message_states.end()) {
+    // DEBUG("skip %d: not specified\n", cmsg.getAddress());
+    return;
+  }
+
+  auto dat = cmsg.getDat();
+
+  if (dat.size() > 64) {
+    DEBUG("got message longer than 64 bytes: 0x%X %zu\n", cmsg.getAddress(), dat.size());
+    return;
+  }
+
+  // TODO: this actually triggers for some cars. fix and enable this
+  //if (dat.size() != state_it->second.size) {
+  //  DEBUG("got message with unexpected length: expected %d, got %zu for %d", state_it->second.size, dat.size(), cmsg.getAddress());
+  //  return;
+  //}
+
+  std::vector<uint8_t> data(dat.size(), 0);
+  memcpy(data.data(), dat.begin(), dat.size());
+  if (state_it->second.parse(sec, data)) {
+    update_values(state_it->second);
+  }
+}
+
 void CANParser::UpdateCans(uint64_t sec, const capnp::List<cereal::CanData>::Reader& cans) {
   //DEBUG("got %d messages\n", cans.size());
 
@@ -229,38 +309,19 @@ void CANParser::UpdateCans(uint64_t sec, const capnp::List<cereal::CanData>::Rea
       continue;
     }
     bus_empty = false;
-
-    auto state_it = message_states.find(cmsg.getAddress());
-    if (state_it == message_states.end()) {
-      // DEBUG("skip %d: not specified\n", cmsg.getAddress());
-      continue;
-    }
-
-    auto dat = cmsg.getDat();
-
-    if (dat.size() > 64) {
-      DEBUG("got message longer than 64 bytes: 0x%X %zu\n", cmsg.getAddress(), dat.size());
-      continue;
-    }
-
-    // TODO: this actually triggers for some cars. fix and enable this
-    //if (dat.size() != state_it->second.size) {
-    //  DEBUG("got message with unexpected length: expected %d, got %zu for %d", state_it->second.size, dat.size(), cmsg.getAddress());
-    //  continue;
-    //}
-
-    std::vector<uint8_t> data(dat.size(), 0);
-    memcpy(data.data(), dat.begin(), dat.size());
-    state_it->second.parse(sec, data);
+    parse_frame(sec, cmsg);
   }
 
-  // update bus timeout
+  update_bus_timeout(sec, bus_empty);
+}
+#endif
+
+void CANParser::update_bus_timeout(uint64_t sec, bool bus_empty) {
   if (!bus_empty) {
     last_nonempty_sec = sec;
   }
   bus_timeout = (sec - last_nonempty_sec) > bus_timeout_threshold;
 }
-#endif
 
 void CANParser::UpdateCans(uint64_t sec, const capnp::DynamicStruct::Reader& cmsg) {
   // assume message struct is `cereal::CanData` and parse
@@ -281,7 +342,9 @@ void CANParser::UpdateCans(uint64_t sec, const capnp::DynamicStruct::Reader& cms
   if (dat.size() > 64) return; // shouldn't ever happen
   std::vector<uint8_t> data(dat.size(), 0);
   memcpy(data.data(), dat.begin(), dat.size());
-  state_it->second.parse(sec, data);
+  if (state_it->second.parse(sec, data)) {
+    update_values(state_it->second);
+  }
 }
 
 void CANParser::UpdateValid(uint64_t sec) {
@@ -320,3 +383,64 @@ std::vector<SignalValue> CANParser::query_latest() {
 
   return ret;
 }
+
+void CANParser::set_history(const std::vector<SignalParseOptions> &sigoptions) {
+  for (auto& kv : message_states) {
+    auto& state = kv.second;
+    state.keep_all.assign(state.parse_sigs.size(), false);
+    for (int i = 0; i < state.parse_sigs.size(); i++) {
+      for (const auto& sigop : sigoptions) {
+        if (sigop.address == state.address && strcmp(sigop.name, state.parse_sigs[i].name) == 0) {
+          state.keep_all[i] = true;
+        }
+      }
+    }
+  }
+}
+
+std::vector<SignalIndex> CANParser::signal_indices() {
+  std::vector<SignalIndex> ret;
+  for (const auto& kv : message_states) {
+    const auto& state = kv.second;
+    for (int i = 0; i < state.parse_sigs.size(); i++) {
+      ret.push_back((SignalIndex){
+        .address = state.address,
+        .name = state.parse_sigs[i].name,
+        .index = state.values_offset + i,
+      });
+    }
+  }
+  return ret;
+}
+
+std::vector<uint32_t> CANParser::query_updated() {
+  std::vector<uint32_t> ret;
+  for (const auto& kv : message_states) {
+    if (last_sec == 0 || kv.second.seen == last_sec) {
+      ret.push_back(kv.first);
+    }
+  }
+  return ret;
+}
+
+std::vector<SignalValue> CANParser::query_history() {
+  // like query_latest, but only for the signals set with set_history
+  std::vector<SignalValue> ret;
+  for (auto& kv : message_states) {
+    auto& state = kv.second;
+    if (last_sec != 0 && state.seen != last_sec) continue;
+
+    for (int i = 0; i < state.parse_sigs.size(); i++) {
+      if (!state.keep_all.empty() && !state.keep_all[i]) continue;
+
+      ret.push_back((SignalValue){
+        .address = state.address,
+        .name = state.parse_sigs[i].name,
+        .value = state.vals[i],
+        .all_values = state.all_vals[i],
+      });
+      state.all_vals[i].clear();
+    }
+  }
+  return ret;
+}
@@ -15,9 +15,50 @@ import os
 import numbers
 from collections import defaultdict
 
+import numpy as np
+
 cdef int CAN_INVALID_CNT = 5
 
 
+cdef class SignalView:
+  """Read-only dict-like view of the signals of one message, backed by CANParser.values."""
+  cdef:
+    double *vals
+    dict index
+
+  def __getitem__(self, name):
+    return self.vals[self.index[name]]
+
+  def get(self, name, default=None):
+    i = self.index.get(name)
+    return default if i is None else self.vals[i]
+
+  def __contains__(self, name):
+    return name in self.index
+
+  def __iter__(self):
+    return iter(self.index)
+
+  def __len__(self):
+    return len(self.index)
+
+  def keys(self):
+    return self.index.keys()
+
+  def values(self):
+    return [self.vals[i] for i in self.index.values()]
+
+  def items(self):
+    return [(name, self.vals[i]) for name, i in self.index.items()]
+
+  def __copy__(self):
+    # snapshot, e.g. for copying a message to modify and send it
+    return dict(self.items())
+
+  def __repr__(self):
+    return repr(dict(self.items()))
+
+
 cdef class CANParser:
   cdef:
     cpp_CANParser *can
@@ -33,10 +74,19 @@ cdef class CANParser:
     bool bus_timeout
     string dbc_name
     int can_invalid_cnt
-
-  def __init__(self, dbc_name, signals, checks=None, bus=0, enforce_checks=True):
+    bool flat
+    dict signal_index
+    object values
+
+  def __init__(self, dbc_name, signals, checks=None, bus=0, enforce_checks=True, flat=False, history=None):
+    """With flat=True every signal value lives in the preallocated array `values`, which is
+       updated in place while parsing. vl then holds views into that array instead of dicts
+       rewritten on every update, and vl_all is only collected for the (signal, message)
+       pairs in history."""
     if checks is None:
       checks = []
+    if history is None:
+      history = []
 
     self.dbc_name = dbc_name
     self.dbc = dbc_lookup(dbc_name)
@@ -76,6 +126,8 @@ cdef class CANParser:
         c = (self.msg_name_to_address[name], c[1])
         checks[i] = c
 
+    history = [(s[0], s[1] if isinstance(s[1], numbers.Number) else self.msg_name_to_address[s[1].encode('utf8')]) for s in history]
+
     if enforce_checks:
       checked_addrs = {c[0] for c in checks}
       signal_addrs = {s[1] for s in signals}
@@ -102,8 +154,44 @@ cdef class CANParser:
       message_options_v.push_back(mpo)
 
     self.can = new cpp_CANParser(bus, dbc_name, message_options_v, signal_options_v)
+
+    self.flat = flat
+    self.signal_index = {}
+    if flat:
+      self._init_flat(history)
     self.update_vl()
 
+  cdef _init_flat(self, history):
+    cdef vector[SignalParseOptions] history_v
+    cdef SignalParseOptions spo
+    for sig_name, sig_address in history:
+      spo.address = sig_address
+      spo.name = sig_name
+      history_v.push_back(spo)
+    self.can.set_history(history_v)
+
+    cdef size_t num_values = self.can.values.size()
+    self.values = np.asarray(<double[:num_values]> self.can.values.data()) if num_values else np.zeros(0)
+
+    cdef SignalView view
+    for address in list(self.vl.keys()):
+      if isinstance(address, numbers.Number):
+        view = SignalView()
+        view.vals = self.can.values.data()
+        view.index = {}
+        self.vl[address] = view
+        self.vl[self.address_to_msg_name[address].decode('utf8')] = view
+
+    for si in self.can.signal_indices():
+      name = <unicode>si.name
+      (<SignalView>self.vl[si.address]).index[name] = si.index
+      self.signal_index[(name, si.address)] = si.index
+      self.signal_index[(name, self.address_to_msg_name[si.address].decode('utf8'))] = si.index
+
+  def handle(self, sig_name, msg):
+    """Index of a signal in values, by message name or address. Flat mode only."""
+    return self.signal_index[(sig_name, msg)]
+
   cdef unordered_set[uint32_t] update_vl(self):
     cdef unordered_set[uint32_t] updated_addrs
 
@@ -114,6 +202,14 @@ cdef class CANParser:
     self.can_valid = self.can_invalid_cnt < CAN_INVALID_CNT
     self.bus_timeout = self.can.bus_timeout
 
+    if self.flat:
+      # values are already up to date, only the history needs copying
+      for address in self.can.query_updated():
+        updated_addrs.insert(address)
+      for cv in self.can.query_history():
+        self.vl_all[cv.address][<unicode>cv.name].extend(cv.all_values)
+      return updated_addrs
+
     new_vals = self.can.query_latest()
     for cv in new_vals:
       # Cast char * directly to unicode
@@ -142,6 +238,25 @@ cdef class CANParser:
     return updated_addrs
 
 
+def update_parsers(parsers, strings, sendcan=False):
+  """Same as calling update_strings on each parser, but every packet is deserialized
+     once and its frames are routed to the parsers on their bus in one pass.
+     Returns the set of updated addresses of each parser."""
+  cdef vector[cpp_CANParser*] cans
+  cdef CANParser cp
+  for cp in parsers:
+    cans.push_back(cp.can)
+    for v in cp.vl_all.values():
+      v.clear()
+
+  updated_addrs = [set() for _ in parsers]
+  for s in strings:
+    cpp_CANParser.update_string_multi(cans, s, sendcan)
+    for cp, updated in zip(parsers, updated_addrs):
+      updated.update(cp.update_vl())
+  return updated_addrs
+
+
 cdef class CANDefine():
   cdef:
     const DBC *dbc
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+import unittest
+
+from opendbc.can.packer import CANPacker
+from opendbc.can.parser import CANParser, update_parsers
+from selfdrive.boardd.boardd import can_list_to_can_capnp
+
+DBC = "hyundai_kia_generic"
+
+SIGNALS = [
+  ("WHL_SPD_FL", "WHL_SPD11"),
+  ("WHL_SPD_FR", "WHL_SPD11"),
+  ("WHL_SPD_RL", "WHL_SPD11"),
+  ("WHL_SPD_RR", "WHL_SPD11"),
+  ("CF_Clu_Vanz", "CLU11"),
+  ("CF_Clu_CruiseSwState", "CLU11"),
+  ("TQI", "EMS16"),
+  ("ENG_STAT", "EMS16"),
+]
+
+CHECKS = [
+  ("WHL_SPD11", 50),
+  ("CLU11", 50),
+  ("EMS16", 100),
+]
+
+
+def record_stream(num_packets=200):
+  """Packs a drive's worth of can packets: two wheel speed frames per packet, a cluster
+     that drops out halfway and frames on other buses."""
+  packer = CANPacker(DBC)
+  stream = []
+  for i in range(num_packets):
+    speed = i * 0.25
+    msgs = [
+      packer.make_can_msg("EMS16", 0, {"TQI": i % 100, "ENG_STAT": i % 4}),
+      packer.make_can_msg("WHL_SPD11", 0, {"WHL_SPD_FL": speed, "WHL_SPD_FR": speed + 0.5,
+                                           "WHL_SPD_RL": speed, "WHL_SPD_RR": speed + 1.}),
+      packer.make_can_msg("WHL_SPD11", 0, {"WHL_SPD_FL": speed + 0.125, "WHL_SPD_FR": speed + 0.625,
+                                           "WHL_SPD_RL": speed + 0.125, "WHL_SPD_RR": speed + 1.125}),
+      packer.make_can_msg("EMS16", 1, {"TQI": 50, "ENG_STAT": 7}),
+    ]
+    if i < num_packets // 2 or i % 10 == 0:
+      msgs.append(packer.make_can_msg("CLU11", 0, {"CF_Clu_Vanz": speed, "CF_Clu_CruiseSwState": i % 3}))
+    stream.append(can_list_to_can_capnp(msgs))
+  return stream
+
+
+def vl_dict(vl, msg):
+  return dict(vl[msg].items())
+
+
+def vl_all_dict(vl_all, msg):
+  return {sig: list(vals) for sig, vals in vl_all[msg].items() if len(vals)}
+
+
+class TestCanParserFlat(unittest.TestCase):
+  def test_flat_matches_dicts(self):
+    parser = CANParser(DBC, list(SIGNALS), list(CHECKS), 0)
+    flat = CANParser(DBC, list(SIGNALS), list(CHECKS), 0, flat=True, history=list(SIGNALS))
+    msgs = {m for _, m in SIGNALS}
+
+    for i, s in enumerate(record_stream()):
+      updated = parser.update_strings([s])
+      self.assertEqual(flat.update_strings([s]), updated, f"packet {i}")
+
+      for msg in msgs:
+        self.assertEqual(vl_all_dict(flat.vl_all, msg), vl_all_dict(parser.vl_all, msg), f"packet {i} {msg}")
+        if len(parser.vl[msg]):
+          self.assertEqual(vl_dict(flat.vl, msg), vl_dict(parser.vl, msg), f"packet {i} {msg}")
+
+      self.assertEqual(flat.can_valid, parser.can_valid)
+      self.assertEqual(flat.bus_timeout, parser.bus_timeout)
+
+  def test_flat_values(self):
+    flat = CANParser(DBC, list(SIGNALS), list(CHECKS), 0, flat=True)
+    stream = record_stream(10)
+    flat.update_strings(stream)
+
+    # vl reads through to values, vl_all is only kept for signals in history
+    idx = flat.handle("WHL_SPD_RR", "WHL_SPD11")
+    self.assertEqual(flat.values[idx], flat.vl["WHL_SPD11"]["WHL_SPD_RR"])
+    self.assertEqual(flat.vl["WHL_SPD11"]["WHL_SPD_RR"], 9 * 0.25 + 1.125)
+    self.assertEqual(vl_all_dict(flat.vl_all, "WHL_SPD11"), {})
+
+
+class TestUpdateParsers(unittest.TestCase):
+  @staticmethod
+  def _parsers():
+    return [
+      CANParser(DBC, list(SIGNALS), list(CHECKS), 0),
+      CANParser(DBC, [("TQI", "EMS16"), ("ENG_STAT", "EMS16")], [("EMS16", 100)], 1),
+      CANParser(DBC, list(SIGNALS), list(CHECKS), 0, flat=True, history=list(SIGNALS[:2])),
+      CANParser(DBC, [("CF_Clu_Vanz", "CLU11")], [("CLU11", 50)], 2),
+    ]
+
+  def test_matches_update_strings(self):
+    multi, single = self._parsers(), self._parsers()
+    stream = record_stream()
+
+    # a few packets per update, like a drained can socket
+    for i in range(0, len(stream), 3):
+      strings = stream[i:i + 3]
+      updated = update_parsers(multi, strings)
+      for j, (pm, ps) in enumerate(zip(multi, single)):
+        msg = f"packets {i}-{i + len(strings)}, parser {j}"
+        self.assertEqual(updated[j], ps.update_strings(strings), msg)
+        for name in {m for _, m in SIGNALS}:
+          self.assertEqual(vl_dict(pm.vl, name), vl_dict(ps.vl, name), msg)
+          self.assertEqual(vl_all_dict(pm.vl_all, name), vl_all_dict(ps.vl_all, name), msg)
+        self.assertEqual(pm.can_valid, ps.can_valid, msg)
+        self.assertEqual(pm.bus_timeout, ps.bus_timeout, msg)
+
+    # the bus 1 parser saw its message in every packet, the bus 2 parser never did
+    self.assertTrue(multi[1].can_valid)
+    self.assertFalse(multi[3].can_valid)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -25,73 +25,102 @@ CANPACKET_HEAD_SIZE = 0x5
 DLC_TO_LEN = [0, 1, 2, 3, 4, 5, 6, 7, 8, 12, 16, 20, 24, 32, 48, 64]
 LEN_TO_DLC = {length: dlc for (dlc, length) in enumerate(DLC_TO_LEN)}
 
+CAN_HEADER = struct.Struct("<BI")
+USB_CHUNK_SIZE = 256  # CAN packets are sent in chunks of just over this many bytes
+
+def _add_usb_counters(raw):
+  # 64 byte USB packets, each starting with a counter byte
+  tx = bytearray(len(raw) + (len(raw) + 62) // 63)
+  for counter, i in enumerate(range(0, len(raw), 63)):
+    tx[counter * 64] = counter
+    tx[counter * 64 + 1:counter * 64 + 64] = raw[i:i + 63]
+  return tx
+
 def pack_can_buffer(arr):
-  snds = [b'']
-  idx = 0
+  snds = []
+  parts = []
+  size = 0
+  pack = CAN_HEADER.pack
   for address, _, dat, bus in arr:
-    assert len(dat) in LEN_TO_DLC
+    data_len_code = LEN_TO_DLC.get(len(dat))
+    assert data_len_code is not None
     if DEBUG:
       print(f"  W 0x{address:x}: 0x{dat.hex()}")
     extended = 1 if address >= 0x800 else 0
-    data_len_code = LEN_TO_DLC[len(dat)]
-    header = bytearray(5)
-    word_4b = address << 3 | extended << 2
-    header[0] = (data_len_code << 4) | (bus << 1)
-    header[1] = word_4b & 0xFF
-    header[2] = (word_4b >> 8) & 0xFF
-    header[3] = (word_4b >> 16) & 0xFF
-    header[4] = (word_4b >> 24) & 0xFF
-    snds[idx] += header + dat
-    if len(snds[idx]) > 256: # Limit chunks to 256 bytes
-      snds.append(b'')
-      idx += 1
-
-  #Apply counter to each 64 byte packet
-  for idx in range(len(snds)):
-    tx = b''
-    counter = 0
-    for i in range (0, len(snds[idx]), 63):
-      tx += bytes([counter]) + snds[idx][i:i+63]
-      counter += 1
-    snds[idx] = tx
+    parts.append(pack((data_len_code << 4) | (bus << 1), (address << 3 | extended << 2) & 0xFFFFFFFF))
+    parts.append(dat)
+    size += CANPACKET_HEAD_SIZE + len(dat)
+    if size > USB_CHUNK_SIZE:
+      snds.append(_add_usb_counters(b"".join(parts)))
+      parts = []
+      size = 0
+  snds.append(_add_usb_counters(b"".join(parts)))
   return snds
 
+def _strip_usb_counters(dat):
+  # CAN packets span USB packets, stop at the first lost USB packet
+  dat = memoryview(dat)
+  n = (len(dat) + 63) // 64
+  counters = bytes(dat[::64])
+  expected = bytes(range(min(n, 256)))
+  valid = min(n, 256)
+  if counters[:valid] != expected:
+    valid = next(i for i in range(valid) if counters[i] != i)
+  if valid < n:
+    print("CAN: LOST RECV PACKET COUNTER")
+  return b"".join([dat[i:i + 63] for i in range(1, valid * 64, 64)])
+
+def _can_packet_starts(buf):
+  # offsets of every complete CAN packet in buf
+  starts = []
+  pos = 0
+  end = len(buf) - CANPACKET_HEAD_SIZE
+  while pos <= end:
+    nxt = pos + CANPACKET_HEAD_SIZE + DLC_TO_LEN[buf[pos] >> 4]
+    if nxt > end + CANPACKET_HEAD_SIZE:
+      break
+    starts.append(pos)
+    pos = nxt
+  return starts
+
 def unpack_can_buffer(dat):
+  buf = bytearray(_strip_usb_counters(dat))
   ret = []
-  counter = 0
-  tail = bytearray()
-  for i in range(0, len(dat), 64):
-    if counter != dat[i]:
-      print("CAN: LOST RECV PACKET COUNTER")
-      break
-    counter+=1
-    chunk = tail + dat[i+1:i+64]
-    tail = bytearray()
-    pos = 0
-    while pos<len(chunk):
-      data_len = DLC_TO_LEN[(chunk[pos]>>4)]
-      pckt_len = CANPACKET_HEAD_SIZE + data_len
-      if pckt_len <= len(chunk[pos:]):
-        header = chunk[pos:pos+CANPACKET_HEAD_SIZE]
-        if len(header) < 5:
-          print("CAN: MALFORMED USB RECV PACKET")
-          break
-        bus = (header[0] >> 1) & 0x7
-        address = (header[4] << 24 | header[3] << 16 | header[2] << 8 | header[1]) >> 3
-        returned = (header[1] >> 1) & 0x1
-        rejected = header[1] & 0x1
-        data = chunk[pos + CANPACKET_HEAD_SIZE:pos + CANPACKET_HEAD_SIZE + data_len]
-        if returned:
-          bus += 128
-        if rejected:
-          bus += 192
-        if DEBUG:
-          print(f"  R 0x{address:x}: 0x{data.hex()}")
-        ret.append((address, 0, data, bus))
-        pos += pckt_len
-      else:
-        tail = chunk[pos:]
-        break
+  unpack_from = CAN_HEADER.unpack_from
+  for pos in _can_packet_starts(buf):
+    head, word = unpack_from(buf, pos)
+    bus = (head >> 1) & 0x7
+    if word & 0x2:  # returned
+      bus += 128
+    if word & 0x1:  # rejected
+      bus += 192
+    data = buf[pos + CANPACKET_HEAD_SIZE:pos + CANPACKET_HEAD_SIZE + DLC_TO_LEN[head >> 4]]
+    if DEBUG:
+      print(f"  R 0x{word >> 3:x}: 0x{data.hex()}")
+    ret.append((word >> 3, 0, data, bus))
+  return ret
+
+CAN_PACKET_DTYPE = [('address', '<u4'), ('bus', '<u2'), ('len', 'u1'), ('data', 'u1', (64,))]
+
+def unpack_can_buffer_array(dat):
+  """Like unpack_can_buffer, as a numpy structured array of address, bus, len and data."""
+  import numpy as np  # pylint: disable=import-outside-toplevel
+  buf = _strip_usb_counters(dat)
+  starts = np.array(_can_packet_starts(buf), dtype=np.int64)
+  raw = np.frombuffer(buf, dtype=np.uint8)
+
+  ret = np.zeros(len(starts), dtype=CAN_PACKET_DTYPE)
+  head = raw[starts]
+  word = np.zeros(len(starts), dtype=np.uint32)
+  for i in range(4):
+    word |= raw[starts + 1 + i].astype(np.uint32) << (8 * i)
+  ret['address'] = word >> 3
+  ret['len'] = np.array(DLC_TO_LEN, dtype=np.uint8)[head >> 4]
+  ret['bus'] = ((head >> 1) & 0x7) + np.where(word & 0x2, 128, 0) + np.where(word & 0x1, 192, 0)
+
+  # gather the data bytes of all packets at once, bytes past their length stay 0
+  mask = np.arange(64) < ret['len'][:, None]
+  ret['data'][mask] = raw[(starts[:, None] + CANPACKET_HEAD_SIZE + np.arange(64))[mask]]
   return ret
 
 def ensure_health_packet_version(fn):
@@ -1222,6 +1222,52 @@ class AcadosOcpSolver:
         return out
 
 
+    def get_all(self, field_, out=None):
+        """
+        Get the last solution of the solver at all stages in one call:
+
+            :param field: string in ['x', 'u', 'z', 'pi', 'lam', 't', 'sl', 'su',]
+            :param out: optional C-contiguous float64 array, row i is filled with stage i.
+                        Defaults to a new array over all stages the field exists at.
+        """
+        out_fields = ['x', 'u', 'z', 'pi', 'lam', 't', 'sl', 'su']
+
+        if field_ not in out_fields:
+            raise Exception('AcadosOcpSolver.get_all(): {} is an invalid argument.\
+                    \n Possible values are {}. Exiting.'.format(field_, out_fields))
+
+        field = field_.encode('utf-8')
+
+        self.shared_lib.ocp_nlp_dims_get_from_attr.argtypes = \
+            [c_void_p, c_void_p, c_void_p, c_int, c_char_p]
+        self.shared_lib.ocp_nlp_dims_get_from_attr.restype = c_int
+        self.shared_lib.ocp_nlp_out_get.argtypes = \
+            [c_void_p, c_void_p, c_void_p, c_int, c_char_p, c_void_p]
+
+        n_stages = self.N if field_ in ['u', 'pi'] else self.N + 1
+        if out is None:
+            out = np.zeros((n_stages, self.shared_lib.ocp_nlp_dims_get_from_attr(self.nlp_config, \
+                self.nlp_dims, self.nlp_out, 0, field)))
+
+        if out.dtype != np.float64 or out.ndim != 2 or not out.flags['C_CONTIGUOUS']:
+            raise Exception('AcadosOcpSolver.get_all(): out must be a C-contiguous 2D float64 array.')
+
+        if out.shape[0] > n_stages:
+            raise Exception('AcadosOcpSolver.get_all(): field {} exists at {} stages, got {} rows.'\
+                .format(field_, n_stages, out.shape[0]))
+
+        for stage in range(out.shape[0]):
+            dims = self.shared_lib.ocp_nlp_dims_get_from_attr(self.nlp_config, \
+                self.nlp_dims, self.nlp_out, stage, field)
+            if dims != out.shape[1]:
+                raise Exception('AcadosOcpSolver.get_all(): mismatching dimension for field "{}" '.format(field_) +
+                    'at stage {} with dimension {} (you have {})'.format(stage, dims, out.shape[1]))
+            self.shared_lib.ocp_nlp_out_get(self.nlp_config, \
+                self.nlp_dims, self.nlp_out, stage, field, out.ctypes.data + stage * out.strides[0])
+
+        return out
+
+
     def print_statistics(self):
         """
         prints statistics of previous solver run as a table:
@@ -1556,6 +1602,60 @@ class AcadosOcpSolver:
         return
 
 
+    def set_all(self, field_, value_):
+        """
+        Set numerical data inside the solver at the stages 0 to len(value)-1 in one call.
+
+            :param field: string in ['x', 'u', 'pi', 'lam', 't', 'z', 'sl', 'su', 'p', 'yref', 'lbx', 'ubx', 'lbu', 'ubu']
+            :param value: 2D array, row i is the value at stage i
+        """
+        cost_fields = ['y_ref', 'yref']
+        constraints_fields = ['lbx', 'ubx', 'lbu', 'ubu']
+        out_fields = ['x', 'u', 'pi', 'lam', 't', 'z', 'sl', 'su']
+
+        if field_ not in constraints_fields + cost_fields + out_fields + ['p']:
+            raise Exception("AcadosOcpSolver.set_all(): {} is not a valid argument.\
+                \nPossible values are {}. Exiting.".format(field_, \
+                constraints_fields + cost_fields + out_fields + ['p']))
+
+        value_ = np.ascontiguousarray(value_, dtype=np.float64)
+        if value_.ndim != 2 or value_.shape[0] > self.N + 1:
+            raise Exception('AcadosOcpSolver.set_all(): expected at most N+1 = {} rows, got shape {}.'.format(self.N + 1, value_.shape))
+
+        field = field_.encode('utf-8')
+        row_stride = value_.strides[0]
+
+        if field_ == 'p':
+            update_params = getattr(self.shared_lib, f"{self.model_name}_acados_update_params")
+            update_params.argtypes = [c_void_p, c_int, c_void_p, c_int]
+            update_params.restype = c_int
+            for stage in range(value_.shape[0]):
+                if update_params(self.capsule, stage, value_.ctypes.data + stage * row_stride, value_.shape[1]) != 0:
+                    raise Exception('AcadosOcpSolver.set_all(): updating parameters at stage {} failed.'.format(stage))
+            return
+
+        self.shared_lib.ocp_nlp_dims_get_from_attr.argtypes = \
+            [c_void_p, c_void_p, c_void_p, c_int, c_char_p]
+        self.shared_lib.ocp_nlp_dims_get_from_attr.restype = c_int
+
+        if field_ in constraints_fields:
+            setter, target = self.shared_lib.ocp_nlp_constraints_model_set, self.nlp_in
+        elif field_ in cost_fields:
+            setter, target = self.shared_lib.ocp_nlp_cost_model_set, self.nlp_in
+        else:
+            setter, target = self.shared_lib.ocp_nlp_out_set, self.nlp_out
+        setter.argtypes = [c_void_p, c_void_p, c_void_p, c_int, c_char_p, c_void_p]
+
+        for stage in range(value_.shape[0]):
+            dims = self.shared_lib.ocp_nlp_dims_get_from_attr(self.nlp_config, \
+                self.nlp_dims, self.nlp_out, stage, field)
+            if dims != value_.shape[1]:
+                msg = 'AcadosOcpSolver.set_all(): mismatching dimension for field "{}" '.format(field_)
+                msg += 'at stage {} with dimension {} (you have {})'.format(stage, dims, value_.shape[1])
+                raise Exception(msg)
+            setter(self.nlp_config, self.nlp_dims, target, stage, field, value_.ctypes.data + stage * row_stride)
+
+
     def cost_set(self, stage_, field_, value_, api='warn'):
         """
         Set numerical data in the cost module of the solver.
@@ -1693,6 +1793,39 @@ class AcadosOcpSolver:
         return
 
 
+    def constraints_set_all(self, field_, value_):
+        """
+        Set a vector valued field of the constraint module at the stages 0 to len(value)-1 in one call.
+
+            :param field: string in ['lbx', 'ubx', 'lbu', 'ubu', 'lg', 'ug', 'lh', 'uh', 'uphi']
+            :param value: 2D array, row i is the value at stage i
+        """
+        value_ = np.ascontiguousarray(value_, dtype=np.float64)
+        if value_.ndim != 2 or value_.shape[0] > self.N + 1:
+            raise Exception('AcadosOcpSolver.constraints_set_all(): expected at most N+1 = {} rows, got shape {}.'.format(self.N + 1, value_.shape))
+
+        field = field_.encode('utf-8')
+
+        self.shared_lib.ocp_nlp_constraint_dims_get_from_attr.argtypes = \
+            [c_void_p, c_void_p, c_void_p, c_int, c_char_p, POINTER(c_int)]
+        self.shared_lib.ocp_nlp_constraint_dims_get_from_attr.restype = c_int
+        self.shared_lib.ocp_nlp_constraints_model_set.argtypes = \
+            [c_void_p, c_void_p, c_void_p, c_int, c_char_p, c_void_p]
+
+        dims = np.zeros((2,), dtype=np.intc)
+        dims_data = cast(dims.ctypes.data, POINTER(c_int))
+
+        for stage in range(value_.shape[0]):
+            self.shared_lib.ocp_nlp_constraint_dims_get_from_attr(self.nlp_config, \
+                self.nlp_dims, self.nlp_out, stage, field, dims_data)
+            if dims[0] != value_.shape[1] or dims[1] != 0:
+                raise Exception(f'AcadosOcpSolver.constraints_set_all(): mismatching dimension' +
+                    f' for field "{field_}" at stage {stage} with dimension {tuple(dims)} (you have {(value_.shape[1], 0)})')
+
+            self.shared_lib.ocp_nlp_constraints_model_set(self.nlp_config, \
+                self.nlp_dims, self.nlp_in, stage, field, value_.ctypes.data + stage * value_.strides[0])
+
+
     def dynamics_get(self, stage_, field_):
         """
         Get numerical data from the dynamics module of the solver:
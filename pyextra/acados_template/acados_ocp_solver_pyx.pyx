@@ -272,6 +272,45 @@ cdef class AcadosOcpSolverCython:
         return out
 
 
+    def get_all(self, str field_, out=None):
+        """
+        Get the last solution of the solver at all stages in one call:
+
+            :param field: string in ['x', 'u', 'z', 'pi', 'lam', 't', 'sl', 'su',]
+            :param out: optional C-contiguous float64 array, row i is filled with stage i.
+                        Defaults to a new array over all stages the field exists at.
+        """
+
+        out_fields = ['x', 'u', 'z', 'pi', 'lam', 't', 'sl', 'su']
+        field = field_.encode('utf-8')
+
+        if field_ not in out_fields:
+            raise Exception('AcadosOcpSolverCython.get_all(): {} is an invalid argument.\
+                    \n Possible values are {}. Exiting.'.format(field_, out_fields))
+
+        n_stages = self.N if field_ in ['u', 'pi'] else self.N + 1
+        if out is None:
+            out = np.zeros((n_stages, acados_solver_common.ocp_nlp_dims_get_from_attr(self.nlp_config,
+                self.nlp_dims, self.nlp_out, 0, field)))
+
+        cdef double[:, ::1] value = out
+        if value.shape[0] > n_stages:
+            raise Exception('AcadosOcpSolverCython.get_all(): field {} exists at {} stages, got {} rows.'\
+                .format(field_, n_stages, value.shape[0]))
+
+        cdef int stage, dims
+        for stage in range(value.shape[0]):
+            dims = acados_solver_common.ocp_nlp_dims_get_from_attr(self.nlp_config,
+                self.nlp_dims, self.nlp_out, stage, field)
+            if dims != value.shape[1]:
+                raise Exception('AcadosOcpSolverCython.get_all(): mismatching dimension for field "{}" '.format(field_) +
+                    'at stage {} with dimension {} (you have {})'.format(stage, dims, value.shape[1]))
+            acados_solver_common.ocp_nlp_out_get(self.nlp_config, \
+                self.nlp_dims, self.nlp_out, stage, field, <void *> &value[stage, 0])
+
+        return out
+
+
     def print_statistics(self):
         """
         prints statistics of previous solver run as a table:
@@ -548,6 +587,53 @@ cdef class AcadosOcpSolverCython:
                     self.nlp_solver, stage, field, <void *> value.data)
 
 
+    def set_all(self, str field_, value_):
+        """
+        Set numerical data inside the solver at the stages 0 to len(value)-1 in one call.
+
+            :param field: string in ['x', 'u', 'pi', 'lam', 't', 'z', 'sl', 'su', 'p', 'yref', 'lbx', 'ubx', 'lbu', 'ubu']
+            :param value: 2D array, row i is the value at stage i
+        """
+        cost_fields = ['y_ref', 'yref']
+        constraints_fields = ['lbx', 'ubx', 'lbu', 'ubu']
+        out_fields = ['x', 'u', 'pi', 'lam', 't', 'z', 'sl', 'su']
+
+        if field_ not in constraints_fields + cost_fields + out_fields + ['p']:
+            raise Exception("AcadosOcpSolverCython.set_all(): {} is not a valid argument.\
+                \nPossible values are {}. Exiting.".format(field_, \
+                constraints_fields + cost_fields + out_fields + ['p']))
+
+        field = field_.encode('utf-8')
+
+        cdef double[:, ::1] value = np.ascontiguousarray(value_, dtype=np.float64)
+        if value.shape[0] > self.N + 1:
+            raise Exception('AcadosOcpSolverCython.set_all(): got {} stages, N is {}.'.format(value.shape[0], self.N))
+
+        cdef int stage, dims
+        for stage in range(value.shape[0]):
+            if field_ == 'p':
+                if acados_solver.acados_update_params(self.capsule, stage, &value[stage, 0], value.shape[1]) != 0:
+                    raise Exception('AcadosOcpSolverCython.set_all(): updating parameters at stage {} failed.'.format(stage))
+                continue
+
+            dims = acados_solver_common.ocp_nlp_dims_get_from_attr(self.nlp_config,
+                self.nlp_dims, self.nlp_out, stage, field)
+            if dims != value.shape[1]:
+                msg = 'AcadosOcpSolverCython.set_all(): mismatching dimension for field "{}" '.format(field_)
+                msg += 'at stage {} with dimension {} (you have {})'.format(stage, dims, value.shape[1])
+                raise Exception(msg)
+
+            if field_ in constraints_fields:
+                acados_solver_common.ocp_nlp_constraints_model_set(self.nlp_config,
+                    self.nlp_dims, self.nlp_in, stage, field, <void *> &value[stage, 0])
+            elif field_ in cost_fields:
+                acados_solver_common.ocp_nlp_cost_model_set(self.nlp_config,
+                    self.nlp_dims, self.nlp_in, stage, field, <void *> &value[stage, 0])
+            else:
+                acados_solver_common.ocp_nlp_out_set(self.nlp_config,
+                    self.nlp_dims, self.nlp_out, stage, field, <void *> &value[stage, 0])
+
+
     def cost_set(self, int stage, str field_, value_):
         """
         Set numerical data in the cost module of the solver.
@@ -616,6 +702,32 @@ cdef class AcadosOcpSolverCython:
         return
 
 
+    def constraints_set_all(self, str field_, value_):
+        """
+        Set a vector valued field of the constraint module at the stages 0 to len(value)-1 in one call.
+
+            :param field: string in ['lbx', 'ubx', 'lbu', 'ubu', 'lg', 'ug', 'lh', 'uh', 'uphi']
+            :param value: 2D array, row i is the value at stage i
+        """
+        field = field_.encode('utf-8')
+
+        cdef double[:, ::1] value = np.ascontiguousarray(value_, dtype=np.float64)
+        if value.shape[0] > self.N + 1:
+            raise Exception('AcadosOcpSolverCython.constraints_set_all(): got {} stages, N is {}.'.format(value.shape[0], self.N))
+
+        cdef int dims[2]
+        cdef int stage
+        for stage in range(value.shape[0]):
+            acados_solver_common.ocp_nlp_constraint_dims_get_from_attr(self.nlp_config, \
+                self.nlp_dims, self.nlp_out, stage, field, &dims[0])
+            if dims[0] != value.shape[1] or dims[1] != 0:
+                raise Exception(f'AcadosOcpSolverCython.constraints_set_all(): mismatching dimension' +
+                    f' for field "{field_}" at stage {stage} with dimension {tuple(dims)} (you have {(value.shape[1], 0)})')
+
+            acados_solver_common.ocp_nlp_constraints_model_set(self.nlp_config, \
+                self.nlp_dims, self.nlp_in, stage, field, <void *> &value[stage, 0])
+
+
     def dynamics_get(self, int stage, str field_):
         """
         Get numerical data from the dynamics module of the solver:
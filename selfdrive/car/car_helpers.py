@@ -4,8 +4,10 @@ from typing import Any, Dict, List
 from common.params import Params
 from common.basedir import BASEDIR
 from selfdrive.car.fingerprints import eliminate_incompatible_cars, all_legacy_fingerprint_cars
-from selfdrive.car.vin import get_vin, VIN_UNKNOWN
-from selfdrive.car.fw_versions import get_fw_versions, match_fw_to_car
+from selfdrive.car.vin import get_vin, vin_query, vin_from_query, VIN_UNKNOWN
+from selfdrive.car.fw_versions import fw_queries, build_car_fw, match_fw_to_car
+from selfdrive.car.isotp_parallel_query import IsoTpQueryEngine
+from selfdrive.car.registry import Interfaces, interface_names as registry_interface_names
 from selfdrive.swaglog import cloudlog
 import cereal.messaging as messaging
 from selfdrive.car import gen_empty_fingerprint
@@ -71,17 +73,12 @@ def get_interface_attr(attr: str) -> Dict[str, Any]:
 
 def _get_interface_names() -> Dict[str, List[str]]:
   # returns a dict of brand name and its respective models
-  brand_names = {}
-  for brand_name, model_names in get_interface_attr("CAR").items():
-    model_names = [getattr(model_names, c) for c in model_names.__dict__.keys() if not c.startswith("__")]
-    brand_names[brand_name] = model_names
-
-  return brand_names
+  return registry_interface_names()
 
 
-# imports from directory selfdrive/car/<name>/
+# brands in selfdrive/car/<name>/, their interfaces are only imported when looked up
 interface_names = _get_interface_names()
-interfaces = load_interfaces(interface_names)
+interfaces = Interfaces()
 
 
 # **** for use live only ****
@@ -105,8 +102,17 @@ def fingerprint(logcan, sendcan):
       car_fw = list(cached_params.carFw)
     else:
       cloudlog.warning("Getting VIN & FW versions")
-      _, vin = get_vin(logcan, sendcan, bus)
-      car_fw = get_fw_versions(logcan, sendcan)
+      # VIN and FW queries share one engine, the FW queries on other buses run while the VIN is read
+      engine = IsoTpQueryEngine(sendcan, logcan)
+      query = vin_query(engine, bus)
+      queries, ecu_types = fw_queries(engine)
+      try:
+        engine.run()
+      except Exception:
+        cloudlog.exception("VIN & FW query exception")
+      ret = vin_from_query(query)
+      _, vin = ret if ret is not None else get_vin(logcan, sendcan, bus)
+      car_fw = build_car_fw(queries, ecu_types)
 
     exact_fw_match, fw_candidates = match_fw_to_car(car_fw)
   else:
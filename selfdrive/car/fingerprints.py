@@ -1,5 +1,6 @@
 import os
 from common.basedir import BASEDIR
+from selfdrive.car.registry import car_registry
 
 
 def get_attr_from_cars(attr, result=dict, combine_brands=True):
@@ -34,8 +35,8 @@ def get_attr_from_cars(attr, result=dict, combine_brands=True):
   return result
 
 
-FW_VERSIONS = get_attr_from_cars('FW_VERSIONS')
-_FINGERPRINTS = get_attr_from_cars('FINGERPRINTS')
+FW_VERSIONS = car_registry()['FW_VERSIONS']
+_FINGERPRINTS = car_registry()['FINGERPRINTS']
 
 _DEBUG_ADDRESS = {1880: 8}   # reserved for debug purposes
 
@@ -9,8 +9,9 @@ from tqdm import tqdm
 
 import panda.python.uds as uds
 from cereal import car
-from selfdrive.car.fingerprints import FW_VERSIONS, get_attr_from_cars
-from selfdrive.car.isotp_parallel_query import IsoTpParallelQuery
+from selfdrive.car.fingerprints import FW_VERSIONS
+from selfdrive.car.registry import car_registry
+from selfdrive.car.isotp_parallel_query import IsoTpQueryEngine
 from selfdrive.swaglog import cloudlog
 
 Ecu = car.CarParams.Ecu
@@ -198,42 +199,102 @@ def build_fw_dict(fw_versions):
   return fw_versions_dict
 
 
+# These ECUs are known to be shared between models (EPS only between hybrid/ICE version)
+# Getting this exactly right isn't crucial, but excluding camera and radar makes it almost
+# impossible to get 3 matching versions, even if two models with shared parts are released at the same
+# time and only one is in our database.
+FUZZY_EXCLUDE_ECUS = [Ecu.fwdCamera, Ecu.fwdRadar, Ecu.eps, Ecu.debug]
+ESSENTIAL_ECUS = [Ecu.engine, Ecu.eps, Ecu.esp, Ecu.fwdRadar, Ecu.fwdCamera, Ecu.vsa]
+
+
+class FwIndex:
+  """Inverted index over a FW_VERSIONS table. Sets of candidates are int bitsets
+  (bit i is candidates[i]), so matching is a few ORs and ANDs per queried ECU."""
+  def __init__(self, fw_versions):
+    self.candidates = list(fw_versions.keys())
+    self.bit = {c: 1 << i for i, c in enumerate(self.candidates)}
+    self.all = (1 << len(self.candidates)) - 1
+
+    # exact: per (ecu, addr, subaddr) the candidates listing it, the essential ones among
+    # them and per FW version the candidates that accept it
+    self.ecus = defaultdict(int)
+    self.essential = defaultdict(int)
+    self.versions = defaultdict(int)
+    # fuzzy: (addr, subaddr, fw) -> candidates, without the shared ECU types. Candidates
+    # listing a version more than once never match it uniquely
+    self.fuzzy = defaultdict(int)
+    self.fuzzy_dup = defaultdict(int)
+
+    for c, fws in fw_versions.items():
+      bit = self.bit[c]
+      for ecu, expected_versions in fws.items():
+        ecu_type, addr = ecu[0], ecu[1:]
+        if ecu_type not in FUZZY_EXCLUDE_ECUS:
+          for f in expected_versions:
+            self.fuzzy_dup[addr + (f,)] |= self.fuzzy[addr + (f,)] & bit
+            self.fuzzy[addr + (f,)] |= bit
+
+        # Virtual debug ecu doesn't need to match the database
+        if ecu_type == Ecu.debug:
+          continue
+        self.ecus[ecu] |= bit
+        if ecu_type in ESSENTIAL_ECUS:
+          self.essential[ecu] |= bit
+        for f in expected_versions:
+          self.versions[ecu + (f,)] |= bit
+
+  def to_set(self, bits):
+    ret = set()
+    while bits:
+      low = bits & -bits
+      ret.add(self.candidates[low.bit_length() - 1])
+      bits ^= low
+    return ret
+
+  def match_exact(self, fw_versions_dict):
+    invalid = 0
+    for ecu, cands in self.ecus.items():
+      found_version = fw_versions_dict.get(ecu[1:], None)
+      if found_version is None:
+        # Ignore non essential ecus
+        invalid |= self.essential[ecu]
+      else:
+        invalid |= cands & ~self.versions.get(ecu + (found_version,), 0)
+    return self.to_set(self.all & ~invalid)
+
+  def match_fuzzy(self, fw_versions_dict, exclude=None):
+    """Returns (candidate, number of uniquely matched ECUs), candidate is None when
+    ECUs uniquely matched different cars."""
+    mask = self.all & ~self.bit.get(exclude, 0)
+    match_count = 0
+    candidate = 0
+    for addr, version in fw_versions_dict.items():
+      # All cars that have this FW response on the specified address
+      cands = self.fuzzy.get(addr + (version,), 0) & mask
+      if cands and not cands & (cands - 1) and not cands & self.fuzzy_dup.get(addr + (version,), 0):
+        match_count += 1
+        if not candidate:
+          candidate = cands
+        # We uniquely matched two different cars. No fuzzy match possible
+        elif candidate != cands:
+          return None, 0
+    return (self.to_set(candidate).pop() if candidate else None), match_count
+
+
+_fw_index = None
+
+def get_fw_index():
+  global _fw_index
+  if _fw_index is None:
+    _fw_index = FwIndex(FW_VERSIONS)
+  return _fw_index
+
+
 def match_fw_to_car_fuzzy(fw_versions_dict, log=True, exclude=None):
   """Do a fuzzy FW match. This function will return a match, and the number of firmware version
   that were matched uniquely to that specific car. If multiple ECUs uniquely match to different cars
   the match is rejected."""
-
-  # These ECUs are known to be shared between models (EPS only between hybrid/ICE version)
-  # Getting this exactly right isn't crucial, but excluding camera and radar makes it almost
-  # impossible to get 3 matching versions, even if two models with shared parts are released at the same
-  # time and only one is in our database.
-  exclude_types = [Ecu.fwdCamera, Ecu.fwdRadar, Ecu.eps, Ecu.debug]
-
-  # Build lookup table from (addr, subaddr, fw) to list of candidate cars
-  all_fw_versions = defaultdict(list)
-  for candidate, fw_by_addr in FW_VERSIONS.items():
-    if candidate == exclude:
-      continue
-
-    for addr, fws in fw_by_addr.items():
-      if addr[0] in exclude_types:
-        continue
-      for f in fws:
-        all_fw_versions[(addr[1], addr[2], f)].append(candidate)
-
-  match_count = 0
-  candidate = None
-  for addr, version in fw_versions_dict.items():
-    # All cars that have this FW response on the specified address
-    candidates = all_fw_versions[(addr[0], addr[1], version)]
-
-    if len(candidates) == 1:
-      match_count += 1
-      if candidate is None:
-        candidate = candidates[0]
-      # We uniquely matched two different cars. No fuzzy match possible
-      elif candidate != candidates[0]:
-        return set()
+  candidate, match_count = get_fw_index().match_fuzzy(fw_versions_dict, exclude)
 
   if match_count >= 2:
     if log:
@@ -248,44 +309,20 @@ def match_fw_to_car_exact(fw_versions_dict):
   FW versions for a list of "essential" ECUs. If an ECU is not considered
   essential the FW version can be missing to get a fingerprint, but if it's present it
   needs to match the database."""
-  invalid = []
-  candidates = FW_VERSIONS
-
-  for candidate, fws in candidates.items():
-    for ecu, expected_versions in fws.items():
-      ecu_type = ecu[0]
-      addr = ecu[1:]
-      found_version = fw_versions_dict.get(addr, None)
-      ESSENTIAL_ECUS = [Ecu.engine, Ecu.eps, Ecu.esp, Ecu.fwdRadar, Ecu.fwdCamera, Ecu.vsa]
-      #if ecu_type == Ecu.esp and candidate in [TOYOTA.RAV4, TOYOTA.COROLLA, TOYOTA.HIGHLANDER] and found_version is None:
-      #  continue
-
-      # On some Toyota models, the engine can show on two different addresses
-      #if ecu_type == Ecu.engine and candidate in [TOYOTA.CAMRY, TOYOTA.COROLLA_TSS2, TOYOTA.CHR, TOYOTA.LEXUS_IS] and found_version is None:
-      #  continue
-
-      # Ignore non essential ecus
-      if ecu_type not in ESSENTIAL_ECUS and found_version is None:
-        continue
-
-      # Virtual debug ecu doesn't need to match the database
-      if ecu_type == Ecu.debug:
-        continue
-
-      if found_version not in expected_versions:
-        invalid.append(candidate)
-        break
-
-  return set(candidates.keys()) - set(invalid)
+  return get_fw_index().match_exact(fw_versions_dict)
 
 
 def match_fw_to_car(fw_versions, allow_fuzzy=True):
   fw_versions_dict = build_fw_dict(fw_versions)
+  return match_fw_dict_to_car(fw_versions_dict, allow_fuzzy)
+
+
+def match_fw_dict_to_car(fw_versions_dict, allow_fuzzy=True, log=True):
   matches = match_fw_to_car_exact(fw_versions_dict)
 
   exact_match = True
   if allow_fuzzy and len(matches) == 0:
-    matches = match_fw_to_car_fuzzy(fw_versions_dict)
+    matches = match_fw_to_car_fuzzy(fw_versions_dict, log=log)
 
     # Fuzzy match found
     if len(matches) == 1:
@@ -294,7 +331,19 @@ def match_fw_to_car(fw_versions, allow_fuzzy=True):
   return exact_match, matches
 
 
-def get_fw_versions(logcan, sendcan, extra=None, timeout=0.1, debug=False, progress=False):
+def match_fw_to_car_batch(fw_versions_list, allow_fuzzy=True):
+  """match_fw_to_car for many vehicles at once, e.g. for fleet wide audits. Takes a list
+  of carFw lists or of {(addr, subaddr): fw} dicts, returns a list of (exact_match, matches)."""
+  get_fw_index()
+  results = []
+  for fw_versions in fw_versions_list:
+    fw_versions_dict = fw_versions if isinstance(fw_versions, dict) else build_fw_dict(fw_versions)
+    results.append(match_fw_dict_to_car(fw_versions_dict, allow_fuzzy, log=False))
+  return results
+
+
+def fw_queries(engine, extra=None, timeout=0.1):
+  """Adds the FW version queries to an IsoTpQueryEngine, returns the queries and the ECU type of each address."""
   ecu_types = {}
 
   # Extract ECU addresses to query from fingerprints
@@ -302,7 +351,7 @@ def get_fw_versions(logcan, sendcan, extra=None, timeout=0.1, debug=False, progr
   addrs = []
   parallel_addrs = []
 
-  versions = get_attr_from_cars('FW_VERSIONS', combine_brands=False)
+  versions = {brand: dict(info['FW_VERSIONS']) for brand, info in car_registry()['brands'].items() if info['FW_VERSIONS']}
   if extra is not None:
     versions.update(extra)
 
@@ -322,19 +371,23 @@ def get_fw_versions(logcan, sendcan, extra=None, timeout=0.1, debug=False, progr
 
   addrs.insert(0, parallel_addrs)
 
-  fw_versions = {}
-  for i, addr in enumerate(tqdm(addrs, disable=not progress)):
+  # the engine only runs queries to different ECUs on a bus at the same time
+  queries = []
+  for i, addr in enumerate(addrs):
     for addr_chunk in chunks(addr):
       for r in REQUESTS:
-        try:
-          addrs = [(a, s) for (b, a, s) in addr_chunk if b in (r.brand, 'any')]
+        query_addrs = [(a, s) for (b, a, s) in addr_chunk if b in (r.brand, 'any')]
+        if query_addrs:
+          t = 2 * timeout if i == 0 else timeout
+          queries.append(engine.add(r.bus, query_addrs, r.request, r.response, r.rx_offset, timeout=t))
+  return queries, ecu_types
+
 
-          if addrs:
-            query = IsoTpParallelQuery(sendcan, logcan, r.bus, addrs, r.request, r.response, r.rx_offset, debug=debug)
-            t = 2 * timeout if i == 0 else timeout
-            fw_versions.update(query.get_data(t))
-        except Exception:
-          cloudlog.warning(f"FW query exception: {traceback.format_exc()}")
+def build_car_fw(queries, ecu_types):
+  # in the order the queries were added, later requests to the same ECU win
+  fw_versions = {}
+  for query in queries:
+    fw_versions.update(query.results)
 
   # Build capnp list to put into CarParams
   car_fw = []
@@ -353,6 +406,19 @@ def get_fw_versions(logcan, sendcan, extra=None, timeout=0.1, debug=False, progr
   return car_fw
 
 
+def get_fw_versions(logcan, sendcan, extra=None, timeout=0.1, debug=False, progress=False):
+  engine = IsoTpQueryEngine(sendcan, logcan, debug=debug)
+  queries, ecu_types = fw_queries(engine, extra, timeout)
+
+  with tqdm(total=len(queries), disable=not progress) as pbar:
+    try:
+      engine.run(on_done=lambda _: pbar.update())
+    except Exception:
+      cloudlog.warning(f"FW query exception: {traceback.format_exc()}")
+
+  return build_car_fw(queries, ecu_types)
+
+
 if __name__ == "__main__":
   import time
   import argparse
@@ -5,6 +5,7 @@ from math import fabs, erf
 
 from common.numpy_fast import interp
 from common.conversions import Conversions as CV
+from opendbc.can.parser import update_parsers
 from selfdrive.car import STD_CARGO_KG, scale_rot_inertia, scale_tire_stiffness, is_ecu_disconnected, gen_empty_fingerprint, get_safety_config
 from selfdrive.car.gm.values import CAR, Ecu, ECU_FINGERPRINT, CruiseButtons, \
                                     AccState, FINGERPRINTS, CarControllerParams
@@ -227,10 +228,8 @@ class CarInterface(CarInterfaceBase):
 
   # returns a car.CarState
   def update(self, c: car.CarControl, can_strings: List[bytes]) -> car.CarState:
-    self.cp.update_strings(can_strings)
-    self.cp_loopback.update_strings(can_strings) # GM: EPS fault workaround (#22404)
-
-    self.cp_chassis.update_strings(can_strings) # for Brake Light
+    # cp_loopback: GM EPS fault workaround (#22404), cp_chassis: for Brake Light
+    update_parsers([self.cp, self.cp_loopback, self.cp_chassis], can_strings)
     ret = self.CS.update(self.cp, self.cp_loopback, self.cp_chassis) # GM: EPS fault workaround (#22404)
 
     #brake autohold
@@ -447,7 +447,7 @@ class CarState(CarStateBase):
       ]
       checks += [("ESP11", 50)]
 
-    return CANParser(DBC[CP.carFingerprint]["pt"], signals, checks, 0, enforce_checks=False)
+    return CANParser(DBC[CP.carFingerprint]["pt"], signals, checks, 0, enforce_checks=False, flat=True)
 
   @staticmethod
   def get_can2_parser(CP):
@@ -535,7 +535,7 @@ class CarState(CarStateBase):
         ("SCC11", 50),
         ("SCC12", 50),
       ]
-    return CANParser(DBC[CP.carFingerprint]["pt"], signals, checks, 1, enforce_checks=False)
+    return CANParser(DBC[CP.carFingerprint]["pt"], signals, checks, 1, enforce_checks=False, flat=True)
 
   @staticmethod
   def get_cam_can_parser(CP):
@@ -629,5 +629,5 @@ class CarState(CarStateBase):
         ]
         checks += [("LFAHDA_MFC", 20)]
 
-    return CANParser(DBC[CP.carFingerprint]["pt"], signals, checks, 2, enforce_checks=False)
+    return CANParser(DBC[CP.carFingerprint]["pt"], signals, checks, 2, enforce_checks=False, flat=True)
 
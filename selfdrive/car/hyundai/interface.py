@@ -4,6 +4,7 @@ from typing import List
 from cereal import car
 from common.numpy_fast import interp
 from common.conversions import Conversions as CV
+from opendbc.can.parser import update_parsers
 from selfdrive.car.hyundai.values import CAR, Buttons, CarControllerParams
 from selfdrive.car import STD_CARGO_KG, scale_rot_inertia, scale_tire_stiffness, gen_empty_fingerprint, get_safety_config
 from selfdrive.car.interfaces import CarInterfaceBase
@@ -373,9 +374,7 @@ class CarInterface(CarInterfaceBase):
     pass
 
   def update(self, c: car.CarControl, can_strings: List[bytes]) -> car.CarState:
-    self.cp.update_strings(can_strings)
-    self.cp2.update_strings(can_strings)
-    self.cp_cam.update_strings(can_strings)
+    update_parsers([self.cp, self.cp2, self.cp_cam], can_strings)
 
     ret = self.CS.update(self.cp, self.cp2, self.cp_cam)
     ret.canValid = self.cp.can_valid and self.cp2.can_valid and self.cp_cam.can_valid
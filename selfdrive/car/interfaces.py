@@ -10,6 +10,7 @@ from common.basedir import BASEDIR
 from common.kalman.simple_kalman import KF1D
 from common.realtime import DT_CTRL
 from common.params import Params
+from opendbc.can.parser import update_parsers
 from selfdrive.car import gen_empty_fingerprint
 from common.conversions import Conversions as CV
 from selfdrive.controls.lib.drive_helpers import V_CRUISE_MAX, apply_deadzone
@@ -176,9 +177,7 @@ class CarInterfaceBase(ABC):
 
   def update(self, c: car.CarControl, can_strings: List[bytes]) -> car.CarState:
     # parse can
-    for cp in self.can_parsers:
-      if cp is not None:
-        cp.update_strings(can_strings)
+    update_parsers([cp for cp in self.can_parsers if cp is not None], can_strings)
 
     # get CarState
     ret = self._update(c)
@@ -1,7 +1,7 @@
+import math
 import time
 from collections import defaultdict
-from functools import partial
-from typing import Optional
+from typing import Callable, Dict, List, Optional, Set, Tuple
 
 import cereal.messaging as messaging
 from selfdrive.swaglog import cloudlog
@@ -9,140 +9,213 @@ from selfdrive.boardd.boardd import can_list_to_can_capnp
 from panda.python.uds import CanClient, IsoTpMessage, FUNCTIONAL_ADDRS, get_rx_addr_for_tx_addr
 
 
-class IsoTpParallelQuery:
-  def __init__(self, sendcan, logcan, bus, addrs, request, response, response_offset=0x8, functional_addr=False, debug=False):
-    self.sendcan = sendcan
-    self.logcan = logcan
+def functional_addr_for_rx_addr(address):
+  """Functional address of the request a physical response address answers, None if it's not a response."""
+  if 0x7E8 <= address <= 0x7EF:
+    return FUNCTIONAL_ADDRS[0]
+  if 0x18DAF100 <= address <= 0x18DAF1FF:
+    return FUNCTIONAL_ADDRS[1]
+  return None
+
+
+class IsoTpSession:
+  """The request/response sequence of a query with one ECU, or one functional address."""
+  def __init__(self, query, tx_addr, rx_addr):
+    self.query = query
+    self.tx_addr = tx_addr  # (address, sub address)
+    self.rx_addr = rx_addr
+    self.route = (query.bus, tx_addr[0] if rx_addr is None else rx_addr)
+    self.rx_buffer: List[Tuple[int, int, bytes, int]] = []
+    self.msg: Optional[IsoTpMessage] = None
+    self.counter = 0
+    self.done = False
+
+  def can_rx(self):
+    msgs, self.rx_buffer = self.rx_buffer, []
+    return msgs
+
+
+class IsoTpQuery:
+  """Sends the same sequence of requests to a list of ECUs on one bus, see IsoTpQueryEngine.add."""
+  def __init__(self, bus, addrs, request, response, response_offset, functional_addr, timeout, total_timeout):
     self.bus = bus
     self.request = request
     self.response = response
-    self.debug = debug
     self.functional_addr = functional_addr
+    self.timeout = timeout
+    self.total_timeout = 10 * timeout if total_timeout is None else total_timeout
 
-    self.real_addrs = []
-    for a in addrs:
-      if isinstance(a, tuple):
-        self.real_addrs.append(a)
-      else:
-        self.real_addrs.append((a, None))
+    real_addrs = [a if isinstance(a, tuple) else (a, None) for a in addrs]
+    self.sessions = [IsoTpSession(self, a, get_rx_addr_for_tx_addr(a[0], rx_offset=response_offset)) for a in real_addrs]
 
-    self.msg_addrs = {tx_addr: get_rx_addr_for_tx_addr(tx_addr[0], rx_offset=response_offset) for tx_addr in self.real_addrs}
-    self.msg_buffer = defaultdict(list)
+    self.results: Dict[Tuple[int, Optional[int]], bytes] = {}
+    self.done = False
+    self.start_time = 0.
+    self.last_response_time = 0.
 
-  def rx(self):
-    """Drain can socket and sort messages into buffers based on address"""
-    can_packets = messaging.drain_sock(self.logcan, wait_for_one=True)
+  def locks(self) -> Set[Tuple[int, Optional[int]]]:
+    # functional requests are answered by every ECU, they get the bus to themselves
+    if self.functional_addr:
+      return {(self.bus, None)}
+    return {(self.bus, s.tx_addr[0]) for s in self.sessions} | {(self.bus, s.rx_addr) for s in self.sessions}
 
-    for packet in can_packets:
-      for msg in packet.can:
-        if msg.src == self.bus:
-          if self.functional_addr:
-            if (0x7E8 <= msg.address <= 0x7EF) or (0x18DAF100 <= msg.address <= 0x18DAF1FF):
-              fn_addr = next(a for a in FUNCTIONAL_ADDRS if msg.address - a <= 32)
-              self.msg_buffer[fn_addr].append((msg.address, msg.busTime, msg.dat, msg.src))
-          elif msg.address in self.msg_addrs.values():
-            self.msg_buffer[msg.address].append((msg.address, msg.busTime, msg.dat, msg.src))
+  def deadline(self):
+    return min(self.last_response_time + self.timeout, self.start_time + self.total_timeout)
 
-  def _can_tx(self, tx_addr, dat, bus):
-    """Helper function to send single message"""
-    msg = [tx_addr, 0, dat, bus]
-    self.sendcan.send(can_list_to_can_capnp([msg], msgtype='sendcan'))
-
-  def _can_rx(self, addr, sub_addr=None):
-    """Helper function to retrieve message with specified address and subadress from buffer"""
-    keep_msgs = []
-
-    if sub_addr is None:
-      msgs = self.msg_buffer[addr]
-    else:
-      # Filter based on subadress
-      msgs = []
-      for m in self.msg_buffer[addr]:
-        first_byte = m[2][0]
-        if first_byte == sub_addr:
-          msgs.append(m)
-        else:
-          keep_msgs.append(m)
 
-    self.msg_buffer[addr] = keep_msgs
-    return msgs
+class IsoTpQueryEngine:
+  """Runs many ISO-TP queries over one CAN socket. Received frames are routed to the sessions
+     by bus and address, and the socket is waited on until the next query times out instead of
+     polled. Queries run concurrently unless they address the same ECU on the same bus."""
+  def __init__(self, sendcan, logcan, debug=False):
+    self.sendcan = sendcan
+    self.logcan = logcan
+    self.debug = debug
+    self.poller = messaging.Poller()
+    self.poller.registerSocket(logcan)
+
+    self.pending: List[IsoTpQuery] = []
+    self.active: List[IsoTpQuery] = []
+    self.locked: Set[Tuple[int, Optional[int]]] = set()
+    self.routes: Dict[Tuple[int, int], List[IsoTpSession]] = defaultdict(list)
+    self.tx_msgs: List[list] = []
+
+  def add(self, bus, addrs, request, response, response_offset=0x8, functional_addr=False, timeout=0.1, total_timeout=None) -> IsoTpQuery:
+    """Queues a query, its results are in query.results once run() returns. A query ends when all
+       ECUs answered, none answered for timeout secs or after total_timeout secs (10 * timeout)."""
+    query = IsoTpQuery(bus, addrs, request, response, response_offset, functional_addr, timeout, total_timeout)
+    self.pending.append(query)
+    return query
 
-  def _drain_rx(self):
+  def _can_tx(self, tx_addr, dat, bus):
+    self.tx_msgs.append([tx_addr, 0, dat, bus])
+
+  def _flush_tx(self):
+    # all frames queued while handling one batch of received frames go out in one message
+    if self.tx_msgs:
+      self.sendcan.send(can_list_to_can_capnp(self.tx_msgs, msgtype='sendcan'))
+      self.tx_msgs = []
+
+  def _can_start(self, query):
+    busy_buses = {bus for bus, _ in self.locked}
+    if query.functional_addr:
+      return query.bus not in busy_buses
+    return (query.bus, None) not in self.locked and not (query.locks() & self.locked)
+
+  def _start(self, query, now):
+    self.locked |= query.locks()
+    self.active.append(query)
+    query.start_time = query.last_response_time = now
+
+    for s in query.sessions:
+      sub_addr = s.tx_addr[1]
+      can_client = CanClient(self._can_tx, s.can_rx, s.tx_addr[0], s.rx_addr, query.bus, sub_addr=sub_addr, debug=self.debug)
+      s.msg = IsoTpMessage(can_client, timeout=0, max_len=8 if sub_addr is None else 7, debug=self.debug)
+      self.routes[s.route].append(s)
+      try:
+        s.msg.send(query.request[0])
+      except Exception:
+        cloudlog.exception("Error sending UDS request")
+        s.done = True
+
+  def _finish(self, query, on_done):
+    query.done = True
+    self.active.remove(query)
+    self.locked -= query.locks()
+    for s in query.sessions:
+      self.routes[s.route].remove(s)
+    if on_done is not None:
+      on_done(query)
+
+  def _rx(self, timeout) -> Dict[IsoTpSession, None]:
+    """Waits up to timeout secs for CAN messages, returns the sessions that received frames."""
+    updated: Dict[IsoTpSession, None] = {}
+    if not self.poller.poll(math.ceil(timeout * 1000)):
+      return updated
+
+    for packet in messaging.drain_sock(self.logcan):
+      for msg in packet.can:
+        for route in ((msg.src, msg.address), (msg.src, functional_addr_for_rx_addr(msg.address))):
+          for s in self.routes.get(route, ()):
+            sub_addr = s.tx_addr[1]
+            if sub_addr is None or (len(msg.dat) and msg.dat[0] == sub_addr):
+              s.rx_buffer.append((msg.address, msg.busTime, msg.dat, msg.src))
+              updated[s] = None
+    return updated
+
+  def _process(self, s, now):
+    query = s.query
+    if s.done:
+      return
+
+    try:
+      dat: Optional[bytes] = s.msg.recv()
+      if not dat:
+        return
+
+      expected_response = query.response[s.counter]
+      if dat[:len(expected_response)] == expected_response:
+        query.last_response_time = now
+        if s.counter + 1 < len(query.request):
+          s.counter += 1
+          s.msg.send(query.request[s.counter])
+        else:
+          query.results[s.tx_addr] = dat[len(expected_response):]
+          s.done = True
+      else:
+        s.done = True
+        cloudlog.warning(f"iso-tp query bad response: 0x{dat.hex()}")
+    except Exception:
+      cloudlog.exception("Error processing UDS response")
+      s.done = True
+
+  def run(self, on_done: Optional[Callable[[IsoTpQuery], None]] = None):
+    """Runs all queued queries to completion, on_done is called with each query as it ends."""
     messaging.drain_sock(self.logcan)
-    self.msg_buffer = defaultdict(list)
 
-  def get_data(self, timeout, total_timeout=None):
-    if total_timeout is None:
-      total_timeout = 10 * timeout
-
-    self._drain_rx()
-
-    # Create message objects
-    msgs = {}
-    request_counter = {}
-    request_done = {}
-    for tx_addr, rx_addr in self.msg_addrs.items():
-      # rx_addr not set when using functional tx addr
-      id_addr = rx_addr or tx_addr[0]
-      sub_addr = tx_addr[1]
-
-      can_client = CanClient(self._can_tx, partial(self._can_rx, id_addr, sub_addr=sub_addr), tx_addr[0], rx_addr,
-                             self.bus, sub_addr=sub_addr, debug=self.debug)
-
-      max_len = 8 if sub_addr is None else 7
-
-      msg = IsoTpMessage(can_client, timeout=0, max_len=max_len, debug=self.debug)
-      msg.send(self.request[0])
-
-      msgs[tx_addr] = msg
-      request_counter[tx_addr] = 0
-      request_done[tx_addr] = False
-
-    results = {}
-    start_time = time.monotonic()
-    last_response_time = start_time
-    while True:
-      self.rx()
-
-      if all(request_done.values()):
-        break
-
-      for tx_addr, msg in msgs.items():
-        try:
-          dat: Optional[bytes] = msg.recv()
-        except Exception:
-          cloudlog.exception("Error processing UDS response")
-          request_done[tx_addr] = True
-          continue
-
-        if not dat:
-          continue
-
-        counter = request_counter[tx_addr]
-        expected_response = self.response[counter]
-        response_valid = dat[:len(expected_response)] == expected_response
-
-        if response_valid:
-          last_response_time = time.monotonic()
-          if counter + 1 < len(self.request):
-            msg.send(self.request[counter + 1])
-            request_counter[tx_addr] += 1
-          else:
-            results[tx_addr] = dat[len(expected_response):]
-            request_done[tx_addr] = True
-        else:
-          request_done[tx_addr] = True
-          cloudlog.warning(f"iso-tp query bad response: 0x{dat.hex()}")
+    while self.pending or self.active:
+      now = time.monotonic()
+      for query in list(self.pending):
+        if self._can_start(query):
+          self.pending.remove(query)
+          self._start(query, now)
+      self._flush_tx()
+
+      updated = self._rx(max(min(q.deadline() for q in self.active) - time.monotonic(), 0.))
+      now = time.monotonic()
+      for s in updated:
+        self._process(s, now)
+      self._flush_tx()
+
+      for query in list(self.active):
+        if all(s.done for s in query.sessions):
+          self._finish(query, on_done)
+        elif now - query.last_response_time >= query.timeout:
+          for s in query.sessions:
+            if s.counter > 0 and not s.done:
+              cloudlog.warning(f"iso-tp query timeout after receiving response: {s.tx_addr}")
+          self._finish(query, on_done)
+        elif now - query.start_time >= query.total_timeout:
+          cloudlog.warning("iso-tp query timeout while receiving data")
+          self._finish(query, on_done)
 
-      cur_time = time.monotonic()
-      if cur_time - last_response_time > timeout:
-        for tx_addr in msgs:
-          if (request_counter[tx_addr] > 0) and (not request_done[tx_addr]):
-            cloudlog.warning(f"iso-tp query timeout after receiving response: {tx_addr}")
-        break
 
-      if cur_time - start_time > total_timeout:
-        cloudlog.warning("iso-tp query timeout while receiving data")
-        break
+class IsoTpParallelQuery:
+  """A single query run on its own engine."""
+  def __init__(self, sendcan, logcan, bus, addrs, request, response, response_offset=0x8, functional_addr=False, debug=False):
+    self.sendcan = sendcan
+    self.logcan = logcan
+    self.bus = bus
+    self.addrs = addrs
+    self.request = request
+    self.response = response
+    self.response_offset = response_offset
+    self.functional_addr = functional_addr
+    self.debug = debug
 
-    return results
+  def get_data(self, timeout, total_timeout=None):
+    engine = IsoTpQueryEngine(self.sendcan, self.logcan, debug=self.debug)
+    query = engine.add(self.bus, self.addrs, self.request, self.response, self.response_offset, self.functional_addr,
+                       timeout, total_timeout)
+    engine.run()
+    return query.results
@@ -0,0 +1,137 @@
+import os
+import pickle
+import hashlib
+import tempfile
+import importlib
+from typing import Any, Dict
+
+from common.basedir import BASEDIR
+from selfdrive.hardware import PC
+
+# Brands, models, fingerprints and FW versions of every car port, cached so processes
+# only import the values.py of all brands when one of them changed, and the
+# interface modules of the detected brand only.
+REGISTRY_VERSION = 1
+CAR_DIR = os.path.join(BASEDIR, "selfdrive/car")
+CAR_REGISTRY_CACHE = os.getenv("CAR_REGISTRY_CACHE", os.path.join("/tmp" if PC else "/data", "car_registry", "registry.pkl"))
+
+_registry = None
+_interfaces: Dict[str, Any] = {}
+
+
+def _brands():
+  return sorted(d for d in os.listdir(CAR_DIR) if os.path.isfile(os.path.join(CAR_DIR, d, "values.py")))
+
+
+def source_hash():
+  # everything the registry is built from: values.py of each brand and which modules it has
+  h = hashlib.sha256(str(REGISTRY_VERSION).encode())
+  for brand in _brands():
+    h.update(brand.encode())
+    with open(os.path.join(CAR_DIR, brand, "values.py"), "rb") as f:
+      h.update(f.read())
+    for module in ("carstate.py", "carcontroller.py"):
+      h.update(str(os.path.exists(os.path.join(CAR_DIR, brand, module))).encode())
+  return h.hexdigest()
+
+
+def build_registry():
+  registry: Dict[str, Any] = {'brands': {}, 'FW_VERSIONS': {}, 'FINGERPRINTS': {}}
+  for brand in _brands():
+    values = importlib.import_module(f'selfdrive.car.{brand}.values')
+    CAR = getattr(values, 'CAR', None)
+    if CAR is None:
+      continue
+
+    registry['brands'][brand] = {
+      'models': [getattr(CAR, c) for c in CAR.__dict__.keys() if not c.startswith("__")],
+      'FW_VERSIONS': getattr(values, 'FW_VERSIONS', {}),
+      'has_carstate': os.path.exists(os.path.join(CAR_DIR, brand, "carstate.py")),
+      'has_carcontroller': os.path.exists(os.path.join(CAR_DIR, brand, "carcontroller.py")),
+    }
+    registry['FW_VERSIONS'].update(getattr(values, 'FW_VERSIONS', {}))
+    registry['FINGERPRINTS'].update(getattr(values, 'FINGERPRINTS', {}))
+  return registry
+
+
+def _write_cache(h, registry):
+  # written next to the cache and moved into place, readers never see a partial pickle
+  cache_dir = os.path.dirname(CAR_REGISTRY_CACHE)
+  os.makedirs(cache_dir, exist_ok=True)
+  fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix=".registry_")
+  try:
+    with os.fdopen(fd, "wb") as f:
+      pickle.dump({'hash': h, 'registry': registry}, f)
+    os.replace(tmp_path, CAR_REGISTRY_CACHE)
+  except BaseException:
+    os.unlink(tmp_path)
+    raise
+
+
+def car_registry():
+  global _registry
+  if _registry is not None:
+    return _registry
+
+  h = source_hash()
+  try:
+    with open(CAR_REGISTRY_CACHE, "rb") as f:
+      cached = pickle.load(f)
+    if cached['hash'] == h:
+      _registry = cached['registry']
+      return _registry
+  except Exception:
+    pass
+
+  _registry = build_registry()
+  try:
+    _write_cache(h, _registry)
+  except OSError:
+    pass
+  return _registry
+
+
+def interface_names() -> Dict[str, list]:
+  return {brand: info['models'] for brand, info in car_registry()['brands'].items()}
+
+
+def brand_of(model):
+  for brand, info in car_registry()['brands'].items():
+    if model in info['models']:
+      return brand
+  raise KeyError(model)
+
+
+def load_interface(model):
+  """Returns (CarInterface, CarController, CarState) for a model, importing only its brand."""
+  brand = brand_of(model)
+  if brand not in _interfaces:
+    info = car_registry()['brands'][brand]
+    path = f'selfdrive.car.{brand}'
+    CarInterface = importlib.import_module(path + '.interface').CarInterface
+    CarState = importlib.import_module(path + '.carstate').CarState if info['has_carstate'] else None
+    CarController = importlib.import_module(path + '.carcontroller').CarController if info['has_carcontroller'] else None
+    _interfaces[brand] = (CarInterface, CarController, CarState)
+  return _interfaces[brand]
+
+
+class Interfaces(dict):
+  """model -> (CarInterface, CarController, CarState), brands are imported on first access."""
+  def __init__(self):
+    super().__init__({model: None for models in interface_names().values() for model in models})
+
+  def __getitem__(self, model):
+    value = super().__getitem__(model)
+    if value is None:
+      value = load_interface(model)
+      super().__setitem__(model, value)
+    return value
+
+  def get(self, model, default=None):
+    return self[model] if model in self else default
+
+  def values(self):
+    return [self[model] for model in self]
+
+  def items(self):
+    return [(model, self[model]) for model in self]
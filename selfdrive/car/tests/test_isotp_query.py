@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+import time
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from selfdrive.car import isotp_parallel_query
+from selfdrive.car.isotp_parallel_query import IsoTpQueryEngine
+
+TESTER_PRESENT_REQUEST = b'\x3e\x00'
+TESTER_PRESENT_RESPONSE = b'\x7e\x00'
+FW_REQUEST = b'\x22\xf1\x81'
+FW_RESPONSE = b'\x62\xf1\x81'
+VIN_REQUEST = b'\x09\x02'
+VIN_RESPONSE = b'\x49\x02\x01'
+
+VIN = b'1HGCM82633A004352'
+
+
+class FakeEcu:
+  """Answers ISO-TP requests from a dict of request -> response payloads."""
+  def __init__(self, bus, tx_addr, responses, sub_addr=None):
+    self.bus = bus
+    self.tx_addr = tx_addr
+    self.rx_addr = tx_addr + 8
+    self.responses = responses
+    self.sub_addr = sub_addr
+    self.consecutive = []
+
+  def handles(self, bus, addr, dat):
+    if bus != self.bus or (self.sub_addr is not None and dat[0] != self.sub_addr):
+      return False
+    return addr == self.tx_addr or (addr == 0x7DF and 0x7E0 <= self.tx_addr <= 0x7E7)
+
+  def _frame(self, dat):
+    return dat if self.sub_addr is None else bytes([self.sub_addr]) + dat
+
+  def rx(self, dat):
+    if self.sub_addr is not None:
+      dat = dat[1:]
+
+    # flow control from the tester releases the rest of a multi frame response
+    if dat[0] >> 4 == 0x3:
+      frames, self.consecutive = self.consecutive, []
+      return frames
+
+    response = self.responses.get(dat[1:1 + (dat[0] & 0xF)])
+    if response is None:
+      return []
+
+    max_len = 7 if self.sub_addr is None else 6
+    if len(response) <= max_len:
+      return [self._frame(bytes([len(response)]) + response)]
+
+    first_len = max_len - 1
+    rest = response[first_len:]
+    self.consecutive = [self._frame(bytes([0x20 | ((i // max_len + 1) & 0xF)]) + rest[i:i + max_len])
+                        for i in range(0, len(rest), max_len)]
+    return [self._frame(bytes([0x10 | (len(response) >> 8), len(response) & 0xFF]) + response[:first_len])]
+
+
+class FakeCan:
+  """Stands in for the sendcan and logcan sockets, the poller and drain_sock."""
+  def __init__(self, ecus):
+    self.ecus = ecus
+    self.rx_queue = []
+    self.sent = []
+    self.done = []
+
+  # sendcan
+  def send(self, msgs):
+    self.sent.append((msgs, list(self.done)))
+    for addr, _, dat, bus in msgs:
+      for ecu in self.ecus:
+        if ecu.handles(bus, addr, dat):
+          self.rx_queue += [SimpleNamespace(address=ecu.rx_addr, busTime=0, dat=frame, src=bus) for frame in ecu.rx(dat)]
+
+  # messaging
+  def Poller(self):
+    return self
+
+  def registerSocket(self, sock):
+    pass
+
+  def poll(self, timeout):
+    if not self.rx_queue:
+      time.sleep(timeout / 1000.)
+    return self.rx_queue
+
+  def drain_sock(self, sock, wait_for_one=False):
+    msgs, self.rx_queue = self.rx_queue, []
+    return [SimpleNamespace(can=msgs)] if msgs else []
+
+  def first_sent(self, bus, addr):
+    """Index of the first sendcan message with a frame to addr on bus and the queries done by then."""
+    for i, (msgs, done) in enumerate(self.sent):
+      if any(m[0] == addr and m[3] == bus for m in msgs):
+        return i, done
+    return None, None
+
+
+def fw_ecu(bus, addr, fw, sub_addr=None):
+  return FakeEcu(bus, addr, {TESTER_PRESENT_REQUEST: TESTER_PRESENT_RESPONSE, FW_REQUEST: FW_RESPONSE + fw}, sub_addr)
+
+
+class TestIsoTpQueryEngine(unittest.TestCase):
+  def _run(self, can, queries, **kwargs):
+    with mock.patch.object(isotp_parallel_query, "messaging", can), \
+         mock.patch.object(isotp_parallel_query, "can_list_to_can_capnp", lambda msgs, msgtype: msgs):
+      engine = IsoTpQueryEngine(can, None)
+      added = [engine.add(*q, **kwargs) for q in queries]
+      engine.run(on_done=can.done.append)
+    return added
+
+  def test_concurrent_physical_queries(self):
+    can = FakeCan([fw_ecu(0, 0x7E0, b'ENGINE'), fw_ecu(0, 0x7E1, b'TRANS'), fw_ecu(1, 0x750, b'EPS')])
+    request = ([TESTER_PRESENT_REQUEST, FW_REQUEST], [TESTER_PRESENT_RESPONSE, FW_RESPONSE])
+    engine, trans, eps = self._run(can, [(0, [0x7E0], *request), (0, [0x7E1], *request), (1, [0x750], *request)])
+
+    self.assertEqual(engine.results, {(0x7E0, None): b'ENGINE'})
+    self.assertEqual(trans.results, {(0x7E1, None): b'TRANS'})
+    self.assertEqual(eps.results, {(0x750, None): b'EPS'})
+
+    # the first requests to all three ECUs go out together
+    for bus, addr in ((0, 0x7E0), (0, 0x7E1), (1, 0x750)):
+      self.assertEqual(can.first_sent(bus, addr)[0], 0)
+
+  def test_functional_query_locks_bus(self):
+    can = FakeCan([FakeEcu(1, 0x7E0, {VIN_REQUEST: VIN_RESPONSE + VIN}), fw_ecu(1, 0x7E1, b'TRANS'), fw_ecu(0, 0x7E1, b'OTHER')])
+    vin, same_bus, other_bus = self._run(can, [
+      (1, [0x7DF], [VIN_REQUEST], [VIN_RESPONSE], 0x8, True),
+      (1, [0x7E1], [FW_REQUEST], [FW_RESPONSE]),
+      (0, [0x7E1], [FW_REQUEST], [FW_RESPONSE]),
+    ])
+
+    self.assertEqual(vin.results, {(0x7DF, None): VIN})
+    self.assertEqual(same_bus.results, {(0x7E1, None): b'TRANS'})
+    self.assertEqual(other_bus.results, {(0x7E1, None): b'OTHER'})
+
+    # physical queries on the same bus wait for the functional query, other buses don't
+    self.assertEqual(can.first_sent(1, 0x7DF)[0], 0)
+    self.assertEqual(can.first_sent(0, 0x7E1)[0], 0)
+    idx, done = can.first_sent(1, 0x7E1)
+    self.assertGreater(idx, 0)
+    self.assertIn(vin, done)
+
+  def test_functional_query_waits_for_bus(self):
+    can = FakeCan([FakeEcu(1, 0x7E0, {VIN_REQUEST: VIN_RESPONSE + VIN}), fw_ecu(1, 0x7E1, b'TRANS')])
+    physical, vin = self._run(can, [
+      (1, [0x7E1], [FW_REQUEST], [FW_RESPONSE]),
+      (1, [0x7DF], [VIN_REQUEST], [VIN_RESPONSE], 0x8, True),
+    ])
+
+    self.assertEqual(physical.results, {(0x7E1, None): b'TRANS'})
+    self.assertEqual(vin.results, {(0x7DF, None): VIN})
+    self.assertIn(physical, can.first_sent(1, 0x7DF)[1])
+
+  def test_sub_addr_serialized(self):
+    can = FakeCan([fw_ecu(0, 0x750, b'EPS', sub_addr=0xF), fw_ecu(0, 0x750, b'ABS', sub_addr=0x10)])
+    eps, abs_ = self._run(can, [
+      (0, [(0x750, 0xF)], [FW_REQUEST], [FW_RESPONSE]),
+      (0, [(0x750, 0x10)], [FW_REQUEST], [FW_RESPONSE]),
+    ])
+
+    self.assertEqual(eps.results, {(0x750, 0xF): b'EPS'})
+    self.assertEqual(abs_.results, {(0x750, 0x10): b'ABS'})
+
+    # the second query only starts once the first released the address
+    sent_to_abs = [i for i, (msgs, _) in enumerate(can.sent) if any(m[2][0] == 0x10 for m in msgs)]
+    self.assertGreater(sent_to_abs[0], 0)
+    self.assertIn(eps, can.sent[sent_to_abs[0]][1])
+
+  def test_timeout(self):
+    # 0x7E1 never answers, 0x7E2 answers the first request only
+    can = FakeCan([fw_ecu(0, 0x7E0, b'ENGINE'), FakeEcu(0, 0x7E2, {TESTER_PRESENT_REQUEST: TESTER_PRESENT_RESPONSE})])
+    t = time.monotonic()
+    query, = self._run(can, [(0, [0x7E0, 0x7E1, 0x7E2], [TESTER_PRESENT_REQUEST, FW_REQUEST], [TESTER_PRESENT_RESPONSE, FW_RESPONSE])],
+                       timeout=0.1)
+    elapsed = time.monotonic() - t
+
+    self.assertTrue(query.done)
+    self.assertEqual(query.results, {(0x7E0, None): b'ENGINE'})
+    self.assertGreaterEqual(elapsed, 0.1)
+    self.assertLess(elapsed, 0.5)
+
+  def test_total_timeout(self):
+    # the ECU keeps answering, but the query runs out of total_timeout before the last request
+    can = FakeCan([fw_ecu(0, 0x7E0, b'ENGINE')])
+    t = time.monotonic()
+    query, = self._run(can, [(0, [0x7E0], [TESTER_PRESENT_REQUEST, FW_REQUEST], [TESTER_PRESENT_RESPONSE, FW_RESPONSE])],
+                       timeout=1., total_timeout=0.)
+
+    self.assertTrue(query.done)
+    self.assertEqual(query.results, {})
+    self.assertLess(time.monotonic() - t, 0.5)
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+os.environ["CAR_REGISTRY_CACHE"] = "/tmp/__test_car_registry__/registry.pkl"
+from selfdrive.car import registry
+from selfdrive.car.car_helpers import get_interface_attr
+
+
+class TestCarRegistry(unittest.TestCase):
+  def setUp(self):
+    tmp = tempfile.TemporaryDirectory()
+    self.addCleanup(tmp.cleanup)
+    self.cache_dir = os.path.join(tmp.name, "car_registry")
+    self.cache = os.path.join(self.cache_dir, "registry.pkl")
+
+    for patch in (mock.patch.object(registry, "CAR_REGISTRY_CACHE", self.cache), mock.patch.object(registry, "_registry", None)):
+      patch.start()
+      self.addCleanup(patch.stop)
+
+  def _load(self):
+    registry._registry = None
+    return registry.car_registry()
+
+  def test_matches_values(self):
+    reg = self._load()
+    self.assertEqual(os.listdir(self.cache_dir), ["registry.pkl"])
+    for brand, CAR in get_interface_attr("CAR").items():
+      models = [getattr(CAR, c) for c in CAR.__dict__.keys() if not c.startswith("__")]
+      self.assertEqual(reg['brands'][brand]['models'], models)
+
+    # served from the cache the second time
+    with mock.patch.object(registry, "build_registry", side_effect=AssertionError):
+      self.assertEqual(self._load(), reg)
+
+  def test_invalidated_by_source(self):
+    self._load()
+    with mock.patch.object(registry, "source_hash", return_value="changed"), \
+         mock.patch.object(registry, "build_registry", return_value={'brands': {}}) as build:
+      self._load()
+      build.assert_called_once()
+
+  def test_failed_write(self):
+    # a failed write leaves neither a temporary file nor a partial cache behind
+    with mock.patch.object(registry.pickle, "dump", side_effect=OSError):
+      self._load()
+    self.assertEqual(os.listdir(self.cache_dir), [])
+
+  def test_lazy_interfaces(self):
+    interfaces = registry.Interfaces()
+    self.assertIsNone(dict.__getitem__(interfaces, "mock"))
+    CarInterface, _, _ = interfaces["mock"]
+    self.assertEqual(CarInterface.__module__, "selfdrive.car.mock.interface")
+
+
+if __name__ == "__main__":
+  unittest.main()
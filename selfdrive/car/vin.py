@@ -3,7 +3,7 @@ import traceback
 
 import cereal.messaging as messaging
 from panda.python.uds import FUNCTIONAL_ADDRS
-from selfdrive.car.isotp_parallel_query import IsoTpParallelQuery
+from selfdrive.car.isotp_parallel_query import IsoTpQueryEngine
 from selfdrive.swaglog import cloudlog
 
 VIN_REQUEST = b'\x09\x02'
@@ -11,12 +11,26 @@ VIN_RESPONSE = b'\x49\x02\x01'
 VIN_UNKNOWN = "0" * 17
 
 
+def vin_query(engine, bus, timeout=0.1):
+  return engine.add(bus, FUNCTIONAL_ADDRS, [VIN_REQUEST], [VIN_RESPONSE], functional_addr=True, timeout=timeout)
+
+
+def vin_from_query(query):
+  """(addr, vin) of the first ECU that answered a vin_query, None if none did."""
+  for addr, vin in query.results.items():
+    return addr[0], vin.decode()
+  return None
+
+
 def get_vin(logcan, sendcan, bus, timeout=0.1, retry=5, debug=False):
   for i in range(retry):
     try:
-      query = IsoTpParallelQuery(sendcan, logcan, bus, FUNCTIONAL_ADDRS, [VIN_REQUEST], [VIN_RESPONSE], functional_addr=True, debug=debug)
-      for addr, vin in query.get_data(timeout).items():
-        return addr[0], vin.decode()
+      engine = IsoTpQueryEngine(sendcan, logcan, debug=debug)
+      query = vin_query(engine, bus, timeout)
+      engine.run()
+      ret = vin_from_query(query)
+      if ret is not None:
+        return ret
       print(f"vin query retry ({i+1}) ...")
     except Exception:
       cloudlog.warning(f"VIN query exception: {traceback.format_exc()}")
@@ -11,6 +11,7 @@ from common.numpy_fast import clip, interp
 from common.realtime import sec_since_boot, config_realtime_process, Priority, Ratekeeper, DT_CTRL
 from common.profiler import Profiler
 from common.params import Params, put_nonblocking
+from common.params_cache import cached_params
 import cereal.messaging as messaging
 from common.conversions import Conversions as CV
 from panda import ALTERNATIVE_EXPERIENCE
@@ -242,7 +243,8 @@ class Controls:
 
     # controlsd is driven by can recv, expected at 100Hz
     self.rk = Ratekeeper(100, print_delay_threshold=None)
-    self.prof = Profiler(False)  # off by default
+    # off by default, PROFILE_CONTROLSD=1 exports timings for selfdrive/debug/profiler_stats.py
+    self.prof = Profiler(bool(int(os.getenv("PROFILE_CONTROLSD", "0"))), name="controlsd")
 
   def reset(self):
     self.slowing_down = False
@@ -350,8 +352,8 @@ class Controls:
     #opkr
     self.second += DT_CTRL
     if self.second > 1.0:
-      self.live_sr = Params().get_bool("OpkrLiveSteerRatio")
-      self.live_sr_percent = int(Params().get("LiveSteerRatioPercent", encoding="utf8"))
+      self.live_sr = cached_params().get_bool("OpkrLiveSteerRatio")
+      self.live_sr_percent = cached_params().get_int("LiveSteerRatioPercent", -5)
       self.second = 0.0
 
 
@@ -666,7 +668,7 @@ class Controls:
     x = max(params.stiffnessFactor, 0.1)
     #sr = max(params.steerRatio, 0.1)
 
-    if Params().get_bool("UseNpilotManager"):
+    if cached_params().get_bool("UseNpilotManager"):
       if ntune_common_enabled('useLiveSteerRatio'):
         sr = max(params.steerRatio, 0.1)
         sr = sr - (sr * ntune_common_get('steerRatioScale')) # steerRatioScale value update
@@ -681,7 +683,7 @@ class Controls:
       else:
         sr = max(self.new_steerRatio, 0.1)
 
-    if Params().get_bool("UseBaseTorqueValues") and not Params().get_bool("UseNpilotManager"):
+    if cached_params().get_bool("UseBaseTorqueValues") and not cached_params().get_bool("UseNpilotManager"):
       sr = self.CP.steerRatio
       self.is_live_torque = True
 
@@ -702,33 +704,33 @@ class Controls:
 
           self.LaC.update_live_torque_params(torque_params.latAccelFactorFiltered, torque_params.latAccelOffsetFiltered, torque_params.frictionCoefficientFiltered)
         else:
-          if Params().get_bool("UseNpilotManager"):
+          if cached_params().get_bool("UseNpilotManager"):
             try:
               self.torque_latAccelFactor = ntune_torque_get('latAccelFactor') #LAT_ACCEL_FACTOR
               self.torque_friction = ntune_torque_get('friction') #FRICTION
             except:
-              self.torque_latAccelFactor = float(Decimal(Params().get("TorqueMaxLatAccel", encoding="utf8")) * Decimal('0.1'))
-              self.torque_friction = float(Decimal(Params().get("TorqueFriction", encoding="utf8")) * Decimal('0.001'))
+              self.torque_latAccelFactor = cached_params().get_scaled("TorqueMaxLatAccel", '0.1', 2.5)
+              self.torque_friction = cached_params().get_scaled("TorqueFriction", '0.001', 0.14)
 
           else:
-            self.torque_latAccelFactor = float(Decimal(Params().get("TorqueMaxLatAccel", encoding="utf8")) * Decimal('0.1'))
-            self.torque_friction = float(Decimal(Params().get("TorqueFriction", encoding="utf8")) * Decimal('0.001'))
+            self.torque_latAccelFactor = cached_params().get_scaled("TorqueMaxLatAccel", '0.1', 2.5)
+            self.torque_friction = cached_params().get_scaled("TorqueFriction", '0.001', 0.14)
 
           self.torque_latAccelOffset = 0.
           self.LaC.update_live_torque_params(self.torque_latAccelFactor, self.torque_latAccelOffset, self.torque_friction)
 
       else:
 
-        if Params().get_bool("UseNpilotManager"):
+        if cached_params().get_bool("UseNpilotManager"):
           try:
             self.torque_latAccelFactor = ntune_torque_get('latAccelFactor') #LAT_ACCEL_FACTOR
             self.torque_friction = ntune_torque_get('friction') #FRICTION
           except:
-            self.torque_latAccelFactor = float(Decimal(Params().get("TorqueMaxLatAccel", encoding="utf8")) * Decimal('0.1'))
-            self.torque_friction = float(Decimal(Params().get("TorqueFriction", encoding="utf8")) * Decimal('0.001'))
+            self.torque_latAccelFactor = cached_params().get_scaled("TorqueMaxLatAccel", '0.1', 2.5)
+            self.torque_friction = cached_params().get_scaled("TorqueFriction", '0.001', 0.14)
         else:
-          self.torque_latAccelFactor = float(Decimal(Params().get("TorqueMaxLatAccel", encoding="utf8")) * Decimal('0.1'))
-          self.torque_friction = float(Decimal(Params().get("TorqueFriction", encoding="utf8")) * Decimal('0.001'))
+          self.torque_latAccelFactor = cached_params().get_scaled("TorqueMaxLatAccel", '0.1', 2.5)
+          self.torque_friction = cached_params().get_scaled("TorqueFriction", '0.001', 0.14)
 
         self.torque_latAccelOffset = 0.
         self.LaC.update_live_torque_params(self.torque_latAccelFactor, self.torque_latAccelOffset, self.torque_friction)
@@ -961,7 +963,7 @@ class Controls:
     controlsState.sccStockCamStatus = self.sccStockCamStatus
 
     controlsState.steerRatio = float(self.steerRatio_to_send)
-    controlsState.steerActuatorDelay = ntune_common_get('steerActuatorDelay') if Params().get_bool("UseNpilotManager") else float(Decimal(Params().get("SteerActuatorDelayAdj", encoding="utf8")) * Decimal('0.01'))
+    controlsState.steerActuatorDelay = ntune_common_get('steerActuatorDelay') if cached_params().get_bool("UseNpilotManager") else cached_params().get_scaled("SteerActuatorDelayAdj", '0.01', 0.22)
 
     controlsState.sccGasFactor = ntune_scc_get('sccGasFactor')
     controlsState.sccBrakeFactor = ntune_scc_get('sccBrakeFactor')
@@ -1025,26 +1027,26 @@ class Controls:
     self.prof.checkpoint("Ratekeeper", ignore=True)
 
     # Sample data from sockets and get a carState
-    CS = self.data_sample()
+    with self.prof.scope("data_sample"):
+      CS = self.data_sample()
     cloudlog.timestamp("Data sampled")
-    self.prof.checkpoint("Sample")
 
-    self.update_events(CS)
+    with self.prof.scope("update_events"):
+      self.update_events(CS)
     cloudlog.timestamp("Events updated")
 
     if not self.read_only and self.initialized:
       # Update control state
-      self.state_transition(CS)
-      self.prof.checkpoint("State transition")
+      with self.prof.scope("state_transition"):
+        self.state_transition(CS)
 
     # Compute actuators (runs PID loops and lateral MPC)
-    CC, lac_log = self.state_control(CS)
-
-    self.prof.checkpoint("State Control")
+    with self.prof.scope("state_control"):
+      CC, lac_log = self.state_control(CS)
 
     # Publish data
-    self.publish_logs(CS, start_time, CC, lac_log)
-    self.prof.checkpoint("Sent")
+    with self.prof.scope("publish_logs"):
+      self.publish_logs(CS, start_time, CC, lac_log)
 
     self.update_button_timers(CS.buttonEvents)
     self.CS_prev = CS
@@ -1053,7 +1055,6 @@ class Controls:
     while True:
       self.step()
       self.rk.monitor_time()
-      self.prof.display()
 
 def main(sm=None, pm=None, logcan=None):
   controls = Controls(sm, pm, logcan)
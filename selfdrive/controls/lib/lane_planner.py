@@ -6,6 +6,7 @@ from common.realtime import DT_MDL
 from selfdrive.hardware import EON, TICI
 from selfdrive.swaglog import cloudlog
 from common.params import Params
+from common.params_cache import cached_params
 from decimal import Decimal
 from selfdrive.ntune import ntune_common_get, ntune_common_enabled
 
@@ -80,7 +81,7 @@ class LanePlanner:
     self.lp_timer += DT_MDL
     if self.lp_timer > 1.0:
       self.lp_timer = 0.0
-      self.camera_offset = ntune_common_get('cameraOffset') if Params().get_bool('UseNpilotManager') else -(float(Decimal(Params().get("CameraOffsetAdj", encoding="utf8")) * Decimal('0.001')))  # m from center car to camera
+      self.camera_offset = ntune_common_get('cameraOffset') if cached_params().get_bool('UseNpilotManager') else -cached_params().get_scaled("CameraOffsetAdj", '0.001', -0.01)  # m from center car to camera
 
     #opkr
     if self.drive_close_to_edge:
@@ -5,7 +5,7 @@ from common.numpy_fast import interp
 from selfdrive.controls.lib.latcontrol import LatControl, MIN_STEER_SPEED
 from selfdrive.controls.lib.pid import PIDController
 from selfdrive.controls.lib.vehicle_model import ACCELERATION_DUE_TO_GRAVITY
-from common.params import Params
+from common.params_cache import cached_params
 from decimal import Decimal
 from selfdrive.ntune import ntune_torque_get
 
@@ -63,9 +63,9 @@ class LatControlTorque(LatControl):
       lateral_accel_deadzone = curvature_deadzone * CS.vEgo ** 2
 
       try:
-        isLowSpeed  = ntune_torque_get('isLowSpeedFactor') if Params().get_bool('UseNpilotManager') else Params().get_bool('IsLowSpeedFactor')
+        isLowSpeed  = ntune_torque_get('isLowSpeedFactor') if cached_params().get_bool('UseNpilotManager') else cached_params().get_bool('IsLowSpeedFactor')
       except:
-        isLowSpeed  = Params().get_bool('IsLowSpeedFactor')
+        isLowSpeed  = cached_params().get_bool('IsLowSpeedFactor')
 
       if isLowSpeed:
         #low_speed_factor = interp(CS.vEgo, [0, 10, 20], [100, 75, 75])
@@ -125,14 +125,13 @@ class LateralMpc():
     self.x_sol = np.zeros((N+1, X_DIM))
     self.u_sol = np.zeros((N, 1))
     self.yref = np.zeros((N+1, 3))
-    for i in range(N):
-      self.solver.cost_set(i, "yref", self.yref[i])
+    self.p = np.zeros((N+1, P_DIM))
+    self.solver.set_all("yref", self.yref[:N])
     self.solver.cost_set(N, "yref", self.yref[N][:2])
 
     # Somehow needed for stable init
-    for i in range(N+1):
-      self.solver.set(i, 'x', np.zeros(X_DIM))
-      self.solver.set(i, 'p', np.zeros(P_DIM))
+    self.solver.set_all('x', self.x_sol)
+    self.solver.set_all('p', self.p)
     self.solver.constraints_set(0, "lbx", x0)
     self.solver.constraints_set(0, "ubx", x0)
     self.solver.solve()
@@ -157,20 +156,17 @@ class LateralMpc():
     # rotation_radius = p_cp[1]
     self.yref[:,1] = heading_pts*(v_ego+5.0)
     self.yref[:,2] = curv_rate_pts * (v_ego+5.0) * 4.0
-    for i in range(N):
-      self.solver.cost_set(i, "yref", self.yref[i])
-      self.solver.set(i, "p", p_cp)
-    self.solver.set(N, "p", p_cp)
+    self.p[:] = p_cp
+    self.solver.set_all("yref", self.yref[:N])
+    self.solver.set_all("p", self.p)
     self.solver.cost_set(N, "yref", self.yref[N][:2])
 
     t = sec_since_boot()
     self.solution_status = self.solver.solve()
     self.solve_time = sec_since_boot() - t
 
-    for i in range(N+1):
-      self.x_sol[i] = self.solver.get(i, 'x')
-    for i in range(N):
-      self.u_sol[i] = self.solver.get(i, 'u')
+    self.solver.get_all('x', self.x_sol)
+    self.solver.get_all('u', self.u_sol)
     self.cost = self.solver.get_cost()
 
 
@@ -8,7 +8,7 @@ from selfdrive.swaglog import cloudlog
 from selfdrive.modeld.constants import index_function
 from selfdrive.controls.lib.radar_helpers import _LEAD_ACCEL_TAU
 from common.conversions import Conversions as CV
-from common.params import Params
+from common.params_cache import cached_params
 from common.realtime import DT_MDL
 from common.filter_simple import FirstOrderFilter
 from common.filter_simple import StreamingMovingAverage
@@ -250,7 +250,7 @@ class LongitudinalMpc:
     self.tFollowRatio = 1.0
     self.stopDistance = STOP_DISTANCE #선행차와 정지하는 거리를 입력한다.
     self.softHoldTimer = 0
-    self.lo_timer = 0 
+    self.lo_timer = 0
     self.v_cruise = 0.
     self.xStopFilter = StreamingMovingAverage(3)  #11
     self.xStopFilter2 = StreamingMovingAverage(15) #3
@@ -285,8 +285,7 @@ class LongitudinalMpc:
     self.prev_a = np.array(self.a_solution)
     self.j_solution = np.zeros(N)
     self.yref = np.zeros((N+1, COST_DIM))
-    for i in range(N):
-      self.solver.cost_set(i, "yref", self.yref[i])
+    self.solver.set_all("yref", self.yref[:N])
     self.solver.cost_set(N, "yref", self.yref[N][:COST_E_DIM])
     self.x_sol = np.zeros((N+1, X_DIM))
     self.u_sol = np.zeros((N,1))
@@ -296,8 +295,7 @@ class LongitudinalMpc:
     self.xState = "CRUISE"
     self.startSignCount = 0
     self.stopSignCount = 0
-    for i in range(N+1):
-      self.solver.set(i, 'x', np.zeros(X_DIM))
+    self.solver.set_all('x', self.x_sol)
     self.last_cloudlog_t = 0
     self.status = False
     self.crash_cnt = 0.0
@@ -372,8 +370,7 @@ class LongitudinalMpc:
     self.x0[1] = v
     self.x0[2] = a
     if abs(v_prev - v) > 2.:  # probably only helps if v < v_prev
-      for i in range(0, N+1):
-        self.solver.set(i, 'x', self.x0)
+      self.solver.set_all('x', np.tile(self.x0, (N+1, 1)))
 
   @staticmethod
   def extrapolate_lead(x_lead, v_lead, a_lead, a_lead_tau):
@@ -407,6 +404,44 @@ class LongitudinalMpc:
     lead_xv = self.extrapolate_lead(x_lead, v_lead, a_lead, a_lead_tau)
     return lead_xv
 
+  def read_params(self):
+    params = cached_params()
+    if params.enabled:
+      # cached reads, an edited param is picked up on the next cycle
+      step = None
+    else:
+      # every read opens a file without the cache, spread them over 200 frames
+      self.lo_timer = (self.lo_timer + 1) % 200
+      if self.lo_timer % 20 != 0:
+        return
+      step = self.lo_timer // 20
+
+    # defaults as set by the manager
+    if step in (None, 0):
+      self.XEgoObstacleCost = float(params.get_int("XEgoObstacleCost", 6))
+      self.JEgoCost = float(params.get_int("JEgoCost", 5))
+    if step in (None, 1):
+      self.AChangeCost = float(params.get_int("AChangeCost", 150))
+      self.DangerZoneCost = float(params.get_int("DangerZoneCost", 100))
+    if step in (None, 2):
+      self.leadDangerFactor = float(params.get_int("LeadDangerFactor", 75)) * 0.01
+      self.trafficStopDistanceAdjust = float(params.get_int("TrafficStopDistanceAdjust", 400)) / 100.
+    if step in (None, 3):
+      self.applyLongDynamicCost = params.get_bool("ApplyLongDynamicCost")
+      self.trafficStopAccel = float(params.get_int("TrafficStopAccel", 80)) / 100.
+    if step in (None, 4):
+      self.trafficStopModelSpeed = params.get_bool("TrafficStopModelSpeed")
+      self.stopDistance = float(params.get_int("StopDistance", 600)) / 100.
+    if step in (None, 5):
+      self.e2eDecelSpeed = float(params.get_int("E2eDecelSpeed", 90))
+      self.applyDynamicTFollow = float(params.get_int("ApplyDynamicTFollow", 110)) / 100.
+    if step in (None, 6):
+      self.applyDynamicTFollowApart = float(params.get_int("ApplyDynamicTFollowApart", 95)) / 100.
+      self.applyDynamicTFollowDecel = float(params.get_int("ApplyDynamicTFollowDecel", 110)) / 100.
+    if step in (None, 7):
+      self.tFollowRatio = float(params.get_int("TFollowRatio", 100)) / 100.
+      self.softHoldMode = params.get_int("SoftHoldMode", 1)
+
   def set_accel_limits(self, min_a, max_a):
     # TODO this sets a max accel limit, but the minimum limit is only for cruise decel
     # needs refactor
@@ -418,32 +453,7 @@ class LongitudinalMpc:
     a_ego = carstate.aEgo
 
     model_x = model.position.x[-1]
-    self.lo_timer += 1
-    if self.lo_timer > 200:
-      self.lo_timer = 0
-      self.XEgoObstacleCost = float(int(Params().get("XEgoObstacleCost", encoding="utf8")))
-      self.JEgoCost = float(int(Params().get("JEgoCost", encoding="utf8")))
-    elif self.lo_timer == 20:
-      self.AChangeCost = float(int(Params().get("AChangeCost", encoding="utf8")))
-      self.DangerZoneCost = float(int(Params().get("DangerZoneCost", encoding="utf8")))
-    elif self.lo_timer == 40:
-      self.leadDangerFactor = float(int(Params().get("LeadDangerFactor", encoding="utf8"))) * 0.01
-      self.trafficStopDistanceAdjust = float(int(Params().get("TrafficStopDistanceAdjust", encoding="utf8"))) / 100.
-    elif self.lo_timer == 60:
-      self.applyLongDynamicCost = Params().get_bool("ApplyLongDynamicCost")
-      self.trafficStopAccel = float(int(Params().get("TrafficStopAccel", encoding="utf8"))) / 100.
-    elif self.lo_timer == 80:
-      self.trafficStopModelSpeed = Params().get_bool("TrafficStopModelSpeed")
-      self.stopDistance = float(int(Params().get("StopDistance", encoding="utf8"))) / 100.
-    elif self.lo_timer == 100:
-      self.e2eDecelSpeed = float(int(Params().get("E2eDecelSpeed", encoding="utf8")))
-      self.applyDynamicTFollow = float(int(Params().get("ApplyDynamicTFollow", encoding="utf8"))) / 100.
-    elif self.lo_timer == 120:
-      self.applyDynamicTFollowApart = float(int(Params().get("ApplyDynamicTFollowApart", encoding="utf8"))) / 100.
-      self.applyDynamicTFollowDecel = float(int(Params().get("ApplyDynamicTFollowDecel", encoding="utf8"))) / 100.
-    elif self.lo_timer == 140:
-      self.tFollowRatio = float(int(Params().get("TFollowRatio", encoding="utf8"))) / 100.     
-      self.softHoldMode = int(Params().get("SoftHoldMode", encoding="utf8"))
+    self.read_params()
 
     self.trafficState = 0
 
@@ -626,8 +636,7 @@ class LongitudinalMpc:
     self.yref[:,2] = v
     self.yref[:,3] = a
     self.yref[:,5] = j
-    for i in range(N):
-      self.solver.set(i, "yref", self.yref[i])
+    self.solver.set_all("yref", self.yref[:N])
     self.solver.set(N, "yref", self.yref[N][:COST_E_DIM])
 
     self.params[:,2] = np.min(x_obstacles, axis=1)
@@ -665,8 +674,7 @@ class LongitudinalMpc:
   def run(self):
     # t0 = sec_since_boot()
     # reset = 0
-    for i in range(N+1):
-      self.solver.set(i, 'p', self.params[i])
+    self.solver.set_all('p', self.params)
     self.solver.constraints_set(0, "lbx", self.x0)
     self.solver.constraints_set(0, "ubx", self.x0)
 
@@ -682,10 +690,8 @@ class LongitudinalMpc:
     # print(f"long_mpc residuals: {res[0]:.2e}, {res[1]:.2e}, {res[2]:.2e}, {res[3]:.2e}")
     # self.solver.print_statistics()
 
-    for i in range(N+1):
-      self.x_sol[i] = self.solver.get(i, 'x')
-    for i in range(N):
-      self.u_sol[i] = self.solver.get(i, 'u')
+    self.solver.get_all('x', self.x_sol)
+    self.solver.get_all('u', self.u_sol)
 
     self.v_solution = self.x_sol[:,1]
     self.a_solution = self.x_sol[:,2]
@@ -1,6 +1,4 @@
-from common.numpy_fast import mean
-from common.kalman.simple_kalman import KF1D
-
+import numpy as np
 
 # Default lead acceleration decay set to 50% at 1s
 _LEAD_ACCEL_TAU = 1.5
@@ -8,160 +6,150 @@ _LEAD_ACCEL_TAU = 1.5
 # Hack to maintain vision lead state
 _vision_lead_aTau = {0: _LEAD_ACCEL_TAU, 1: _LEAD_ACCEL_TAU}
 
-# radar tracks
-SPEED, ACCEL = 0, 1   # Kalman filter states enum
-
 # stationary qualification parameters
 v_ego_stationary = 4.   # no stationary object flag below this speed
 
 RADAR_TO_CENTER = 2.7   # (deprecated) RADAR is ~ 2.7m ahead from center of car
 RADAR_TO_CAMERA = 1.52   # RADAR is ~ 1.5m ahead from center of mesh frame
 
-class Track():
-  def __init__(self, v_lead, kalman_params):
-    self.cnt = 0
-    self.aLeadTau = _LEAD_ACCEL_TAU
-    self.K_A = kalman_params.A
-    self.K_C = kalman_params.C
-    self.K_K = kalman_params.K
-    self.kf = KF1D([[v_lead], [0.0]], self.K_A, self.K_C, self.K_K)
-
-  def update(self, d_rel, y_rel, v_rel, v_lead, measured):
-    # relative values, copy
-    self.dRel = d_rel   # LONG_DIST
-    self.yRel = y_rel   # -LAT_DIST
-    self.vRel = v_rel   # REL_SPEED
-    self.vLead = v_lead
-    self.measured = measured   # measured or estimate
 
-    # computed velocity and accelerations
-    if self.cnt > 0:
-      self.kf.update(self.vLead)
+class Tracks():
+  """Radar tracks as arrays sorted by trackId, the lead Kalman filters of all
+     tracks are stepped together."""
+  def __init__(self, kalman_params):
+    A, C, K = kalman_params.A, kalman_params.C, kalman_params.K
+    self.K0, self.K1 = K[0][0], K[1][0]
+    self.A_K = [A[0][0] - self.K0 * C[0], A[0][1] - self.K0 * C[1],
+                A[1][0] - self.K1 * C[0], A[1][1] - self.K1 * C[1]]
+
+    self.ids = np.zeros(0, dtype=np.uint64)
+    self.dRel = np.zeros(0)       # LONG_DIST
+    self.yRel = np.zeros(0)       # -LAT_DIST
+    self.vRel = np.zeros(0)       # REL_SPEED
+    self.vLead = np.zeros(0)
+    self.measured = np.zeros(0, dtype=bool)   # measured or estimate
+    self.cnt = np.zeros(0, dtype=np.int64)
+    # Kalman filter states, speed and accel
+    self.vLeadK = np.zeros(0)
+    self.aLeadK = np.zeros(0)
+    self.aLeadTau = np.zeros(0)
+
+  def __len__(self):
+    return len(self.ids)
+
+  def update(self, ids, d_rel, y_rel, v_rel, v_lead, measured):
+    # the last point wins if a trackId is repeated, new tracks start with a fresh filter
+    last = len(ids) - 1 - np.unique(ids[::-1], return_index=True)[1]
+    ids = ids[last]
+    v_lead = v_lead[last]
+
+    if len(self.ids):
+      prev = np.minimum(np.searchsorted(self.ids, ids), len(self.ids) - 1)
+      existing = self.ids[prev] == ids
+      cnt = np.where(existing, self.cnt[prev], 0)
+      x0 = np.where(existing, self.vLeadK[prev], v_lead)
+      x1 = np.where(existing, self.aLeadK[prev], 0.)
+      a_lead_tau = np.where(existing, self.aLeadTau[prev], _LEAD_ACCEL_TAU)
+    else:
+      cnt = np.zeros(len(ids), dtype=np.int64)
+      x0, x1 = v_lead, np.zeros(len(ids))
+      a_lead_tau = np.full(len(ids), _LEAD_ACCEL_TAU)
 
-    self.vLeadK = float(self.kf.x[SPEED][0])
-    self.aLeadK = float(self.kf.x[ACCEL][0])
+    # computed velocity and accelerations
+    step = cnt > 0
+    A_K = self.A_K
+    self.vLeadK = np.where(step, A_K[0] * x0 + A_K[1] * x1 + self.K0 * v_lead, x0)
+    self.aLeadK = np.where(step, A_K[2] * x0 + A_K[3] * x1 + self.K1 * v_lead, x1)
 
     # Learn if constant acceleration
-    if abs(self.aLeadK) < 0.5:
-      self.aLeadTau = _LEAD_ACCEL_TAU
-    else:
-      self.aLeadTau *= 0.9
+    self.aLeadTau = np.where(np.abs(self.aLeadK) < 0.5, _LEAD_ACCEL_TAU, a_lead_tau * 0.9)
 
-    self.cnt += 1
+    self.ids = ids
+    self.dRel = d_rel[last]
+    self.yRel = y_rel[last]
+    self.vRel = v_rel[last]
+    self.vLead = v_lead
+    self.measured = measured[last]
+    self.cnt = cnt + 1
 
-  def get_key_for_cluster(self):
+  def keys_for_cluster(self):
     # Weigh y higher since radar is inaccurate in this dimension
-    return [self.dRel, self.yRel*2, self.vRel]
-
-  def reset_a_lead(self, aLeadK, aLeadTau):
-    self.kf = KF1D([[self.vLead], [aLeadK]], self.K_A, self.K_C, self.K_K)
-    self.aLeadK = aLeadK
-    self.aLeadTau = aLeadTau
-
-
-class Cluster():
-  def __init__(self):
-    self.tracks = set()
-
-  def add(self, t):
-    # add the first track
-    self.tracks.add(t)
-
-  # TODO: make generic
-  @property
-  def dRel(self):
-    return mean([t.dRel for t in self.tracks])
-
-  @property
-  def yRel(self):
-    return mean([t.yRel for t in self.tracks])
-
-  @property
-  def vRel(self):
-    return mean([t.vRel for t in self.tracks])
-
-  @property
-  def aRel(self):
-    return mean([t.aRel for t in self.tracks])
-
-  @property
-  def vLead(self):
-    return mean([t.vLead for t in self.tracks])
-
-  @property
-  def dPath(self):
-    return mean([t.dPath for t in self.tracks])
-
-  @property
-  def vLat(self):
-    return mean([t.vLat for t in self.tracks])
-
-  @property
-  def vLeadK(self):
-    return mean([t.vLeadK for t in self.tracks])
-
-  @property
-  def aLeadK(self):
-    if all(t.cnt <= 1 for t in self.tracks):
-      return 0.
-    else:
-      return mean([t.aLeadK for t in self.tracks if t.cnt > 1])
-
-  @property
-  def aLeadTau(self):
-    if all(t.cnt <= 1 for t in self.tracks):
-      return _LEAD_ACCEL_TAU
-    else:
-      return mean([t.aLeadTau for t in self.tracks if t.cnt > 1])
-
-  @property
-  def measured(self):
-    return any(t.measured for t in self.tracks)
-
-  def get_RadarState(self, model_prob=0.0):
+    return np.column_stack((self.dRel, self.yRel * 2, self.vRel))
+
+  def reset_a_lead(self, mask, aLeadK, aLeadTau):
+    self.vLeadK[mask] = self.vLead[mask]
+    self.aLeadK[mask] = aLeadK
+    self.aLeadTau[mask] = aLeadTau
+
+
+class Clusters():
+  """Per cluster means of the tracks, computed once from the cluster label of each track."""
+  def __init__(self, tracks, labels):
+    labels = np.asarray(labels, dtype=np.int64)
+    self.n = int(labels.max()) + 1 if len(labels) else 0
+    n = self.n
+
+    count = np.bincount(labels, minlength=n)
+    self.dRel = np.bincount(labels, tracks.dRel, n) / count
+    self.yRel = np.bincount(labels, tracks.yRel, n) / count
+    self.vRel = np.bincount(labels, tracks.vRel, n) / count
+    self.vLead = np.bincount(labels, tracks.vLead, n) / count
+    self.vLeadK = np.bincount(labels, tracks.vLeadK, n) / count
+    self.measured = np.bincount(labels, tracks.measured, n) > 0
+
+    # accel of tracks that have been filtered at least once
+    old = tracks.cnt > 1
+    old_count = np.bincount(labels[old], minlength=n)
+    has_old = old_count > 0
+    safe_count = np.maximum(old_count, 1)
+    self.aLeadK = np.where(has_old, np.bincount(labels[old], tracks.aLeadK[old], n) / safe_count, 0.)
+    self.aLeadTau = np.where(has_old, np.bincount(labels[old], tracks.aLeadTau[old], n) / safe_count, _LEAD_ACCEL_TAU)
+
+  def __len__(self):
+    return self.n
+
+  def get_RadarState(self, i, model_prob=0.0):
     return {
-      "dRel": float(self.dRel),
-      "yRel": float(self.yRel),
-      "vRel": float(self.vRel),
-      "vLead": float(self.vLead),
-      "vLeadK": float(self.vLeadK),
-      "aLeadK": float(self.aLeadK),
+      "dRel": float(self.dRel[i]),
+      "yRel": float(self.yRel[i]),
+      "vRel": float(self.vRel[i]),
+      "vLead": float(self.vLead[i]),
+      "vLeadK": float(self.vLeadK[i]),
+      "aLeadK": float(self.aLeadK[i]),
       "status": True,
-      "fcw": self.is_potential_fcw(model_prob),
+      "fcw": is_potential_fcw(model_prob),
       "modelProb": model_prob,
       "radar": True,
-      "aLeadTau": float(self.aLeadTau)
+      "aLeadTau": float(self.aLeadTau[i])
     }
 
-  def get_RadarState_from_vision(self, lead_msg, lead_index, v_ego):
-    # Learn if constant acceleration
-    if abs(float(lead_msg.a[0])) < 0.5:
-      _vision_lead_aTau[lead_index] = _LEAD_ACCEL_TAU
-    else:
-      _vision_lead_aTau[lead_index] *= 0.9
-
-    return {
-      "dRel": float(lead_msg.x[0] - RADAR_TO_CAMERA),
-      "yRel": float(-lead_msg.y[0]),
-      "vRel": float(lead_msg.v[0] - v_ego),
-      "vLead": float(lead_msg.v[0]),
-      "vLeadK": float(lead_msg.v[0]),
-      "aLeadK": float(lead_msg.a[0]),
-      "aLeadTau": _vision_lead_aTau[lead_index],
-      "fcw": False,
-      "modelProb": float(lead_msg.prob),
-      "radar": False,
-      "status": True
-    }
-
-  def __str__(self):
-    ret = f"x: {self.dRel:4.1f}  y: {self.yRel:4.1f}  v: {self.vRel:4.1f}  a: {self.aLeadK:4.1f}"
-    return ret
-
   def potential_low_speed_lead(self, v_ego):
     # stop for stuff in front of you and low speed, even without model confirmation
     # Radar points closer than 0.75, are almost always glitches on toyota radars
-    return abs(self.yRel) < 1.0 and (v_ego < v_ego_stationary) and (0.75 < self.dRel < 25)
-
-  def is_potential_fcw(self, model_prob):
-    return model_prob > .9
+    return (np.abs(self.yRel) < 1.0) & (v_ego < v_ego_stationary) & (0.75 < self.dRel) & (self.dRel < 25)
+
+
+def get_RadarState_from_vision(lead_msg, lead_index, v_ego):
+  # Learn if constant acceleration
+  if abs(float(lead_msg.a[0])) < 0.5:
+    _vision_lead_aTau[lead_index] = _LEAD_ACCEL_TAU
+  else:
+    _vision_lead_aTau[lead_index] *= 0.9
+
+  return {
+    "dRel": float(lead_msg.x[0] - RADAR_TO_CAMERA),
+    "yRel": float(-lead_msg.y[0]),
+    "vRel": float(lead_msg.v[0] - v_ego),
+    "vLead": float(lead_msg.v[0]),
+    "vLeadK": float(lead_msg.v[0]),
+    "aLeadK": float(lead_msg.a[0]),
+    "aLeadTau": _vision_lead_aTau[lead_index],
+    "fcw": False,
+    "modelProb": float(lead_msg.prob),
+    "radar": False,
+    "status": True
+  }
+
+
+def is_potential_fcw(model_prob):
+  return model_prob > .9
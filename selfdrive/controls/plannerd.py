@@ -9,6 +9,27 @@ from selfdrive.hardware import TICI
 import cereal.messaging as messaging
 
 
+def get_planners(params, CP):
+  use_lanelines = not params.get_bool('EndToEndToggle')
+  wide_camera = params.get_bool('EnableWideCamera') if TICI else False
+
+  cloudlog.event("e2e mode", on=use_lanelines)
+
+  longitudinal_planner = Planner(CP)
+  lateral_planner = LateralPlanner(CP, use_lanelines=use_lanelines, wide_camera=wide_camera)
+  return longitudinal_planner, lateral_planner
+
+
+def plannerd_step(sm, pm, longitudinal_planner, lateral_planner):
+  sm.update()
+
+  if sm.updated['modelV2']:
+    lateral_planner.update(sm)
+    lateral_planner.publish(sm, pm)
+    longitudinal_planner.update(sm)
+    longitudinal_planner.publish(sm, pm)
+
+
 def plannerd_thread(sm=None, pm=None):
   config_realtime_process(2, Priority.CTRL_LOW)
 
@@ -17,13 +38,7 @@ def plannerd_thread(sm=None, pm=None):
   CP = car.CarParams.from_bytes(params.get("CarParams", block=True))
   cloudlog.info("plannerd got CarParams: %s", CP.carName)
 
-  use_lanelines = not params.get_bool('EndToEndToggle')
-  wide_camera = params.get_bool('EnableWideCamera') if TICI else False
-
-  cloudlog.event("e2e mode", on=use_lanelines)
-
-  longitudinal_planner = Planner(CP)
-  lateral_planner = LateralPlanner(CP, use_lanelines=use_lanelines, wide_camera=wide_camera)
+  longitudinal_planner, lateral_planner = get_planners(params, CP)
 
   if sm is None:
     sm = messaging.SubMaster(['carControl', 'carState', 'controlsState', 'radarState', 'modelV2', 'liveMapData', 'liveParameters'],
@@ -33,13 +48,7 @@ def plannerd_thread(sm=None, pm=None):
     pm = messaging.PubMaster(['longitudinalPlan', 'lateralPlan'])
 
   while True:
-    sm.update()
-
-    if sm.updated['modelV2']:
-      lateral_planner.update(sm)
-      lateral_planner.publish(sm, pm)
-      longitudinal_planner.update(sm)
-      longitudinal_planner.publish(sm, pm)
+    plannerd_step(sm, pm, longitudinal_planner, lateral_planner)
 
 
 def main(sm=None, pm=None):
@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 import importlib
-import math
-from collections import defaultdict, deque
+from collections import deque
+
+import numpy as np
 
 import cereal.messaging as messaging
 from cereal import car
@@ -9,7 +10,7 @@ from common.numpy_fast import interp
 from common.params import Params
 from common.realtime import Ratekeeper, Priority, config_realtime_process
 from selfdrive.controls.lib.cluster.fastcluster_py import cluster_points_centroid
-from selfdrive.controls.lib.radar_helpers import Cluster, Track, RADAR_TO_CAMERA
+from selfdrive.controls.lib.radar_helpers import Clusters, Tracks, RADAR_TO_CAMERA, get_RadarState_from_vision
 from selfdrive.swaglog import cloudlog
 from selfdrive.hardware import TICI
 
@@ -38,30 +39,27 @@ class KalmanParams():
 
 def laplacian_cdf(x, mu, b):
   b = max(b, 1e-4)
-  return math.exp(-abs(x-mu)/b)
+  return np.exp(-np.abs(x-mu)/b)
 
 
 def match_vision_to_cluster(v_ego, lead, clusters):
   # match vision point to best statistical cluster match
   offset_vision_dist = lead.x[0] - RADAR_TO_CAMERA
 
-  def prob(c):
-    prob_d = laplacian_cdf(c.dRel, offset_vision_dist, lead.xStd[0])
-    prob_y = laplacian_cdf(c.yRel, -lead.y[0], lead.yStd[0])
-    prob_v = laplacian_cdf(c.vRel + v_ego, lead.v[0], lead.vStd[0])
-
-    # This is isn't exactly right, but good heuristic
-    return prob_d * prob_y * prob_v
+  prob_d = laplacian_cdf(clusters.dRel, offset_vision_dist, lead.xStd[0])
+  prob_y = laplacian_cdf(clusters.yRel, -lead.y[0], lead.yStd[0])
+  prob_v = laplacian_cdf(clusters.vRel + v_ego, lead.v[0], lead.vStd[0])
 
-  cluster = max(clusters, key=prob)
+  # This is isn't exactly right, but good heuristic
+  i = int(np.argmax(prob_d * prob_y * prob_v))
 
   # if no 'sane' match is found return -1
   # stationary radar points can be false positives
   #dist_sane = abs(cluster.dRel - offset_vision_dist) < max([(offset_vision_dist)*.25, 5.0])
-  dist_sane = abs(cluster.dRel - offset_vision_dist) < max([(offset_vision_dist)*.35, 5.0])
-  vel_sane = (abs(cluster.vRel + v_ego - lead.v[0]) < 10) or (v_ego + cluster.vRel > 3)
+  dist_sane = abs(clusters.dRel[i] - offset_vision_dist) < max([(offset_vision_dist)*.35, 5.0])
+  vel_sane = (abs(clusters.vRel[i] + v_ego - lead.v[0]) < 10) or (v_ego + clusters.vRel[i] > 3)
   if dist_sane and vel_sane:
-    return cluster
+    return i
   else:
     return None
 
@@ -75,18 +73,18 @@ def get_lead(v_ego, ready, clusters, lead_msg, lead_index, low_speed_override=Tr
 
   lead_dict = {'status': False}
   if cluster is not None:
-    lead_dict = cluster.get_RadarState(lead_msg.prob)
+    lead_dict = clusters.get_RadarState(cluster, lead_msg.prob)
   elif (cluster is None) and ready and (lead_msg.prob > .5):
-    lead_dict = Cluster().get_RadarState_from_vision(lead_msg, lead_index, v_ego)
+    lead_dict = get_RadarState_from_vision(lead_msg, lead_index, v_ego)
 
-  if low_speed_override:
-    low_speed_clusters = [c for c in clusters if c.potential_low_speed_lead(v_ego)]
+  if low_speed_override and len(clusters) > 0:
+    low_speed_clusters = np.flatnonzero(clusters.potential_low_speed_lead(v_ego))
     if len(low_speed_clusters) > 0:
-      closest_cluster = min(low_speed_clusters, key=lambda c: c.dRel)
+      closest_cluster = low_speed_clusters[np.argmin(clusters.dRel[low_speed_clusters])]
 
       # Only choose new cluster if it is actually closer than the previous one
-      if (not lead_dict['status']) or (closest_cluster.dRel < lead_dict['dRel']):
-        lead_dict = closest_cluster.get_RadarState()
+      if (not lead_dict['status']) or (clusters.dRel[closest_cluster] < lead_dict['dRel']):
+        lead_dict = clusters.get_RadarState(closest_cluster)
 
   return lead_dict
 
@@ -95,8 +93,8 @@ class RadarD():
   def __init__(self, radar_ts, delay=0):
     self.current_time = 0
 
-    self.tracks = defaultdict(dict)
     self.kalman_params = KalmanParams(radar_ts)
+    self.tracks = Tracks(self.kalman_params)
 
     # v_ego
     self.v_ego = 0.
@@ -113,54 +111,29 @@ class RadarD():
     if sm.updated['modelV2']:
       self.ready = True
 
-    ar_pts = {}
-    for pt in rr.points:
-      ar_pts[pt.trackId] = [pt.dRel, pt.yRel, pt.vRel, pt.measured]
-
-    # *** remove missing points from meta data ***
-    for ids in list(self.tracks.keys()):
-      if ids not in ar_pts:
-        self.tracks.pop(ids, None)
-
-    # *** compute the tracks ***
-    for ids in ar_pts:
-      rpt = ar_pts[ids]
-
-      # align v_ego by a fixed time to align it with the radar measurement
-      v_lead = rpt[2] + self.v_ego_hist[0]
-
-      # create the track if it doesn't exist or it's a new track
-      if ids not in self.tracks:
-        self.tracks[ids] = Track(v_lead, self.kalman_params)
-      self.tracks[ids].update(rpt[0], rpt[1], rpt[2], v_lead, rpt[3])
+    ids = np.array([pt.trackId for pt in rr.points], dtype=np.uint64)
+    pts = np.array([(pt.dRel, pt.yRel, pt.vRel, pt.measured) for pt in rr.points], dtype=np.float64).reshape(-1, 4)
+    d_rel, y_rel, v_rel = pts[:, 0], pts[:, 1], pts[:, 2]
 
-    idens = list(sorted(self.tracks.keys()))
-    track_pts = [self.tracks[iden].get_key_for_cluster() for iden in idens]
+    # *** compute the tracks, missing points are dropped ***
+    # align v_ego by a fixed time to align it with the radar measurement
+    tracks = self.tracks
+    tracks.update(ids, d_rel, y_rel, v_rel, v_rel + self.v_ego_hist[0], pts[:, 3] > 0)
 
     # If we have multiple points, cluster them
-    if len(track_pts) > 1:
-      cluster_idxs = cluster_points_centroid(track_pts, 2.5)
-      clusters = [None] * (max(cluster_idxs) + 1)
-
-      for idx in range(len(track_pts)):
-        cluster_i = cluster_idxs[idx]
-        if clusters[cluster_i] is None:
-          clusters[cluster_i] = Cluster()
-        clusters[cluster_i].add(self.tracks[idens[idx]])
-    elif len(track_pts) == 1:
+    if len(tracks) > 1:
+      cluster_idxs = cluster_points_centroid(tracks.keys_for_cluster(), 2.5)
+    elif len(tracks) == 1:
       # FIXME: cluster_point_centroid hangs forever if len(track_pts) == 1
       cluster_idxs = [0]
-      clusters = [Cluster()]
-      clusters[0].add(self.tracks[idens[0]])
     else:
-      clusters = []
+      cluster_idxs = []
+    cluster_idxs = np.array(cluster_idxs, dtype=np.int64)
+    clusters = Clusters(tracks, cluster_idxs)
 
     # if a new point, reset accel to the rest of the cluster
-    for idx in range(len(track_pts)):
-      if self.tracks[idens[idx]].cnt <= 1:
-        aLeadK = clusters[cluster_idxs[idx]].aLeadK
-        aLeadTau = clusters[cluster_idxs[idx]].aLeadTau
-        self.tracks[idens[idx]].reset_a_lead(aLeadK, aLeadTau)
+    new = tracks.cnt <= 1
+    tracks.reset_a_lead(new, clusters.aLeadK[cluster_idxs[new]], clusters.aLeadTau[cluster_idxs[new]])
 
     # *** publish radarState ***
     dat = messaging.new_message('radarState')
@@ -178,6 +151,36 @@ class RadarD():
     return dat
 
 
+def radard_step(RI, RD, sm, pm, can_strings, cum_lag_ms=0.):
+  """Runs one radard iteration on the drained can strings. Returns False if
+     they didn't complete a radar frame."""
+  rr = RI.update(can_strings)
+
+  if rr is None:
+    return False
+
+  sm.update(0)
+
+  dat = RD.update(sm, rr)
+  dat.radarState.cumLagMs = cum_lag_ms
+
+  pm.send('radarState', dat)
+
+  # *** publish tracks for UI debugging (keep last) ***
+  tracks = RD.tracks
+  dat = messaging.new_message('liveTracks', len(tracks))
+
+  for cnt in range(len(tracks)):
+    dat.liveTracks[cnt] = {
+      "trackId": int(tracks.ids[cnt]),
+      "dRel": float(tracks.dRel[cnt]),
+      "yRel": float(tracks.yRel[cnt]),
+      "vRel": float(tracks.vRel[cnt]),
+    }
+  pm.send('liveTracks', dat)
+  return True
+
+
 # fuses camera and radar data for best lead detection
 def radard_thread(sm=None, pm=None, can_sock=None):
   config_realtime_process(5 if TICI else 2, Priority.CTRL_LOW)
@@ -206,32 +209,8 @@ def radard_thread(sm=None, pm=None, can_sock=None):
 
   while 1:
     can_strings = messaging.drain_sock_raw(can_sock, wait_for_one=True)
-    rr = RI.update(can_strings)
-
-    if rr is None:
-      continue
-
-    sm.update(0)
-
-    dat = RD.update(sm, rr)
-    dat.radarState.cumLagMs = -rk.remaining*1000.
-
-    pm.send('radarState', dat)
-
-    # *** publish tracks for UI debugging (keep last) ***
-    tracks = RD.tracks
-    dat = messaging.new_message('liveTracks', len(tracks))
-
-    for cnt, ids in enumerate(sorted(tracks.keys())):
-      dat.liveTracks[cnt] = {
-        "trackId": ids,
-        "dRel": float(tracks[ids].dRel),
-        "yRel": float(tracks[ids].yRel),
-        "vRel": float(tracks[ids].vRel),
-      }
-    pm.send('liveTracks', dat)
-
-    rk.monitor_time()
+    if radard_step(RI, RD, sm, pm, can_strings, -rk.remaining*1000.):
+      rk.monitor_time()
 
 
 def main(sm=None, pm=None, can_sock=None):
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+import time
+import random
+import argparse
+
+from panda import DLC_TO_LEN, LEN_TO_DLC, pack_can_buffer, unpack_can_buffer, unpack_can_buffer_array
+
+CANPACKET_HEAD_SIZE = 5
+
+
+# the byte concatenating implementation the panda library had before, as the reference
+def legacy_pack_can_buffer(arr):
+  snds = [b'']
+  idx = 0
+  for address, _, dat, bus in arr:
+    assert len(dat) in LEN_TO_DLC
+    extended = 1 if address >= 0x800 else 0
+    data_len_code = LEN_TO_DLC[len(dat)]
+    header = bytearray(5)
+    word_4b = address << 3 | extended << 2
+    header[0] = (data_len_code << 4) | (bus << 1)
+    header[1] = word_4b & 0xFF
+    header[2] = (word_4b >> 8) & 0xFF
+    header[3] = (word_4b >> 16) & 0xFF
+    header[4] = (word_4b >> 24) & 0xFF
+    snds[idx] += header + dat
+    if len(snds[idx]) > 256:
+      snds.append(b'')
+      idx += 1
+
+  for idx in range(len(snds)):
+    tx = b''
+    counter = 0
+    for i in range(0, len(snds[idx]), 63):
+      tx += bytes([counter]) + snds[idx][i:i+63]
+      counter += 1
+    snds[idx] = tx
+  return snds
+
+
+def legacy_unpack_can_buffer(dat):
+  ret = []
+  counter = 0
+  tail = bytearray()
+  for i in range(0, len(dat), 64):
+    if counter != dat[i]:
+      break
+    counter += 1
+    chunk = tail + dat[i+1:i+64]
+    tail = bytearray()
+    pos = 0
+    while pos < len(chunk):
+      data_len = DLC_TO_LEN[(chunk[pos] >> 4)]
+      pckt_len = CANPACKET_HEAD_SIZE + data_len
+      if pckt_len <= len(chunk[pos:]):
+        header = chunk[pos:pos+CANPACKET_HEAD_SIZE]
+        bus = (header[0] >> 1) & 0x7
+        address = (header[4] << 24 | header[3] << 16 | header[2] << 8 | header[1]) >> 3
+        returned = (header[1] >> 1) & 0x1
+        rejected = header[1] & 0x1
+        data = chunk[pos + CANPACKET_HEAD_SIZE:pos + CANPACKET_HEAD_SIZE + data_len]
+        if returned:
+          bus += 128
+        if rejected:
+          bus += 192
+        ret.append((address, 0, data, bus))
+        pos += pckt_len
+      else:
+        tail = chunk[pos:]
+        break
+  return ret
+
+
+def random_frames(n, fd=False):
+  lens = DLC_TO_LEN if fd else DLC_TO_LEN[:9]
+  return [(random.choice([random.randrange(0x800), random.randrange(0x800, 1 << 29)]), 0,
+           bytes(random.getrandbits(8) for _ in range(random.choice(lens))), random.randrange(3)) for _ in range(n)]
+
+
+def recv_buffer(frames):
+  # what the panda sends on a receive, one continuous stream with the same framing as a send
+  stream = b"".join(s[i + 1:i + 64] for s in legacy_pack_can_buffer(frames) for i in range(0, len(s), 64))
+  return b"".join(bytes([c]) + stream[i:i + 63] for c, i in enumerate(range(0, len(stream), 63)))
+
+
+def bench(name, f, arg, frames, seconds):
+  calls = 0
+  start = time.monotonic()
+  while time.monotonic() - start < seconds:
+    f(arg)
+    calls += 1
+  rate = calls * frames / (time.monotonic() - start)
+  print(f"  {name:28} {rate / 1e3:9.1f}k frames/s")
+  return rate
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Compares the panda CAN buffer packing to the previous implementation")
+  parser.add_argument("--frames", type=int, default=256, help="frames per call, about one can_recv at 3 busses")
+  parser.add_argument("--seconds", type=float, default=2.)
+  parser.add_argument("--fd", action="store_true", help="CAN FD frame lengths")
+  args = parser.parse_args()
+
+  random.seed(0)
+  frames = random_frames(args.frames, args.fd)
+  # counters of the receive buffer go up to 255, keep it to one bulk read
+  recv_frames = frames[:16384 // 64 * 63 // (CANPACKET_HEAD_SIZE + (64 if args.fd else 8)) - 1]
+  dat = recv_buffer(recv_frames)
+
+  assert [bytes(s) for s in pack_can_buffer(frames)] == [bytes(s) for s in legacy_pack_can_buffer(frames)]
+  assert [(a, b, bytes(d), bus) for a, b, d, bus in unpack_can_buffer(dat)] == \
+         [(a, b, bytes(d), bus) for a, b, d, bus in legacy_unpack_can_buffer(dat)]
+  arr = unpack_can_buffer_array(dat)
+  assert [(int(r['address']), bytes(r['data'][:r['len']]), int(r['bus'])) for r in arr] == \
+         [(a, bytes(d), bus) for a, _, d, bus in recv_frames]
+
+  print(f"pack, {args.frames} frames per call")
+  old = bench("legacy", legacy_pack_can_buffer, frames, args.frames, args.seconds)
+  new = bench("pack_can_buffer", pack_can_buffer, frames, args.frames, args.seconds)
+  print(f"  speedup {new / old:.2f}x")
+
+  print(f"unpack, {len(recv_frames)} frames per call")
+  old = bench("legacy", legacy_unpack_can_buffer, dat, len(recv_frames), args.seconds)
+  new = bench("unpack_can_buffer", unpack_can_buffer, dat, len(recv_frames), args.seconds)
+  arr = bench("unpack_can_buffer_array", unpack_can_buffer_array, dat, len(recv_frames), args.seconds)
+  print(f"  speedup {new / old:.2f}x, array {arr / old:.2f}x")
@@ -96,8 +96,8 @@ if __name__ == "__main__":
 
   init_lr, new_lr = None, None
   if args.init:
-    init_lr = logreader_from_route_or_segment(args.init)
+    init_lr = logreader_from_route_or_segment(args.init, services=['can'])
   if args.comp:
-    new_lr = logreader_from_route_or_segment(args.comp)
+    new_lr = logreader_from_route_or_segment(args.comp, services=['can'])
 
   can_printer(args.bus, init_msgs=init_lr, new_msgs=new_lr, table=args.table)
@@ -0,0 +1,14 @@
+#!/usr/bin/env python3
+import sys
+import time
+
+from common.profiler import read_stats
+
+# Prints the live timings of a process started with profiling on, e.g. PROFILE_CONTROLSD=1
+if __name__ == "__main__":
+  name = sys.argv[1] if len(sys.argv) > 1 else "controlsd"
+  while True:
+    print(f"\n{'checkpoint':>40}  {'p50':>7}  {'p99':>7}  {'max':>7}  {'count':>8}")
+    for n, s in sorted(read_stats(name).items()):
+      print(f"{n:>40}  {s['p50']:7.2f}  {s['p99']:7.2f}  {s['max']:7.2f}  {s['count']:8d}")
+    time.sleep(1)
@@ -7,5 +7,5 @@ from tools.lib.logreader import LogReader
 
 if __name__ == "__main__":
   r = Route(sys.argv[1])
-  cp = [m for m in LogReader(r.qlog_paths()[0]) if m.which() == 'carParams']
+  cp = list(LogReader(r.qlog_paths()[0], services=['carParams']))
   Params().put("CarParams", cp[0].carParams.as_builder().to_bytes())
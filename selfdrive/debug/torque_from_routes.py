@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+import argparse
+
+from selfdrive.locationd.torqued import SERVICES, estimate_logs
+from tools.lib.route import Route
+from tools.lib.logreader import MultiLogIterator
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Runs the live torque estimator over the logs of several routes")
+  parser.add_argument("--qlog", action="store_true", help="use qlogs instead of rlogs")
+  parser.add_argument("routes", nargs="+")
+  args = parser.parse_args()
+
+  CP = None
+  logs = []
+  for name in args.routes:
+    route = Route(name)
+    paths = route.qlog_paths() if args.qlog else route.log_paths()
+    lr = list(MultiLogIterator([p for p in paths if p is not None], services=SERVICES + ['carParams']))
+    if CP is None:
+      CP = next((m.carParams for m in lr if m.which() == "carParams"), None)
+    logs.append(lr)
+
+  if CP is None:
+    raise SystemExit("no carParams in the logs")
+
+  ltp = estimate_logs(CP, logs, decimated=args.qlog).liveTorqueParameters
+  print(f"points: {ltp.totalBucketPoints}  valid: {ltp.liveValid}")
+  print(f"latAccelFactor: {ltp.latAccelFactorRaw:.4f}  latAccelOffset: {ltp.latAccelOffsetRaw:.4f}  friction: {ltp.frictionCoefficientRaw:.4f}")
+  print(f"filtered latAccelFactor: {ltp.latAccelFactorFiltered:.4f}  latAccelOffset: {ltp.latAccelOffsetFiltered:.4f}  friction: {ltp.frictionCoefficientFiltered:.4f}")
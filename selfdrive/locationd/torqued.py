@@ -17,8 +17,6 @@ HISTORY = 5  # secs
 POINTS_PER_BUCKET = 1500
 MIN_POINTS_TOTAL = 4000
 MIN_POINTS_TOTAL_QLOG = 600
-FIT_POINTS_TOTAL = 2000
-FIT_POINTS_TOTAL_QLOG = 600
 MIN_VEL = 15  # m/s
 FRICTION_FACTOR = 1.5  # ~85% of data coverage
 FACTOR_SANITY = 0.3
@@ -34,6 +32,7 @@ MAX_INVALID_THRESHOLD = 10
 MIN_ENGAGE_BUFFER = 2  # secs
 
 VERSION = 1  # bump this to invalidate old parameter caches
+SERVICES = ['carControl', 'carState', 'liveLocationKalman']
 
 def slope2rot(slope):
   sin = np.sqrt(slope**2 / (slope**2 + 1))
@@ -42,19 +41,37 @@ def slope2rot(slope):
 
 
 class NPQueue:
+  """Ring buffer of rows that keeps the scatter matrix sum(row * row.T) of its contents."""
   def __init__(self, maxlen, rowsize):
     self.maxlen = maxlen
-    self.arr = np.empty((0, rowsize))
+    self.buf = np.empty((maxlen, rowsize))
+    self.idx = 0
+    self.n = 0
+    self.scatter = np.zeros((rowsize, rowsize))
 
   def __len__(self):
-    return len(self.arr)
+    return self.n
+
+  @property
+  def arr(self):
+    # oldest row first
+    if self.n < self.maxlen:
+      return self.buf[:self.n]
+    return np.concatenate((self.buf[self.idx:], self.buf[:self.idx]))
 
   def append(self, pt):
-    if len(self.arr) < self.maxlen:
-      self.arr = np.append(self.arr, [pt], axis=0)
+    pt = np.asarray(pt, dtype=np.float64)
+    if self.n == self.maxlen:
+      old = self.buf[self.idx]
+      self.scatter -= np.outer(old, old)
     else:
-      self.arr[:-1] = self.arr[1:]
-      self.arr[-1] = pt
+      self.n += 1
+    self.buf[self.idx] = pt
+    self.scatter += np.outer(pt, pt)
+    self.idx = (self.idx + 1) % self.maxlen
+    if self.idx == 0:
+      # recompute once per lap so rounding errors don't accumulate
+      self.scatter = self.buf.T @ self.buf
 
 
 class PointBuckets:
@@ -85,24 +102,26 @@ class PointBuckets:
       return points
     return points[np.random.choice(np.arange(len(points)), min(len(points), num_points), replace=False)]
 
+  def get_scatter(self):
+    """Scatter matrix of all the [x, 1, y] points."""
+    return sum(x.scatter for x in self.buckets.values())
+
   def load_points(self, points):
     for x, y in points:
       self.add_point(x, y)
 
 
 class TorqueEstimator:
-  def __init__(self, CP, decimated=False):
+  def __init__(self, CP, decimated=False, restore_cache=True):
     self.hist_len = int(HISTORY / DT_MDL)
     self.lag = CP.steerActuatorDelay + .2   # from controlsd
 
     if decimated:
       self.min_bucket_points = MIN_BUCKET_POINTS / 10
       self.min_points_total = MIN_POINTS_TOTAL_QLOG
-      self.fit_points = FIT_POINTS_TOTAL_QLOG
     else:
       self.min_bucket_points = MIN_BUCKET_POINTS
       self.min_points_total = MIN_POINTS_TOTAL
-      self.fit_points = FIT_POINTS_TOTAL
 
     self.offline_friction = 0.0
     self.offline_latAccelFactor = 0.0
@@ -128,8 +147,8 @@ class TorqueEstimator:
 
     # try to restore cached params
     params = Params()
-    params_cache = params.get("LiveTorqueCarParams")
-    torque_cache = params.get("LiveTorqueParameters")
+    params_cache = params.get("LiveTorqueCarParams") if restore_cache else None
+    torque_cache = params.get("LiveTorqueParameters") if restore_cache else None
     if params_cache is not None and torque_cache is not None:
       try:
         cache_ltp = log.Event.from_bytes(torque_cache).liveTorqueParameters
@@ -172,14 +191,19 @@ class TorqueEstimator:
     self.filtered_points = PointBuckets(x_bounds=STEER_BUCKET_BOUNDS, min_points=self.min_bucket_points, min_points_total=self.min_points_total)
 
   def estimate_params(self):
-    points = self.filtered_points.get_points(self.fit_points)
     # total least square solution as both x and y are noisy observations
     # this is empirically the slope of the hysteresis parallelogram as opposed to the line through the diagonals
+    # the smallest right singular vector of the [x, 1, y] points is the smallest eigenvector of their scatter matrix
+    scatter = self.filtered_points.get_scatter()
     try:
-      _, _, v = np.linalg.svd(points, full_matrices=False)
-      slope, offset = -v.T[0:2, 2] / v.T[2, 2]
-      _, spread = np.matmul(points[:, [0, 2]], slope2rot(slope)).T
-      friction_coeff = np.std(spread) * FRICTION_FACTOR
+      _, v = np.linalg.eigh(scatter)
+      slope, offset = -v[0:2, 0] / v[2, 0]
+      # spread is the distance of the points to the fitted slope, its std follows from the moments of x and y
+      n = scatter[1, 1]
+      mean = scatter[[0, 2], 1] / n
+      cov = scatter[np.ix_([0, 2], [0, 2])] / n - np.outer(mean, mean)
+      w = slope2rot(slope)[:, 1]
+      friction_coeff = np.sqrt(max(w @ cov @ w, 0.)) * FRICTION_FACTOR
     except np.linalg.LinAlgError as e:
       cloudlog.exception(f"Error computing live torque params: {e}")
       slope = offset = friction_coeff = np.nan
@@ -258,11 +282,31 @@ class TorqueEstimator:
     return msg
 
 
+def estimate_logs(CP, logs, decimated=False):
+  """Runs the estimator offline over the carControl, carState and liveLocationKalman
+     messages of several logs in turn, returns the final liveTorqueParameters."""
+  estimator = TorqueEstimator(CP, decimated=decimated, restore_cache=False)
+  llk_cnt = 0
+  for lr in logs:
+    # raw points are interpolated in time, don't mix them across routes
+    estimator.raw_points.clear()
+    msgs = sorted((m for m in lr if m.which() in SERVICES), key=lambda m: m.logMonoTime)
+    for msg in msgs:
+      which = msg.which()
+      estimator.handle_log(msg.logMonoTime * 1e-9, which, getattr(msg, which))
+      # 4Hz driven by liveLocationKalman, like the live process
+      if which == 'liveLocationKalman':
+        llk_cnt += 1
+        if llk_cnt % 5 == 0:
+          estimator.get_msg()
+  return estimator.get_msg(with_points=True)
+
+
 def main(sm=None, pm=None):
   config_realtime_process(2, Priority.CTRL_LOW)
 
   if sm is None:
-    sm = messaging.SubMaster(['carControl', 'carState', 'liveLocationKalman'], poll=['liveLocationKalman'])
+    sm = messaging.SubMaster(SERVICES, poll=['liveLocationKalman'])
 
   if pm is None:
     pm = messaging.PubMaster(['liveTorqueParameters'])
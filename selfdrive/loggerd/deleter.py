@@ -1,41 +1,163 @@
 #!/usr/bin/env python3
 import os
-import shutil
+import time
 import threading
 from selfdrive.swaglog import cloudlog
-from selfdrive.loggerd.config import ROOT, get_available_bytes, get_available_percent
-from selfdrive.loggerd.uploader import listdir_by_creation
+from selfdrive.statsd import statlog
+from selfdrive.loggerd.config import ROOT
+from selfdrive.loggerd.uploader import IMMEDIATE_PRIORITY, is_uploaded, listdir_by_creation
 
 MIN_BYTES = 5 * 1024 * 1024 * 1024
 MIN_PERCENT = 10
 
+# free this much on top of the thresholds, so every new segment doesn't need a batch
+RECLAIM_MARGIN = int(os.getenv("DELETER_RECLAIM_MARGIN", str(1024 * 1024 * 1024)))
+# bytes unlinked per second, loggerd keeps writing meanwhile. Not applied below half the thresholds
+DELETE_BUDGET = int(os.getenv("DELETER_BUDGET", str(256 * 1024 * 1024)))
+
 DELETE_LAST = ['boot', 'crash']
 
 
+def bytes_to_free(root):
+  """Returns the bytes missing to the thresholds, and if the disk is critically full."""
+  try:
+    statvfs = os.statvfs(root)
+  except OSError:
+    return 0, False
+
+  available = statvfs.f_bavail * statvfs.f_frsize
+  percent_bytes = MIN_PERCENT / 100. * statvfs.f_blocks * statvfs.f_frsize
+  need = max(MIN_BYTES - available, percent_bytes - available)
+  critical = available < min(MIN_BYTES, percent_bytes) / 2
+  return max(int(need), 0), critical
+
+
+class SegmentIndex():
+  """Size, lock and upload state of the entries in root. They are only rescanned
+     when their mtime changes, the upload state until they are uploaded."""
+  def __init__(self, root):
+    self.root = root
+    self.cache = {}  # name -> (mtime_ns, size, locked, uploaded)
+
+  def _scan(self, name):
+    path = os.path.join(self.root, name)
+    st = os.stat(path)
+    cached = self.cache.get(name)
+    if cached is not None and cached[0] == st.st_mtime_ns:
+      _, size, locked, uploaded = cached
+      if not uploaded:
+        uploaded = all(is_uploaded(os.path.join(path, n)) for n in IMMEDIATE_PRIORITY if os.path.exists(os.path.join(path, n)))
+    elif os.path.isdir(path):
+      size, locked, names = 0, False, []
+      with os.scandir(path) as it:
+        for entry in it:
+          names.append(entry.name)
+          locked |= entry.name.endswith(".lock")
+          try:
+            size += entry.stat(follow_symlinks=False).st_size
+          except OSError:
+            pass
+      uploaded = all(is_uploaded(os.path.join(path, n)) for n in IMMEDIATE_PRIORITY if n in names)
+    else:
+      size, locked, uploaded = st.st_size, False, True
+
+    self.cache[name] = (st.st_mtime_ns, size, locked, uploaded)
+    return size, locked, uploaded
+
+  def candidates(self):
+    """Returns (name, size) of the deletable entries in the order to delete them:
+       uploaded before not uploaded, oldest first, DELETE_LAST at the end."""
+    names = listdir_by_creation(self.root)
+    for name in set(self.cache) - set(names):
+      del self.cache[name]
+
+    entries = []
+    for name in names:
+      try:
+        size, locked, uploaded = self._scan(name)
+      except OSError:
+        continue
+      if not locked:
+        entries.append((name in DELETE_LAST, not uploaded, name, size))
+
+    # stable sort keeps the creation order within each group
+    entries.sort(key=lambda e: e[:2])
+    return [(name, size) for _, _, name, size in entries]
+
+  def forget(self, name):
+    self.cache.pop(name, None)
+
+
+class Reclaimer():
+  def __init__(self, root, exit_event, budget=DELETE_BUDGET):
+    self.root = root
+    self.exit_event = exit_event
+    self.budget = budget
+    self.index = SegmentIndex(root)
+    self.start = 0.
+    self.freed = 0
+
+  def select(self, need):
+    batch, total = [], 0
+    for name, size in self.index.candidates():
+      if total >= need:
+        break
+      batch.append(name)
+      total += size
+    return batch
+
+  def _unlink(self, path, throttle):
+    size = os.lstat(path).st_size
+    os.remove(path)
+    self.freed += size
+    if throttle and self.budget > 0:
+      ahead = self.freed / self.budget - (time.monotonic() - self.start)
+      if ahead > 0:
+        self.exit_event.wait(ahead)
+
+  def _delete(self, path, throttle):
+    if not os.path.isdir(path) or os.path.islink(path):
+      self._unlink(path, throttle)
+      return
+
+    for dirpath, dirnames, filenames in os.walk(path, topdown=False):
+      for fn in filenames:
+        self._unlink(os.path.join(dirpath, fn), throttle)
+      for d in dirnames:
+        os.rmdir(os.path.join(dirpath, d))
+    os.rmdir(path)
+
+  def reclaim(self, need, throttle=True):
+    """Deletes a batch of segments freeing at least need bytes, if there are enough. Returns the bytes freed."""
+    batch = self.select(need)
+    self.start = time.monotonic()
+    self.freed = 0
+    for name in batch:
+      if self.exit_event.is_set():
+        break
+      delete_path = os.path.join(self.root, name)
+      try:
+        cloudlog.info(f"deleting {delete_path}")
+        self._delete(delete_path, throttle)
+      except OSError:
+        cloudlog.exception(f"issue deleting {delete_path}")
+      self.index.forget(name)
+
+    if self.freed > 0:
+      dt = max(time.monotonic() - self.start, 1e-3)
+      cloudlog.event("deleter_reclaimed", segments=len(batch), bytes=self.freed, need=need, secs=dt, throttled=throttle)
+      statlog.gauge("deleter_reclaim_rate", self.freed / dt / 1e6)  # MB/s
+    return self.freed
+
+
 def deleter_thread(exit_event):
+  reclaimer = Reclaimer(ROOT, exit_event)
   while not exit_event.is_set():
-    out_of_bytes = get_available_bytes(default=MIN_BYTES + 1) < MIN_BYTES
-    out_of_percent = get_available_percent(default=MIN_PERCENT + 1) < MIN_PERCENT
-
-    if out_of_percent or out_of_bytes:
-      # remove the earliest directory we can
-      dirs = sorted(listdir_by_creation(ROOT), key=lambda x: x in DELETE_LAST)
-      for delete_dir in dirs:
-        delete_path = os.path.join(ROOT, delete_dir)
-
-        if any(name.endswith(".lock") for name in os.listdir(delete_path)):
-          continue
-
-        try:
-          cloudlog.info(f"deleting {delete_path}")
-          if os.path.isfile(delete_path):
-            os.remove(delete_path)
-          else:
-            shutil.rmtree(delete_path)
-          break
-        except OSError:
-          cloudlog.exception(f"issue deleting {delete_path}")
-      exit_event.wait(.1)
+    need, critical = bytes_to_free(ROOT)
+
+    if need > 0:
+      freed = reclaimer.reclaim(need + RECLAIM_MARGIN, throttle=not critical)
+      exit_event.wait(.1 if freed > 0 else 5)
     else:
       exit_event.wait(30)
 
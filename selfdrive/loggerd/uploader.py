@@ -1,4 +1,5 @@
 #!/usr/bin/env python3
+import heapq
 import json
 import os
 import random
@@ -11,9 +12,12 @@ from pathlib import Path
 from cereal import log
 import cereal.messaging as messaging
 from common.api import Api
+from common.inotify import Inotify, IN_ATTRIB, IN_CREATE, IN_DELETE, IN_DELETE_SELF, IN_IGNORED, IN_ISDIR, \
+                           IN_MOVE_SELF, IN_MOVED_FROM, IN_MOVED_TO, IN_ONLYDIR, IN_Q_OVERFLOW
 from common.params import Params
+from common.xattr import getxattr
 from selfdrive.hardware import TICI
-from selfdrive.loggerd.xattr_cache import getxattr, setxattr
+from selfdrive.loggerd.xattr_cache import setxattr
 from selfdrive.loggerd.config import ROOT
 from selfdrive.swaglog import cloudlog
 
@@ -25,6 +29,9 @@ allow_sleep = bool(os.getenv("UPLOADER_SLEEP", "1"))
 force_wifi = os.getenv("FORCEWIFI") is not None
 fake_upload = os.getenv("FAKEUPLOAD") is not None
 
+IMMEDIATE_FOLDERS = ["crash/", "boot/"]
+IMMEDIATE_PRIORITY = {"qlog.bz2": 0, "qcamera.ts": 1}
+
 
 def get_directory_sort(d):
   return list(map(lambda s: s.rjust(10, '0'), d.rsplit('--', 1)))
@@ -49,83 +56,212 @@ def clear_locks(root):
       cloudlog.exception("clear_locks failed")
 
 
-class Uploader():
-  def __init__(self, dongle_id, root):
-    self.dongle_id = dongle_id
-    self.api = Api(dongle_id)
-    self.root = root
-
-    self.upload_thread = None
-
-    self.last_resp = None
-    self.last_exc = None
+def is_uploaded(fn):
+  try:
+    return getxattr(fn, UPLOAD_ATTR_NAME) is not None
+  except OSError:
+    return True  # deleter could have deleted
 
-    self.immediate_size = 0
-    self.immediate_count = 0
 
-    # stats for last successfully uploaded file
-    self.last_time = 0
-    self.last_speed = 0
-    self.last_filename = ""
+class UploadQueue():
+  """Files waiting for upload in the order the uploader picks them: files in immediate
+     folders, then immediate priority files, by segment. Built from one scan of root
+     and kept up to date with inotify, without inotify root is rescanned every time."""
+  ROOT_EVENTS = IN_CREATE | IN_MOVED_TO | IN_DELETE | IN_MOVED_FROM | IN_ONLYDIR
+  SEGMENT_EVENTS = IN_CREATE | IN_MOVED_TO | IN_DELETE | IN_MOVED_FROM | IN_ATTRIB | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
 
-    self.immediate_folders = ["crash/", "boot/"]
-    self.immediate_priority = {"qlog.bz2": 0, "qcamera.ts": 1}
+  def __init__(self, root, immediate_folders, immediate_priority):
+    self.root = root
+    self.immediate_folders = immediate_folders
+    self.immediate_priority = immediate_priority
+    self.use_inotify = True
+    self.inotify = None
+    self.reconcile()
 
   def get_upload_sort(self, name):
     if name in self.immediate_priority:
       return self.immediate_priority[name]
     return 1000
 
-  def list_upload_files(self):
+  def _sort_key(self, logname, name):
+    fn = os.path.join(self.root, logname, name)
+    if any(f in fn for f in self.immediate_folders):
+      return (0, get_directory_sort(logname), self.get_upload_sort(name), name)
+    if name in self.immediate_priority:
+      return (1, get_directory_sort(logname), self.get_upload_sort(name), name)
+    return None  # never picked
+
+  def reconcile(self):
+    self.pending = {}  # logname -> names not uploaded yet
+    self.sizes = {}  # sizes of immediate priority files, once their segment is done
+    self.locked = set()
+    self.heap = []
+    self.wds = {}
+    self.root_wd = None
+
+    if self.inotify is not None:
+      self.inotify.close()
+      self.inotify = None
+    if self.use_inotify:
+      try:
+        self.inotify = Inotify()
+      except OSError:
+        cloudlog.exception("uploader: inotify unavailable, rescanning")
+        self.use_inotify = False
+
     if not os.path.isdir(self.root):
       return
-
-    self.immediate_size = 0
-    self.immediate_count = 0
+    if self.inotify is not None:
+      try:
+        self.root_wd = self.inotify.add_watch(self.root, self.ROOT_EVENTS)
+      except OSError:
+        cloudlog.exception("uploader: failed to watch root")
 
     for logname in listdir_by_creation(self.root):
-      path = os.path.join(self.root, logname)
+      self._add_segment(logname)
+
+  def _add_segment(self, logname):
+    path = os.path.join(self.root, logname)
+    if self.inotify is not None:
       try:
-        names = os.listdir(path)
+        self.wds[self.inotify.add_watch(path, self.SEGMENT_EVENTS)] = logname
       except OSError:
+        pass  # not a directory or already deleted
+
+    try:
+      names = os.listdir(path)
+    except OSError:
+      return
+
+    self.pending.setdefault(logname, set())
+    for name in sorted(names, key=lambda n: not n.endswith(".lock")):
+      self._add_file(logname, name)
+
+  def _remove_segment(self, logname):
+    for name in self.pending.pop(logname, ()):
+      self.sizes.pop((logname, name), None)
+    self.locked.discard(logname)
+
+  def _add_file(self, logname, name):
+    if name.endswith(".lock"):
+      self.locked.add(logname)
+      return
+
+    pending = self.pending.setdefault(logname, set())
+    key = self._sort_key(logname, name)
+    if key is None or name in pending or is_uploaded(os.path.join(self.root, logname, name)):
+      return
+    pending.add(name)
+    if logname not in self.locked:
+      heapq.heappush(self.heap, (key, logname, name))
+
+  def _remove_file(self, logname, name):
+    if name.endswith(".lock"):
+      if logname in self.locked:
+        self.locked.discard(logname)
+        for n in self.pending.get(logname, ()):
+          heapq.heappush(self.heap, (self._sort_key(logname, n), logname, n))
+    else:
+      self.pending.get(logname, set()).discard(name)
+      self.sizes.pop((logname, name), None)
+
+  def _process_events(self):
+    for wd, mask, _, name in self.inotify.read(0):
+      if mask & IN_Q_OVERFLOW:
+        cloudlog.warning("uploader: inotify queue overflow, rescanning")
+        self.reconcile()
+        return
+
+      if wd == self.root_wd:
+        if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+          self._add_segment(name)
+        elif mask & IN_ISDIR and mask & (IN_DELETE | IN_MOVED_FROM):
+          self._remove_segment(name)
         continue
 
-      if any(name.endswith(".lock") for name in names):
+      logname = self.wds.get(wd)
+      if logname is None:
         continue
+      if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+        self.wds.pop(wd)
+        self._remove_segment(logname)
+      elif mask & (IN_CREATE | IN_MOVED_TO):
+        self._add_file(logname, name)
+      elif mask & (IN_DELETE | IN_MOVED_FROM):
+        self._remove_file(logname, name)
+      elif mask & IN_ATTRIB and name in self.pending.get(logname, ()):
+        if is_uploaded(os.path.join(self.root, logname, name)):
+          self._remove_file(logname, name)
+
+  def update(self):
+    if self.inotify is None or self.root_wd is None:
+      self.reconcile()
+    else:
+      self._process_events()
+
+  def next(self):
+    """Returns (logname, name) of the next file to upload, or None."""
+    self.update()
+    while self.heap:
+      _, logname, name = self.heap[0]
+      if logname not in self.locked and name in self.pending.get(logname, ()):
+        return logname, name
+      heapq.heappop(self.heap)
+    return None
 
-      for name in sorted(names, key=self.get_upload_sort):
-        key = os.path.join(logname, name)
-        fn = os.path.join(path, name)
-        # skip files already uploaded
-        try:
-          is_uploaded = getxattr(fn, UPLOAD_ATTR_NAME)
-        except OSError:
-          cloudlog.event("uploader_getxattr_failed", exc=self.last_exc, key=key, fn=fn)
-          is_uploaded = True  # deleter could have deleted
-        if is_uploaded:
-          continue
+  def mark_uploaded(self, key):
+    logname, name = os.path.split(key)
+    self._remove_file(logname, name)
 
-        try:
-          if name in self.immediate_priority:
-            self.immediate_count += 1
-            self.immediate_size += os.path.getsize(fn)
-        except OSError:
-          pass
+  def immediate_stats(self):
+    """Count and total size of the immediate priority files waiting for upload."""
+    count, size = 0, 0
+    for logname, names in self.pending.items():
+      if logname in self.locked:
+        continue
+      for name in names:
+        if name in self.immediate_priority:
+          count += 1
+          if (logname, name) not in self.sizes:
+            try:
+              self.sizes[(logname, name)] = os.path.getsize(os.path.join(self.root, logname, name))
+            except OSError:
+              continue
+          size += self.sizes[(logname, name)]
+    return count, size
 
-        yield (name, key, fn)
 
-  def next_file_to_upload(self):
-    upload_files = list(self.list_upload_files())
+class Uploader():
+  def __init__(self, dongle_id, root):
+    self.dongle_id = dongle_id
+    self.api = Api(dongle_id)
+    self.root = root
 
-    for name, key, fn in upload_files:
-      if any(f in fn for f in self.immediate_folders):
-        return (key, fn)
+    self.upload_thread = None
 
-    for name, key, fn in upload_files:
-      if name in self.immediate_priority:
-        return (key, fn)
+    self.last_resp = None
+    self.last_exc = None
 
-    return None
+    self.immediate_size = 0
+    self.immediate_count = 0
+
+    # stats for last successfully uploaded file
+    self.last_time = 0
+    self.last_speed = 0
+    self.last_filename = ""
+
+    self.immediate_folders = list(IMMEDIATE_FOLDERS)
+    self.immediate_priority = dict(IMMEDIATE_PRIORITY)
+    self.queue = UploadQueue(self.root, self.immediate_folders, self.immediate_priority)
+
+  def next_file_to_upload(self):
+    d = self.queue.next()
+    self.immediate_count, self.immediate_size = self.queue.immediate_stats()
+    if d is None:
+      return None
+
+    logname, name = d
+    return (os.path.join(logname, name), os.path.join(self.root, logname, name))
 
   def do_upload(self, key, fn):
     try:
@@ -178,6 +314,7 @@ class Uploader():
       try:
         # tag files of 0 size as uploaded
         setxattr(fn, UPLOAD_ATTR_NAME, UPLOAD_ATTR_VALUE)
+        self.queue.mark_uploaded(key)
       except OSError:
         cloudlog.event("uploader_setxattr_failed", exc=self.last_exc, key=key, fn=fn, sz=sz)
       success = True
@@ -188,6 +325,7 @@ class Uploader():
         try:
           # tag file as uploaded
           setxattr(fn, UPLOAD_ATTR_NAME, UPLOAD_ATTR_VALUE)
+          self.queue.mark_uploaded(key)
         except OSError:
           cloudlog.event("uploader_setxattr_failed", exc=self.last_exc, key=key, fn=fn, sz=sz)
 
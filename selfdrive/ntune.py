@@ -1,23 +1,27 @@
 import os
-import fcntl
-import signal
 import json
+import mmap
+import time
+import struct
+import tempfile
 import weakref
 from enum import Enum
 import numpy as np
 
+from common.file_helpers import atomic_write_in_dir, mkdirs_exists_ok
+
 CONF_PATH = '/data/ntune/'
 CONF_LAT_LQR_FILE = '/data/ntune/lat_lqr.json'
 CONF_LAT_INDI_FILE = '/data/ntune/lat_indi.json'
 CONF_LAT_TORQUE_FILE = '/data/ntune/lat_torque_v4.json'
 
-ntunes = {}
-
+# ntuned validates the config files and publishes all groups as one snapshot. The
+# generation counter is memory mapped, so readers only reload when it changes.
+NTUNE_SHM_DIR = os.getenv("NTUNE_SHM_DIR", "/dev/shm/ntune" if os.path.isdir("/dev/shm") else os.path.join(tempfile.gettempdir(), "ntune"))
+GENERATION_FILE = os.path.join(NTUNE_SHM_DIR, "generation")
+SNAPSHOT_FILE = os.path.join(NTUNE_SHM_DIR, "snapshot.json")
 
-def file_watch_handler(signum, frame):
-  global ntunes
-  for ntune in ntunes.values():
-    ntune.handle()
+ntunes = {}
 
 
 class LatType(Enum):
@@ -27,25 +31,83 @@ class LatType(Enum):
   LQR = 3
 
 
+GROUPS = ["common", "scc", "option"]
+LAT_GROUPS = ["lat_indi", "lat_torque_v4", "lat_lqr"]
+
+
+def publish_snapshot(configs, generation):
+  """Writes the configs of all groups, then bumps the generation readers check."""
+  mkdirs_exists_ok(NTUNE_SHM_DIR)
+  with atomic_write_in_dir(SNAPSHOT_FILE, mode="w", overwrite=True) as f:
+    json.dump({'generation': generation, 'configs': configs}, f)
+
+  if not os.path.exists(GENERATION_FILE):
+    with atomic_write_in_dir(GENERATION_FILE, mode="wb", overwrite=True) as f:
+      f.write(struct.pack('<Q', 0))
+  with open(GENERATION_FILE, "r+b") as f:
+    f.write(struct.pack('<Q', generation))
+
+
+class Snapshot():
+  """Reader of the snapshot published by ntuned."""
+  RETRY_OPEN = 1.  # secs
+
+  def __init__(self):
+    self.mm = None
+    self.last_open = -self.RETRY_OPEN
+    self.generation = 0
+    self.configs = None
+
+  def _open(self):
+    self.last_open = time.monotonic()
+    try:
+      with open(GENERATION_FILE, "rb") as f:
+        self.mm = mmap.mmap(f.fileno(), 8, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+      self.mm = None
+
+  def update(self):
+    if self.mm is None:
+      if time.monotonic() - self.last_open < self.RETRY_OPEN:
+        return
+      self._open()
+      if self.mm is None:
+        return
+
+    generation = struct.unpack_from('<Q', self.mm)[0]
+    if generation != self.generation:
+      try:
+        with open(SNAPSHOT_FILE) as f:
+          snapshot = json.load(f)
+        self.generation = snapshot['generation']
+        self.configs = snapshot['configs']
+      except (OSError, ValueError, KeyError):
+        pass
+
+  def group(self, group):
+    """Returns (generation, config) of a group, config is None without a snapshot."""
+    self.update()
+    if self.configs is None:
+      return self.generation, None
+    return self.generation, self.configs.get(group)
+
+
+snapshot = Snapshot()
+
+
 class nTune():
 
   def get_ctrl(self):
     return self.ctrl() if self.ctrl is not None else None
 
-  def __del__(self):
-    if self.group is None:
-      ntunes[self.key] = None
-    print('__del__', self)
-
   def __init__(self, CP=None, ctrl=None, group=None):
 
-    self.invalidated = False
+    self.generation = 0
     self.CP = CP
     self.ctrl = weakref.ref(ctrl) if ctrl is not None else None
     self.type = LatType.NONE
     self.group = group
     self.config = {}
-    self.key = str(self)
     self.disable_lateral_live_tuning = CP.disableLateralLiveTuning if CP is not None else False
 
     if "LatControlTorque" in str(type(ctrl)):
@@ -64,41 +126,22 @@ class nTune():
       ctrl.L = np.array([0.33, 0.318]).reshape((2, 1))
     else:
       self.file = CONF_PATH + group + ".json"
+    self.snapshot_group = os.path.basename(self.file)[:-len(".json")]
 
     if not os.path.exists(CONF_PATH):
       os.makedirs(CONF_PATH)
 
     self.read()
-
-    if self.group is None:
-      ntunes[self.key] = self
-
-    try:
-      signal.signal(signal.SIGIO, file_watch_handler)
-      fd = os.open(CONF_PATH, os.O_RDONLY)
-      fcntl.fcntl(fd, fcntl.F_SETSIG, 0)
-      fcntl.fcntl(fd, fcntl.F_NOTIFY, fcntl.DN_MODIFY | fcntl.DN_CREATE | fcntl.DN_MULTISHOT)
-    except Exception as ex:
-      print("exception", ex)
-      pass
-
-  def handle(self):
-    try:
-      if os.path.getsize(self.file) > 0:
-        with open(self.file, 'r') as f:
-          self.config = json.load(f)
-
-        if self.checkValid():
-          self.write_config(self.config)
-
-        self.invalidated = True
-
-    except:
-      pass
+    self.generation = snapshot.group(self.snapshot_group)[0]
 
   def check(self):  # called by LatControlLQR.update
-    if self.invalidated:
-      self.invalidated = False
+    generation, config = snapshot.group(self.snapshot_group)
+    if config is not None and generation != self.generation:
+      self.generation = generation
+      # lat files are published as they are, the controller validates its own
+      self.config = dict(config)
+      if self.checkValid():
+        self.write_config(self.config)
       self.update()
 
   def read(self):
@@ -385,7 +428,11 @@ class nTune():
 
 
 def ntune_get(group, key):
-  global ntunes
+  _, config = snapshot.group(group)
+  if config is not None and key in config:
+    return config[key]
+
+  # no snapshot from ntuned, read the file in this process
   if group not in ntunes:
     ntunes[group] = nTune(group=group)
 
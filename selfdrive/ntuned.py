@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+import os
+import json
+import time
+
+from common.inotify import Inotify, IN_MODIFY, IN_CLOSE_WRITE, IN_MOVED_TO, IN_CREATE, IN_DELETE
+from selfdrive.ntune import CONF_PATH, GROUPS, LAT_GROUPS, Snapshot, nTune, publish_snapshot
+from selfdrive.swaglog import cloudlog
+
+POLL_INTERVAL = 1.  # secs, without inotify
+DEBOUNCE = 0.1  # secs, editors write files in several steps
+
+
+def read_configs():
+  # nTune validates the files and writes back defaults and clipped values
+  configs = {group: dict(nTune(group=group).config) for group in GROUPS}
+
+  # lat files are only validated by the lateral controller using them, without one
+  # missing values must stay missing so controlsd falls back to its params
+  for group in LAT_GROUPS:
+    try:
+      with open(os.path.join(CONF_PATH, group + ".json")) as f:
+        configs[group] = json.load(f)
+    except (OSError, ValueError):
+      pass
+  return configs
+
+
+def main():
+  os.makedirs(CONF_PATH, exist_ok=True)
+  try:
+    inotify = Inotify()
+    inotify.add_watch(CONF_PATH, IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE)
+  except OSError:
+    cloudlog.exception("ntuned: inotify unavailable, polling")
+    inotify = None
+
+  # continue the generation of a previous run, readers may have cached it
+  previous = Snapshot()
+  previous.update()
+  generation = previous.generation + 1
+  configs = read_configs()
+  publish_snapshot(configs, generation)
+
+  while True:
+    if inotify is not None:
+      inotify.read()
+      time.sleep(DEBOUNCE)
+      inotify.read(0)
+    else:
+      time.sleep(POLL_INTERVAL)
+
+    # rewriting validated files triggers another event, only publish real changes
+    new_configs = read_configs()
+    if new_configs != configs:
+      configs = new_configs
+      generation += 1
+      publish_snapshot(configs, generation)
+      cloudlog.info(f"ntuned: published generation {generation}")
+
+
+if __name__ == "__main__":
+  main()
@@ -2,10 +2,14 @@
 import bz2
 import os
 import sys
+import json
 import math
 import numbers
-import dictdiffer
-from collections import Counter
+import argparse
+from collections import Counter, defaultdict
+from itertools import zip_longest
+
+import capnp
 
 if "CI" in os.environ:
   def tqdm(x):
@@ -17,6 +21,10 @@ from tools.lib.logreader import LogReader
 
 EPSILON = sys.float_info.epsilon
 
+StructReader = capnp.lib.capnp._DynamicStructReader  # pylint: disable=c-extension-no-member
+ListReader = capnp.lib.capnp._DynamicListReader  # pylint: disable=c-extension-no-member
+Enum = capnp.lib.capnp._DynamicEnum  # pylint: disable=c-extension-no-member
+
 
 def save_log(dest, log_msgs, compress=True):
   dat = b"".join(msg.as_builder().to_bytes() for msg in tqdm(log_msgs))
@@ -53,55 +61,181 @@ def remove_ignored_fields(msg, ignore):
   return msg.as_reader()
 
 
-def compare_logs(log1, log2, ignore_fields=None, ignore_msgs=None, tolerance=None):
-  if ignore_fields is None:
-    ignore_fields = []
-  if ignore_msgs is None:
-    ignore_msgs = []
+def _to_py(v):
+  if isinstance(v, StructReader):
+    return v.to_dict(verbose=True)
+  elif isinstance(v, ListReader):
+    return [_to_py(x) for x in v]
+  elif isinstance(v, Enum):
+    return str(v)
+  return v
+
+
+def _diff_path(keys):
+  # same paths as dictdiffer: dotted string, or a list once there is a list index in it
+  if all(isinstance(k, str) for k in keys):
+    return ".".join(keys)
+  return list(keys)
+
+
+class FieldTolerance:
+  """Tolerance per field, the longest matching prefix in field_tolerances wins."""
+  def __init__(self, tolerance=None, field_tolerances=None):
+    self.default = EPSILON if tolerance is None else tolerance
+    self.fields = field_tolerances or {}
+    self.cache = {}
+
+  def get(self, field):
+    if field not in self.cache:
+      tol, prefix = self.default, field
+      while prefix:
+        if prefix in self.fields:
+          tol = self.fields[prefix]
+          break
+        prefix = prefix.rpartition(".")[0]
+      self.cache[field] = tol
+    return self.cache[field]
+
+
+def _diff_value(a, b, keys, field, ignore, tolerance):
+  """Yields (field, diff, magnitude) for every difference between two capnp values."""
+  if field in ignore:
+    return
+
+  if isinstance(a, StructReader):
+    yield from _diff_struct(a, b, keys, field, ignore, tolerance)
+  elif isinstance(a, ListReader):
+    # like dictdiffer, dotted ignore paths don't reach into list items
+    n = min(len(a), len(b))
+    for i in range(n):
+      yield from _diff_value(a[i], b[i], keys + (i,), field, frozenset(), tolerance)
+    if len(b) > n:
+      yield field, ("add", _diff_path(keys), [(i, _to_py(b[i])) for i in range(n, len(b))]), None
+    if len(a) > n:
+      yield field, ("remove", _diff_path(keys), [(i, _to_py(a[i])) for i in reversed(range(n, len(a)))]), None
+  else:
+    if isinstance(a, Enum):
+      a, b = str(a), str(b)
+    if a == b:
+      return
+
+    magnitude = None
+    if isinstance(a, numbers.Number) and isinstance(b, numbers.Number):
+      if math.isfinite(a) and math.isfinite(b):
+        magnitude = abs(a - b)
+        tol = tolerance.get(field)
+        if magnitude <= max(tol, tol * max(abs(a), abs(b))):
+          return
+      elif math.isnan(a) and math.isnan(b):
+        return
+      else:
+        magnitude = math.inf
+    yield field, ("change", _diff_path(keys), (a, b)), magnitude
+
+
+def _diff_struct(a, b, keys, field, ignore, tolerance):
+  # same order as dictdiffer on to_dict(): the union member, the other fields, then additions and removals
+  names = list(a.schema.non_union_fields)
+  changed_union = []
+  if len(a.schema.union_fields):
+    which_a, which_b = a.which(), b.which()
+    if which_a == which_b:
+      names.insert(0, which_a)
+    else:
+      changed_union = [("add", b, which_b), ("remove", a, which_a)]
+
+  for name in names:
+    sub_field = f"{field}.{name}" if field else name
+    yield from _diff_value(getattr(a, name), getattr(b, name), keys + (name,), sub_field, ignore, tolerance)
+
+  for op, msg, name in changed_union:
+    if (f"{field}.{name}" if field else name) not in ignore:
+      yield field, (op, _diff_path(keys), [(name, _to_py(getattr(msg, name)))]), None
+
+
+def iter_diffs(log1, log2, ignore_fields=None, ignore_msgs=None, tolerance=None, field_tolerances=None, max_diffs=None):
+  """Walks both logs in lockstep and compares the capnp messages field by field.
+
+     Yields (msg index, logMonoTime, field, diff, magnitude) for every difference,
+     diff is a dictdiffer style tuple and magnitude the absolute difference of
+     numeric fields (None for everything else). After max_diffs differences the
+     rest of the logs is only walked to check they have the same length.
+  """
+  ignore = set(ignore_fields or [])
+  ignore_msgs = set(ignore_msgs or [])
+  tolerance = FieldTolerance(tolerance, field_tolerances)
+
+  cnt1, cnt2 = Counter(), Counter()
+  num_diffs = 0
+  log1, log2 = ((m for m in log if m.which() not in ignore_msgs) for log in (log1, log2))
+  for i, (msg1, msg2) in enumerate(zip_longest(log1, log2)):
+    if msg1 is None or msg2 is None:
+      for cnt, msg, log in ((cnt1, msg1, log1), (cnt2, msg2, log2)):
+        cnt.update(m.which() for m in ([msg] if msg is not None else []))
+        cnt.update(m.which() for m in log)
+      len1, len2 = sum(cnt1.values()), sum(cnt2.values())
+      raise Exception(f"logs are not same length: {len1} VS {len2}\n\t\t{cnt1}\n\t\t{cnt2}")
+
+    which = msg1.which()
+    cnt1[which] += 1
+    cnt2[msg2.which()] += 1
+    if which != msg2.which():
+      print(msg1, msg2)
+      raise Exception("msgs not aligned between logs")
 
-  log1, log2 = (list(filter(lambda m: m.which() not in ignore_msgs, log)) for log in (log1, log2))
+    if max_diffs is not None and num_diffs >= max_diffs:
+      continue
 
-  if len(log1) != len(log2):
-    cnt1 = Counter(m.which() for m in log1)
-    cnt2 = Counter(m.which() for m in log2)
-    raise Exception(f"logs are not same length: {len(log1)} VS {len(log2)}\n\t\t{cnt1}\n\t\t{cnt2}")
+    for field, diff, magnitude in _diff_struct(msg1, msg2, (), "", ignore, tolerance):
+      yield i, msg1.logMonoTime, field, diff, magnitude
+      num_diffs += 1
+      if max_diffs is not None and num_diffs >= max_diffs:
+        break
 
-  diff = []
-  for msg1, msg2 in tqdm(zip(log1, log2)):
-    if msg1.which() != msg2.which():
-      print(msg1, msg2)
-      raise Exception("msgs not aligned between logs")
 
-    msg1_bytes = remove_ignored_fields(msg1, ignore_fields).as_builder().to_bytes()
-    msg2_bytes = remove_ignored_fields(msg2, ignore_fields).as_builder().to_bytes()
+def compare_logs(log1, log2, ignore_fields=None, ignore_msgs=None, tolerance=None, field_tolerances=None, max_diffs=None):
+  """Returns the differences between two logs, stops after max_diffs differences."""
+  return [d for _, _, _, d, _ in iter_diffs(log1, log2, ignore_fields, ignore_msgs, tolerance, field_tolerances, max_diffs)]
+
 
-    if msg1_bytes != msg2_bytes:
-      msg1_dict = msg1.to_dict(verbose=True)
-      msg2_dict = msg2.to_dict(verbose=True)
+def _magnitude_bucket(magnitude):
+  if magnitude is None:
+    return "other"
+  elif not math.isfinite(magnitude):
+    return "inf"
+  return f"1e{math.floor(math.log10(magnitude))}" if magnitude > 0 else "0"
 
-      tolerance = EPSILON if tolerance is None else tolerance
-      dd = dictdiffer.diff(msg1_dict, msg2_dict, ignore=ignore_fields)
 
-      # Dictdiffer only supports relative tolerance, we also want to check for absolute
-      # TODO: add this to dictdiffer
-      def outside_tolerance(diff):
-        try:
-          if diff[0] == "change":
-            a, b = diff[2]
-            finite = math.isfinite(a) and math.isfinite(b)
-            if finite and isinstance(a, numbers.Number) and isinstance(b, numbers.Number):
-              return abs(a - b) > max(tolerance, tolerance * max(abs(a), abs(b)))
-        except TypeError:
-          pass
-        return True
+def diff_report(log1, log2, ignore_fields=None, ignore_msgs=None, tolerance=None, field_tolerances=None, max_diffs=None):
+  """Summary of the differences between two logs that can be dumped as JSON: the first
+     divergence, number of differences per field and a per field histogram of their
+     magnitudes in decades."""
+  report = {"diffs": 0, "truncated": False, "first_divergence": None, "fields": Counter(), "magnitudes": defaultdict(Counter)}
+  for idx, mono_time, field, diff, magnitude in iter_diffs(log1, log2, ignore_fields, ignore_msgs, tolerance, field_tolerances, max_diffs):
+    if report["first_divergence"] is None:
+      report["first_divergence"] = {"index": idx, "logMonoTime": mono_time, "field": field, "magnitude": magnitude}
+    report["diffs"] += 1
+    report["fields"][field] += 1
+    report["magnitudes"][field][_magnitude_bucket(magnitude)] += 1
 
-      dd = list(filter(outside_tolerance, dd))
+  report["truncated"] = max_diffs is not None and report["diffs"] >= max_diffs
 
-      diff.extend(dd)
-  return diff
+  report["fields"] = dict(report["fields"].most_common())
+  report["magnitudes"] = {f: dict(c) for f, c in report["magnitudes"].items()}
+  return report
 
 
 if __name__ == "__main__":
-  log1 = list(LogReader(sys.argv[1]))
-  log2 = list(LogReader(sys.argv[2]))
-  print(compare_logs(log1, log2, sys.argv[3:]))
+  parser = argparse.ArgumentParser(description="Compare two logs message by message")
+  parser.add_argument("log1")
+  parser.add_argument("log2")
+  parser.add_argument("ignore_fields", nargs="*", default=[], help="Fields to ignore (e.g. controlsState.cumLagMs)")
+  parser.add_argument("--max-diffs", type=int, default=None, help="Stop after this many differences")
+  parser.add_argument("--report", action="store_true", help="Print a JSON summary instead of every difference")
+  args = parser.parse_args()
+
+  log1, log2 = LogReader(args.log1), LogReader(args.log2)
+  if args.report:
+    print(json.dumps(diff_report(log1, log2, args.ignore_fields, max_diffs=args.max_diffs), indent=2))
+  else:
+    print(compare_logs(log1, log2, args.ignore_fields, max_diffs=args.max_diffs))
@@ -25,7 +25,7 @@ NUMPY_TOLERANCE = 1e-7
 CI = "CI" in os.environ
 TIMEOUT = 15
 
-ProcessConfig = namedtuple('ProcessConfig', ['proc_name', 'pub_sub', 'ignore', 'init_callback', 'should_recv_callback', 'tolerance', 'fake_pubsubmaster', 'submaster_config'], defaults=({},))
+ProcessConfig = namedtuple('ProcessConfig', ['proc_name', 'pub_sub', 'ignore', 'init_callback', 'should_recv_callback', 'tolerance', 'fake_pubsubmaster', 'submaster_config', 'step_callback'], defaults=({}, None))
 
 
 def wait_for_event(evt):
@@ -151,6 +151,56 @@ class FakePubMaster(messaging.PubMaster):
     return dat
 
 
+class QueueSocket:
+  """In-thread FakeSocket, an empty socket returns None instead of blocking."""
+  def __init__(self):
+    self.data = []
+
+  def receive(self, non_blocking=False):
+    if non_blocking or not len(self.data):
+      return None
+    return self.data.pop()
+
+  def send(self, data):
+    self.data.append(data)
+
+
+class StepSubMaster(messaging.SubMaster):
+  """SubMaster whose update() applies the messages fed since the last step."""
+  def __init__(self, services, ignore_alive=None, ignore_avg_freq=None):
+    super().__init__(services, ignore_alive=ignore_alive, ignore_avg_freq=ignore_avg_freq, addr=None)
+    self.sock = {s: DumbSocket(s) for s in services}
+    self.pending = None
+
+  def update(self, timeout=-1):
+    if self.pending is not None:
+      cur_time, msgs = self.pending
+      self.pending = None
+      self.update_msgs(cur_time, msgs)
+
+  def feed(self, cur_time, msgs):
+    if self.pending is not None:
+      msgs = self.pending[1] + msgs
+    self.pending = (cur_time, msgs)
+
+
+class StepPubMaster(messaging.PubMaster):
+  """PubMaster that collects everything sent during a step."""
+  def __init__(self, services):  # pylint: disable=super-init-not-called
+    self.sock = {s: DumbSocket() for s in services}
+    self.sent = []
+
+  def send(self, s, dat):
+    if isinstance(dat, bytes):
+      self.sent.append(log.Event.from_bytes(dat))
+    else:
+      self.sent.append(dat.as_reader())
+
+  def pop_sent(self):
+    sent, self.sent = self.sent, []
+    return sent
+
+
 def fingerprint(msgs, fsm, can_sock, fingerprint):
   print("start fingerprinting")
   fsm.wait_on_getitem = True
@@ -188,6 +238,36 @@ def get_car_params(msgs, fsm, can_sock, fingerprint):
     _, CP = get_car(can, sendcan)
   Params().put("CarParams", CP.to_bytes())
 
+
+def controlsd_step_callback(msgs, fsm, fpm, can_sock, fingerprint):
+  from selfdrive.controls.controlsd import Controls
+
+  # Controls fingerprints from the first can messages while it's constructed
+  can_sock.data = [msg.as_builder().to_bytes() for msg in msgs if msg.which() == "can"][:300]
+  controls = Controls(fsm, fpm, can_sock)
+  can_sock.data = []
+  return controls.step
+
+
+def radard_step_callback(msgs, fsm, fpm, can_sock, fingerprint):
+  from selfdrive.controls.radard import RadarD, radard_step
+
+  get_car_params(msgs, fsm, can_sock, fingerprint)
+  CP = car.CarParams.from_bytes(Params().get("CarParams"))
+  RI = importlib.import_module(f'selfdrive.car.{CP.carName}.radar_interface').RadarInterface(CP)
+  RD = RadarD(CP.radarTimeStep, RI.delay)
+  return lambda: radard_step(RI, RD, fsm, fpm, messaging.drain_sock_raw(can_sock, wait_for_one=True))
+
+
+def plannerd_step_callback(msgs, fsm, fpm, can_sock, fingerprint):
+  from selfdrive.controls.plannerd import get_planners, plannerd_step
+
+  get_car_params(msgs, fsm, can_sock, fingerprint)
+  params = Params()
+  longitudinal_planner, lateral_planner = get_planners(params, car.CarParams.from_bytes(params.get("CarParams")))
+  return lambda: plannerd_step(fsm, fpm, longitudinal_planner, lateral_planner)
+
+
 def controlsd_rcv_callback(msg, CP, cfg, fsm):
   # no sendcan until controlsd is initialized
   socks = [s for s in cfg.pub_sub[msg.which()] if
@@ -247,7 +327,8 @@ CONFIGS = [
     should_recv_callback=controlsd_rcv_callback,
     tolerance=NUMPY_TOLERANCE,
     fake_pubsubmaster=True,
-    submaster_config={'ignore_avg_freq': ['radarState', 'longitudinalPlan']}
+    submaster_config={'ignore_avg_freq': ['radarState', 'longitudinalPlan']},
+    step_callback=controlsd_step_callback,
   ),
   ProcessConfig(
     proc_name="radard",
@@ -260,6 +341,7 @@ CONFIGS = [
     should_recv_callback=radar_rcv_callback,
     tolerance=None,
     fake_pubsubmaster=True,
+    step_callback=radard_step_callback,
   ),
   ProcessConfig(
     proc_name="plannerd",
@@ -272,6 +354,7 @@ CONFIGS = [
     should_recv_callback=None,
     tolerance=NUMPY_TOLERANCE,
     fake_pubsubmaster=True,
+    step_callback=plannerd_step_callback,
   ),
   ProcessConfig(
     proc_name="calibrationd",
@@ -336,7 +419,9 @@ CONFIGS = [
 
 
 def replay_process(cfg, lr, fingerprint=None):
-  if cfg.fake_pubsubmaster:
+  if cfg.step_callback is not None:
+    return step_replay_process(cfg, lr, fingerprint)
+  elif cfg.fake_pubsubmaster:
     return python_replay_process(cfg, lr, fingerprint)
   else:
     return cpp_replay_process(cfg, lr, fingerprint)
@@ -356,22 +441,7 @@ def setup_env(simulation=False):
   elif "SIMULATION" in os.environ:
     del os.environ["SIMULATION"]
 
-def python_replay_process(cfg, lr, fingerprint=None):
-  sub_sockets = [s for _, sub in cfg.pub_sub.items() for s in sub]
-  pub_sockets = [s for s in cfg.pub_sub.keys() if s != 'can']
-
-  fsm = FakeSubMaster(pub_sockets, **cfg.submaster_config)
-  fpm = FakePubMaster(sub_sockets)
-  args = (fsm, fpm)
-  if 'can' in list(cfg.pub_sub.keys()):
-    can_sock = FakeSocket()
-    args = (fsm, fpm, can_sock)
-
-  all_msgs = sorted(lr, key=lambda msg: msg.logMonoTime)
-  pub_msgs = [msg for msg in all_msgs if msg.which() in list(cfg.pub_sub.keys())]
-
-  setup_env()
-
+def setup_fingerprint(lr, fingerprint=None):
   # TODO: remove after getting new route for civic & accord
   migration = {
     "HONDA CIVIC 2016 TOURING": "HONDA CIVIC 2016",
@@ -395,6 +465,23 @@ def python_replay_process(cfg, lr, fingerprint=None):
           os.environ['SKIP_FW_QUERY'] = "1"
           os.environ['FINGERPRINT'] = car_fingerprint
 
+def python_replay_process(cfg, lr, fingerprint=None):
+  sub_sockets = [s for _, sub in cfg.pub_sub.items() for s in sub]
+  pub_sockets = [s for s in cfg.pub_sub.keys() if s != 'can']
+
+  fsm = FakeSubMaster(pub_sockets, **cfg.submaster_config)
+  fpm = FakePubMaster(sub_sockets)
+  args = (fsm, fpm)
+  if 'can' in list(cfg.pub_sub.keys()):
+    can_sock = FakeSocket()
+    args = (fsm, fpm, can_sock)
+
+  all_msgs = sorted(lr, key=lambda msg: msg.logMonoTime)
+  pub_msgs = [msg for msg in all_msgs if msg.which() in list(cfg.pub_sub.keys())]
+
+  setup_env()
+  setup_fingerprint(lr, fingerprint)
+
   assert(type(managed_processes[cfg.proc_name]) is PythonProcess)
   managed_processes[cfg.proc_name].prepare()
   mod = importlib.import_module(managed_processes[cfg.proc_name].module)
@@ -445,6 +532,57 @@ def python_replay_process(cfg, lr, fingerprint=None):
   return log_msgs
 
 
+def step_replay_process(cfg, lr, fingerprint=None):
+  """Same as python_replay_process, but the process' step function is called directly
+     in this thread instead of handing every message over to the process' main loop."""
+  sub_sockets = [s for _, sub in cfg.pub_sub.items() for s in sub]
+  pub_sockets = [s for s in cfg.pub_sub.keys() if s != 'can']
+  has_can = 'can' in cfg.pub_sub
+
+  fsm = StepSubMaster(pub_sockets, **cfg.submaster_config)
+  fpm = StepPubMaster(sub_sockets)
+  can_sock = QueueSocket()
+
+  all_msgs = sorted(lr, key=lambda msg: msg.logMonoTime)
+  pub_msgs = [msg for msg in all_msgs if msg.which() in list(cfg.pub_sub.keys())]
+
+  setup_env()
+  setup_fingerprint(lr, fingerprint)
+
+  managed_processes[cfg.proc_name].prepare()
+  step = cfg.step_callback(all_msgs, fsm, fpm, can_sock, fingerprint)
+  fpm.pop_sent()
+
+  CP = car.CarParams.from_bytes(Params().get("CarParams"))
+
+  log_msgs, msg_queue = [], []
+  for msg in tqdm(pub_msgs, disable=CI):
+    if cfg.should_recv_callback is not None:
+      _, should_recv = cfg.should_recv_callback(msg, CP, cfg, fsm)
+    else:
+      recv_socks = [s for s in cfg.pub_sub[msg.which()] if
+                    (fsm.frame + 1) % int(service_list[msg.which()].frequency / service_list[s].frequency) == 0]
+      should_recv = bool(len(recv_socks))
+
+    if msg.which() == 'can':
+      can_sock.send(msg.as_builder().to_bytes())
+    else:
+      msg_queue.append(msg.as_builder())
+
+    if should_recv:
+      fsm.feed(msg.logMonoTime / 1e9, msg_queue)
+      msg_queue = []
+
+    # processes reading can run once per can message, the others once per SubMaster update
+    if (msg.which() == 'can') if has_can else should_recv:
+      step()
+      for m in fpm.pop_sent():
+        m = m.as_builder()
+        m.logMonoTime = msg.logMonoTime
+        log_msgs.append(m.as_reader())
+  return log_msgs
+
+
 def cpp_replay_process(cfg, lr, fingerprint=None):
   sub_sockets = [s for _, sub in cfg.pub_sub.items() for s in sub]  # We get responses here
   pm = messaging.PubMaster(cfg.pub_sub.keys())
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+import math
+import numbers
+import unittest
+
+import dictdiffer
+
+from cereal import log
+from selfdrive.test.process_replay.compare_logs import EPSILON, compare_logs, diff_report
+
+
+def dictdiffer_compare_logs(log1, log2, ignore_fields=None, tolerance=None):
+  """The dictdiffer based comparison compare_logs used to do."""
+  tolerance = EPSILON if tolerance is None else tolerance
+
+  def outside_tolerance(diff):
+    try:
+      if diff[0] == "change":
+        a, b = diff[2]
+        finite = math.isfinite(a) and math.isfinite(b)
+        if finite and isinstance(a, numbers.Number) and isinstance(b, numbers.Number):
+          return abs(a - b) > max(tolerance, tolerance * max(abs(a), abs(b)))
+    except TypeError:
+      pass
+    return True
+
+  diff = []
+  for msg1, msg2 in zip(log1, log2):
+    dd = dictdiffer.diff(msg1.to_dict(verbose=True), msg2.to_dict(verbose=True), ignore=ignore_fields or [])
+    diff.extend(filter(outside_tolerance, dd))
+  return diff
+
+
+def car_state(v_ego=10., a_ego=0.5, buttons=(), gear="drive", mono_time=0):
+  msg = log.Event.new_message()
+  msg.logMonoTime = mono_time
+  cs = msg.init("carState")
+  cs.vEgo = v_ego
+  cs.aEgo = a_ego
+  cs.gearShifter = gear
+  events = cs.init("buttonEvents", len(buttons))
+  for ev, (typ, pressed) in zip(events, buttons):
+    ev.type = typ
+    ev.pressed = pressed
+  return msg.as_reader()
+
+
+def controls_state(lateral="pidState", output=0., v_cruise=30.):
+  msg = log.Event.new_message()
+  cs = msg.init("controlsState")
+  cs.vCruise = v_cruise
+  cs.lateralControlState.init(lateral).output = output
+  return msg.as_reader()
+
+
+class TestCompareLogs(unittest.TestCase):
+  def assertMatchesDictdiffer(self, log1, log2, **kwargs):
+    diff = compare_logs(log1, log2, **kwargs)
+    self.assertEqual(diff, dictdiffer_compare_logs(log1, log2, **kwargs))
+    return diff
+
+  def test_no_diffs(self):
+    log1 = [car_state(), controls_state()]
+    self.assertEqual(self.assertMatchesDictdiffer(log1, list(log1)), [])
+
+  def test_changes(self):
+    diff = self.assertMatchesDictdiffer([car_state(mono_time=1), car_state(gear="park")],
+                                        [car_state(v_ego=11., mono_time=2), car_state(a_ego=0.75, gear="reverse")])
+    self.assertEqual(diff, [
+      ("change", "carState.vEgo", (10., 11.)),
+      ("change", "logMonoTime", (1, 2)),
+      ("change", "carState.gearShifter", ("park", "reverse")),
+      ("change", "carState.aEgo", (0.5, 0.75)),
+    ])
+
+  def test_tolerance(self):
+    log1 = [car_state(v_ego=10., a_ego=0.5), car_state(v_ego=0., a_ego=0.)]
+    log2 = [car_state(v_ego=10.05, a_ego=0.625), car_state(v_ego=1e-3, a_ego=-1.)]
+    self.assertEqual(len(self.assertMatchesDictdiffer(log1, log2)), 4)
+    self.assertEqual(self.assertMatchesDictdiffer(log1, log2, tolerance=1e-2), [
+      ("change", "carState.aEgo", (0.5, 0.625)),
+      ("change", "carState.aEgo", (0., -1.)),
+    ])
+
+  def test_ignore_fields(self):
+    log1 = [car_state(v_ego=10., a_ego=0.5, mono_time=1)]
+    log2 = [car_state(v_ego=11., a_ego=0.625, mono_time=2)]
+    self.assertEqual(self.assertMatchesDictdiffer(log1, log2, ignore_fields=["logMonoTime", "carState.vEgo"]),
+                     [("change", "carState.aEgo", (0.5, 0.625))])
+
+  def test_lists(self):
+    buttons = [("accelCruise", True), ("decelCruise", False), ("cancel", True)]
+    self.assertMatchesDictdiffer([car_state(buttons=buttons)], [car_state(buttons=[("accelCruise", False)])])
+    self.assertMatchesDictdiffer([car_state(buttons=buttons[:1])], [car_state(buttons=buttons)])
+    self.assertMatchesDictdiffer([car_state(buttons=buttons)], [car_state(buttons=buttons[::-1])])
+
+  def test_union_change(self):
+    diff = self.assertMatchesDictdiffer([controls_state("pidState", 1., 30.)], [controls_state("torqueState", 2., 40.)])
+    self.assertEqual([(d[0], d[1]) for d in diff], [
+      ("change", "controlsState.vCruise"),
+      ("add", "controlsState.lateralControlState"),
+      ("remove", "controlsState.lateralControlState"),
+    ])
+    self.assertEqual(diff[1][2][0][0], "torqueState")
+    self.assertEqual(diff[2][2][0][0], "pidState")
+
+  def test_length_mismatch(self):
+    log1 = [car_state(v_ego=float(i)) for i in range(10)]
+    log2 = [car_state(v_ego=float(i) + 1) for i in range(12)]
+    with self.assertRaises(Exception):
+      compare_logs(log1, log2)
+
+    # also when the walk stops early at max_diffs
+    with self.assertRaises(Exception):
+      compare_logs(log1, log2, max_diffs=1)
+    with self.assertRaises(Exception):
+      diff_report(log1, log2, max_diffs=1)
+
+  def test_max_diffs(self):
+    log1 = [car_state(v_ego=float(i)) for i in range(10)]
+    log2 = [car_state(v_ego=float(i) + 1) for i in range(10)]
+    self.assertEqual(compare_logs(log1, log2, max_diffs=3), dictdiffer_compare_logs(log1, log2)[:3])
+
+    report = diff_report(log1, log2, max_diffs=3)
+    self.assertEqual(report["diffs"], 3)
+    self.assertTrue(report["truncated"])
+    self.assertFalse(diff_report(log1, log2)["truncated"])
+
+
+if __name__ == "__main__":
+  unittest.main()
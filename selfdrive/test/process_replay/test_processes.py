@@ -2,6 +2,9 @@
 import argparse
 import os
 import sys
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from typing import Any
 
 from selfdrive.car.car_helpers import interface_names
@@ -77,6 +80,46 @@ def test_process(cfg, lr, cmp_log_fn, ignore_fields=None, ignore_msgs=None):
   except Exception as e:
     return str(e)
 
+def init_worker():
+  # Params live under $HOME, every worker gets its own so replays don't share them
+  os.environ["HOME"] = tempfile.mkdtemp(prefix="process_replay_")
+
+
+def test_segment(segment, cfgs, process_replay_dir, ref_commit, ignore_fields=None, ignore_msgs=None):
+  if not len(cfgs):
+    return {}
+
+  r, n = segment.rsplit("--", 1)
+  lr = LogReader(get_url(r, n))
+
+  results = {}
+  for cfg in cfgs:
+    cmp_log_fn = os.path.join(process_replay_dir, f"{segment}_{cfg.proc_name}_{ref_commit}.bz2")
+    results[cfg.proc_name] = test_process(cfg, lr, cmp_log_fn, ignore_fields, ignore_msgs)
+  return results
+
+
+def test_segments(segments, cfgs, process_replay_dir, ref_commit, ignore_fields=None, ignore_msgs=None, jobs=1):
+  """Replays and compares every segment, with jobs > 1 the segments run in parallel worker processes."""
+  args = (process_replay_dir, ref_commit, ignore_fields, ignore_msgs)
+  if jobs <= 1:
+    return {segment: test_segment(segment, cfgs, *args) for segment in segments}
+
+  # processes replayed over real sockets would talk to each other, those stay serial
+  parallel_cfgs = [cfg for cfg in cfgs if cfg.fake_pubsubmaster]
+  serial_cfgs = [cfg for cfg in cfgs if not cfg.fake_pubsubmaster]
+
+  # spawn, so workers don't inherit Params or messaging state from this process
+  with ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context("spawn"), initializer=init_worker) as pool:
+    futures = {segment: pool.submit(test_segment, segment, parallel_cfgs, *args) for segment in segments}
+    results = {segment: test_segment(segment, serial_cfgs, *args) for segment in segments}
+    for segment, f in futures.items():
+      results[segment].update(f.result())
+
+  # keep the order of cfgs in the report
+  return {segment: {cfg.proc_name: results[segment][cfg.proc_name] for cfg in cfgs} for segment in segments}
+
+
 def format_diff(results, ref_commit):
   diff1, diff2 = "", ""
   diff2 += f"***** tested against commit {ref_commit} *****\n"
@@ -123,6 +166,8 @@ if __name__ == "__main__":
                         help="Extra fields or msgs to ignore (e.g. carState.events)")
   parser.add_argument("--ignore-msgs", type=str, nargs="*", default=[],
                         help="Msgs to ignore (e.g. carEvents)")
+  parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of segments replayed in parallel")
   args = parser.parse_args()
 
   cars_whitelisted = len(args.whitelist_cars) > 0
@@ -143,26 +188,23 @@ if __name__ == "__main__":
     untested = (set(interface_names) - set(excluded_interfaces)) - tested_cars
     assert len(untested) == 0, f"Cars missing routes: {str(untested)}"
 
-  results: Any = {}
+  tested_segments = []
   for car_brand, segment in segments:
     if (cars_whitelisted and car_brand.upper() not in args.whitelist_cars) or \
        (not cars_whitelisted and car_brand.upper() in args.blacklist_cars):
       continue
+    tested_segments.append(segment)
 
-    print(f"***** testing route segment {segment} *****\n")
-
-    results[segment] = {}
-
-    r, n = segment.rsplit("--", 1)
-    lr = LogReader(get_url(r, n))
-
-    for cfg in CONFIGS:
-      if (procs_whitelisted and cfg.proc_name not in args.whitelist_procs) or \
-         (not procs_whitelisted and cfg.proc_name in args.blacklist_procs):
-        continue
+  tested_cfgs = []
+  for cfg in CONFIGS:
+    if (procs_whitelisted and cfg.proc_name not in args.whitelist_procs) or \
+       (not procs_whitelisted and cfg.proc_name in args.blacklist_procs):
+      continue
+    tested_cfgs.append(cfg)
 
-      cmp_log_fn = os.path.join(process_replay_dir, f"{segment}_{cfg.proc_name}_{ref_commit}.bz2")
-      results[segment][cfg.proc_name] = test_process(cfg, lr, cmp_log_fn, args.ignore_fields, args.ignore_msgs)
+  print(f"***** testing {len(tested_segments)} route segments *****\n")
+  results: Any = test_segments(tested_segments, tested_cfgs, process_replay_dir, ref_commit,
+                               args.ignore_fields, args.ignore_msgs, jobs=args.jobs)
 
   diff1, diff2, failed = format_diff(results, ref_commit)
   with open(os.path.join(process_replay_dir, "diff.txt"), "w") as f:
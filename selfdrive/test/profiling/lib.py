@@ -1,4 +1,4 @@
-from collections import defaultdict, deque
+from collections import defaultdict
 from cereal.services import service_list
 import cereal.messaging as messaging
 import capnp
@@ -39,13 +39,10 @@ class SubMaster(messaging.SubMaster):
     self.data = {}
     self.ignore_alive = []
 
-    self.alive = {s: True for s in services}
     self.updated = {s: False for s in services}
     self.rcv_time = {s: 0. for s in services}
     self.rcv_frame = {s: 0 for s in services}
     self.valid = {s: True for s in services}
-    self.freq_ok = {s: True for s in services}
-    self.recv_dts = {s: deque([0.0] * messaging.AVG_FREQ_HISTORY, maxlen=messaging.AVG_FREQ_HISTORY) for s in services}
     self.logMonoTime = {}
     self.sock = {}
     self.freq = {}
@@ -77,6 +74,7 @@ class SubMaster(messaging.SubMaster):
       self.data[s] = getattr(data, s)
       self.logMonoTime[s] = 0
       self.sock[s] = SubSocket(msgs, s)
+    self.init_health(services)
 
   def update(self, timeout=None):
     if not len(self.msgs):
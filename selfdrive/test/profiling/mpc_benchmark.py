@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""Offline benchmark of the lateral and longitudinal MPCs.
+
+capture: replays the planner inputs of routes through plannerd's planners and records
+         every call made to the acados solvers, grouped by solve
+run:     replays the recorded calls against fresh solvers, once per option set, and
+         reports latency, QP iterations, failures and solution deltas to the first set
+
+  ./mpc_benchmark.py capture "a2a0ccea32023010|2023-07-27--13-01-19" --out inputs.pkl
+  ./mpc_benchmark.py run inputs.pkl --options '{}' '{"qp_tol_stat": 1e-3}' --save baseline.npz
+  ./mpc_benchmark.py run inputs.pkl --reference baseline.npz --tolerance 1e-6
+
+Solver type, horizon and condensing are fixed when the solver code is generated, so
+those are compared by running once per build and comparing with --reference.
+"""
+import sys
+import json
+import time
+import pickle
+import argparse
+import importlib
+
+import numpy as np
+
+MPCS = {
+  'lat': 'selfdrive.controls.lib.lateral_mpc_lib.lat_mpc',
+  'long': 'selfdrive.controls.lib.longitudinal_mpc_lib.long_mpc',
+}
+
+SERVICES = ['carControl', 'carState', 'controlsState', 'radarState', 'modelV2', 'liveMapData', 'liveParameters']
+# calls that change the solver inputs or state, everything else passes through unrecorded
+RECORDED = ('set', 'set_all', 'cost_set', 'constraints_set', 'constraints_set_all', 'reset', 'options_set',
+            'update_qp_solver_cond_N')
+STATS = ('time_tot', 'time_qp', 'time_lin', 'time_sim')
+
+
+class RecordingSolver:
+  """Passes calls through to an acados solver, keeping the input calls of each solve."""
+  def __init__(self, solver):
+    self.solver = solver
+    self.calls = []
+    self.frames = []
+
+  def solve(self):
+    self.frames.append(self.calls)
+    self.calls = []
+    return self.solver.solve()
+
+  def __getattr__(self, name):
+    attr = getattr(self.solver, name)
+    if name not in RECORDED:
+      return attr
+
+    def record(*args, **kwargs):
+      self.calls.append((name, tuple(np.array(a) if isinstance(a, np.ndarray) else a for a in args), kwargs))
+      return attr(*args, **kwargs)
+    return record
+
+
+def new_solver(name):
+  mod = importlib.import_module(MPCS[name])
+  return mod.AcadosOcpSolverCython(mod.MODEL_NAME, mod.ACADOS_SOLVER_TYPE, mod.N)
+
+
+def capture(lr):
+  """Runs the planners over the messages of a log, returns the recorded solver calls per MPC."""
+  import cereal.messaging as messaging
+  from common.params import Params
+  from selfdrive.controls.plannerd import get_planners
+
+  # solvers are created by the MPC constructors, so the calls made at init are recorded as well
+  recorders, originals = {}, {}
+  for name, path in MPCS.items():
+    mod = importlib.import_module(path)
+    originals[name] = mod.AcadosOcpSolverCython
+    def make(*args, name=name):
+      recorders[name] = RecordingSolver(originals[name](*args))
+      return recorders[name]
+    mod.AcadosOcpSolverCython = make
+
+  try:
+    planners = None
+    # the planners need valid and logMonoTime as well, fed from the log like process_replay does
+    sm = messaging.SubMaster(SERVICES, poll=['radarState', 'modelV2'], ignore_avg_freq=['radarState', 'liveMapData'], addr=None)
+    for msg in lr:
+      which = msg.which()
+      if which == 'carParams' and planners is None:
+        planners = get_planners(Params(), msg.carParams)
+      elif which in SERVICES:
+        sm.update_msgs(msg.logMonoTime / 1e9, [msg])
+        if which == 'modelV2' and planners is not None and all(sm.rcv_frame[s] > 0 for s in ('carState', 'controlsState', 'radarState')):
+          longitudinal_planner, lateral_planner = planners
+          lateral_planner.update(sm)
+          longitudinal_planner.update(sm)
+  finally:
+    for name, path in MPCS.items():
+      importlib.import_module(path).AcadosOcpSolverCython = originals[name]
+
+  if planners is None:
+    raise ValueError("no carParams in the logs")
+  return {name: r.frames for name, r in recorders.items()}
+
+
+def replay(name, frames, options=None, loops=1):
+  """Replays recorded solver calls open loop against a fresh solver with the given options."""
+  mod = importlib.import_module(MPCS[name])
+  x_dim = mod.X_DIM
+  n = len(frames)
+  res = {
+    'wall': np.zeros((loops, n)),
+    'sqp_iter': np.zeros(n, dtype=np.int64),
+    'qp_iter': np.zeros(n, dtype=np.int64),
+    'status': np.zeros(n, dtype=np.int64),
+    'resets': np.array([any(c[0] == 'reset' for c in calls) for calls in frames]),
+    'x': np.zeros((n, mod.N + 1, x_dim)),
+    'u': np.zeros((n, mod.N, 1)),
+  }
+  res.update({s: np.zeros(n) for s in STATS})
+
+  for loop in range(loops):
+    solver = new_solver(name)
+    for k, v in (options or {}).items():
+      if k == 'qp_solver_cond_N':
+        solver.update_qp_solver_cond_N(v)
+      else:
+        solver.options_set(k, v)
+
+    for i, calls in enumerate(frames):
+      for method, args, kwargs in calls:
+        getattr(solver, method)(*args, **kwargs)
+
+      t = time.perf_counter()
+      status = solver.solve()
+      res['wall'][loop, i] = time.perf_counter() - t
+
+      if loop == 0:
+        res['status'][i] = status
+        res['sqp_iter'][i] = solver.get_stats('sqp_iter')
+        res['qp_iter'][i] = int(np.sum(solver.get_stats('qp_iter')))
+        for s in STATS:
+          res[s][i] = solver.get_stats(s)[0]
+        solver.get_all('x', res['x'][i])
+        solver.get_all('u', res['u'][i])
+  return res
+
+
+def summarize(res):
+  def dist(a):
+    a = np.asarray(a, dtype=np.float64).ravel() * 1e3
+    p50, p90, p99 = np.percentile(a, [50, 90, 99])
+    return f"mean {a.mean():7.3f}  p50 {p50:7.3f}  p90 {p90:7.3f}  p99 {p99:7.3f}  max {a.max():7.3f} ms"
+
+  n = len(res['status'])
+  nans = np.isnan(res['x']).any(axis=(1, 2))
+  lines = [f"  solves: {n}",
+           f"  wall:      {dist(res['wall'])}"]
+  lines += [f"  {s + ':':10} {dist(res[s])}" for s in STATS]
+  lines += [f"  qp_iter:   mean {res['qp_iter'].mean():.2f}  max {res['qp_iter'].max()}   sqp_iter: mean {res['sqp_iter'].mean():.2f}",
+            f"  failed: {np.mean(res['status'] != 0):.2%}  nan: {np.mean(nans):.2%}  recorded resets: {np.mean(res['resets']):.2%}"]
+  return "\n".join(lines)
+
+
+def solution_delta(res, ref):
+  dx = np.abs(res['x'] - ref['x']).max(axis=(1, 2))
+  du = np.abs(res['u'] - ref['u']).max(axis=(1, 2))
+  p50, p99 = np.percentile(dx, [50, 99])
+  return float(max(dx.max(), du.max())), f"  delta x: p50 {p50:.2e}  p99 {p99:.2e}  max {dx.max():.2e}   delta u: max {du.max():.2e}"
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  sub = parser.add_subparsers(dest='cmd', required=True)
+
+  p = sub.add_parser('capture', help="record the MPC inputs of routes")
+  p.add_argument("routes", nargs="+", help="route names or rlog paths")
+  p.add_argument("--out", required=True)
+
+  p = sub.add_parser('run', help="replay recorded MPC inputs against the solvers")
+  p.add_argument("inputs")
+  p.add_argument("--mpc", choices=list(MPCS), nargs="+", default=list(MPCS))
+  p.add_argument("--options", nargs="+", default=['{}'], help="JSON dicts of solver options, the first is the baseline")
+  p.add_argument("--loops", type=int, default=1, help="timing repetitions")
+  p.add_argument("--save", help="save the solutions of the first option set to a .npz")
+  p.add_argument("--reference", help="compare the first option set to solutions saved with --save")
+  p.add_argument("--tolerance", type=float, help="exit with an error if the delta to --reference exceeds this")
+  args = parser.parse_args()
+
+  if args.cmd == 'capture':
+    from tools.lib.route import Route
+    from tools.lib.logreader import MultiLogIterator
+
+    frames = {name: [] for name in MPCS}
+    for r in args.routes:
+      paths = [r] if r.endswith((".bz2", ".zst")) else [p for p in Route(r).log_paths() if p is not None]
+      for name, f in capture(MultiLogIterator(paths, services=SERVICES + ['carParams'])).items():
+        frames[name] += f
+    with open(args.out, "wb") as f:
+      pickle.dump({'routes': args.routes, 'frames': frames}, f)
+    print(", ".join(f"{name}: {len(f)} solves" for name, f in frames.items()), "recorded")
+    return
+
+  with open(args.inputs, "rb") as f:
+    frames = pickle.load(f)['frames']
+  reference = np.load(args.reference) if args.reference else None
+  option_sets = [json.loads(o) for o in args.options]
+
+  saved, worst = {}, 0.
+  for name in args.mpc:
+    results = [replay(name, frames[name], opts, args.loops) for opts in option_sets]
+    for opts, res in zip(option_sets, results):
+      print(f"{name} {json.dumps(opts)}")
+      print(summarize(res))
+      if res is not results[0]:
+        print(solution_delta(res, results[0])[1])
+
+    saved[f"{name}_x"], saved[f"{name}_u"] = results[0]['x'], results[0]['u']
+    if reference is not None:
+      delta, line = solution_delta(results[0], {'x': reference[f"{name}_x"], 'u': reference[f"{name}_u"]})
+      print(f"{name} vs reference\n{line}")
+      worst = max(worst, delta)
+
+  if args.save:
+    np.savez(args.save, **saved)
+  if args.tolerance is not None and worst > args.tolerance:
+    print(f"solutions differ from the reference by {worst:.2e} > {args.tolerance:.2e}")
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+  main()
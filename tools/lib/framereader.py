@@ -6,11 +6,12 @@ import struct
 import subprocess
 import tempfile
 import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from enum import IntEnum
 from functools import wraps
 
 import numpy as np
-from lru import LRU
 
 import _io
 from tools.lib.cache import cache_path_for_file_path
@@ -18,11 +19,17 @@ from tools.lib.exceptions import DataUnreadableError
 from common.file_helpers import atomic_write_in_dir
 
 from tools.lib.filereader import FileReader
+from tools.lib.video_index import get_store
 
 HEVC_SLICE_B = 0
 HEVC_SLICE_P = 1
 HEVC_SLICE_I = 2
 
+# decoded GOPs kept in memory, shared by all readers in the process
+GOP_CACHE_BYTES = int(os.getenv("FRAMEREADER_CACHE_BYTES", str(2 * 1024**3)))
+# concurrent ffmpeg processes used by get_batch
+DECODE_WORKERS = int(os.getenv("FRAMEREADER_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+
 
 class GOPReader:
   def get_gop(self, num):
@@ -30,6 +37,40 @@ class GOPReader:
     raise NotImplementedError
 
 
+class GOPCache:
+  """LRU of decoded GOPs bounded by the total size of the frames in it."""
+  def __init__(self, max_bytes):
+    self.max_bytes = max_bytes
+    self.nbytes = 0
+    self.gops = OrderedDict()
+    self.lock = threading.Lock()
+
+  def get(self, key):
+    with self.lock:
+      gop = self.gops.get(key)
+      if gop is not None:
+        self.gops.move_to_end(key)
+      return gop
+
+  def put(self, key, gop):
+    with self.lock:
+      if key in self.gops:
+        self.nbytes -= self.gops.pop(key).nbytes
+      self.gops[key] = gop
+      self.nbytes += gop.nbytes
+      while self.nbytes > self.max_bytes and len(self.gops) > 1:
+        _, evicted = self.gops.popitem(last=False)
+        self.nbytes -= evicted.nbytes
+
+  def clear(self):
+    with self.lock:
+      self.gops.clear()
+      self.nbytes = 0
+
+
+gop_cache = GOPCache(GOP_CACHE_BYTES)
+
+
 class DoNothingContextManager:
   def __enter__(self):
     return self
@@ -76,11 +117,16 @@ def ffprobe(fn, fmt=None):
   return json.loads(ffprobe_output)
 
 
+_vidindex_built = False
+
 def vidindex(fn, typ):
+  global _vidindex_built
   vidindex_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), "vidindex")
   vidindex = os.path.join(vidindex_dir, "vidindex")
 
-  subprocess.check_call(["make"], cwd=vidindex_dir, stdout=open("/dev/null", "w"))
+  if not _vidindex_built:
+    subprocess.check_call(["make"], cwd=vidindex_dir, stdout=open("/dev/null", "w"))
+    _vidindex_built = True
 
   with tempfile.NamedTemporaryFile() as prefix_f, \
        tempfile.NamedTemporaryFile() as index_f:
@@ -141,41 +187,61 @@ def index_stream(fn, typ):
   }
 
 
-def index_videos(camera_paths, cache_prefix=None):
-  """Requires that paths in camera_paths are contiguous and of the same type."""
-  if len(camera_paths) < 1:
-    raise ValueError("must provide at least one video to index")
+def gop_starts(index):
+  return np.flatnonzero(index[:-1, 0] == HEVC_SLICE_I)
 
-  frame_type = fingerprint_video(camera_paths[0])
-  for fn in camera_paths:
-    index_video(fn, frame_type, cache_prefix)
-
-
-def index_video(fn, frame_type=None, cache_prefix=None):
-  cache_path = cache_path_for_file_path(fn, cache_prefix)
-
-  if os.path.exists(cache_path):
-    return
 
+def _index_video_data(fn, frame_type=None):
   if frame_type is None:
-    frame_type = fingerprint_video(fn[0])
+    frame_type = fingerprint_video(fn)
 
   if frame_type == FrameType.h265_stream:
-    index_stream(fn, "hevc", cache_prefix=cache_prefix)
+    index_data = index_stream(fn, "hevc", no_cache=True)
   else:
     raise NotImplementedError("Only h265 supported")
 
+  index_data['iframes'] = gop_starts(index_data['index'])
+  return frame_type, index_data
 
-def get_video_index(fn, frame_type, cache_prefix=None):
-  cache_path = cache_path_for_file_path(fn, cache_prefix)
 
-  if not os.path.exists(cache_path):
-    index_video(fn, frame_type, cache_prefix)
+def index_videos(camera_paths, cache_prefix=None, workers=DECODE_WORKERS):
+  """Indexes the videos that aren't in the index store yet, in parallel. cache_prefix is
+     deprecated and ignored, VIDEO_INDEX_DB picks the store."""
+  store = get_store()
+  todo = [fn for fn in camera_paths if fn not in store]
+  if len(todo) == 0:
+    return 0
+
+  # vidindex and ffprobe run in the workers, the store is only written from here
+  with ProcessPoolExecutor(max_workers=min(workers, len(todo))) as pool:
+    for fn, (frame_type, index_data) in zip(todo, pool.map(_index_video_data, todo)):
+      store.put(fn, frame_type, index_data)
+  return len(todo)
 
-  if not os.path.exists(cache_path):
-    return None
-  with open(cache_path, "rb") as cache_file:
-    return pickle.load(cache_file)
+
+def index_dir(path, workers=DECODE_WORKERS):
+  """Indexes every hevc video below path, e.g. a route or a whole data directory."""
+  paths = sorted(os.path.join(root, f) for root, _, files in os.walk(path) for f in files if f.endswith(".hevc"))
+  return index_videos(paths, workers=workers)
+
+
+def index_video(fn, frame_type=None, cache_prefix=None):
+  store = get_store()
+  if fn in store:
+    return
+
+  frame_type, index_data = _index_video_data(fn, frame_type)
+  store.put(fn, frame_type, index_data)
+
+
+def get_video_index(fn, frame_type, cache_prefix=None):
+  store = get_store()
+  cached = store.get(fn)
+  if cached is None:
+    index_video(fn, frame_type)
+    cached = store.get(fn)
+
+  return None if cached is None else cached[1]
 
 
 def read_file_check_size(f, sz, cookie):
@@ -264,12 +330,15 @@ class BaseFrameReader:
 
 
 def FrameReader(fn, cache_prefix=None, readahead=False, readbehind=False, index_data=None):
-  frame_type = fingerprint_video(fn)
+  # cache_prefix is deprecated and ignored since the index store, it only keeps the positional arguments in place
+  # an already indexed video needs neither the fingerprint read nor vidindex/ffprobe
+  cached = get_store().get(fn) if not index_data else None
+  frame_type = FrameType(cached[0]) if cached is not None else fingerprint_video(fn)
   if frame_type == FrameType.raw:
     return RawFrameReader(fn)
   elif frame_type in (FrameType.h265_stream,):
     if not index_data:
-      index_data = get_video_index(fn, frame_type, cache_prefix)
+      index_data = cached[1] if cached is not None else get_video_index(fn, frame_type)
     return StreamFrameReader(fn, frame_type, index_data, readahead=readahead, readbehind=readbehind)
   else:
     raise NotImplementedError(frame_type)
@@ -428,18 +497,16 @@ class StreamGOPReader(GOPReader):
     assert self.first_iframe == 0
 
     self.frame_count = len(self.index) - 1
+    iframes = index_data.get('iframes')
+    self.iframes = np.append(gop_starts(self.index) if iframes is None else iframes, self.frame_count)
 
     self.w = probe['streams'][0]['width']
     self.h = probe['streams'][0]['height']
 
   def _lookup_gop(self, num):
-    frame_b = num
-    while frame_b > 0 and self.index[frame_b, 0] != HEVC_SLICE_I:
-      frame_b -= 1
-
-    frame_e = num + 1
-    while frame_e < (len(self.index) - 1) and self.index[frame_e, 0] != HEVC_SLICE_I:
-      frame_e += 1
+    i = np.searchsorted(self.iframes, num, side='right')
+    frame_b = int(self.iframes[i - 1]) if i > 0 else 0
+    frame_e = int(self.iframes[i])
 
     offset_b = self.index[frame_b, 1]
     offset_e = self.index[frame_e, 1]
@@ -477,7 +544,6 @@ class GOPFrameReader(BaseFrameReader):
 
     self.readahead = readahead
     self.readbehind = readbehind
-    self.frame_cache = LRU(64)
 
     if self.readahead:
       self.cache_lock = threading.RLock()
@@ -522,26 +588,68 @@ class GOPFrameReader(BaseFrameReader):
         for k in range(num, min(self.frame_count, num + self.readahead_len)):
           self._get_one(k, pix_fmt)
 
+  def _decode_gop(self, num, pix_fmt):
+    frame_b, num_frames, skip_frames, rawdat = self.get_gop(num)
+
+    ret = decompress_video_data(rawdat, self.vid_fmt, self.w, self.h, pix_fmt)
+    ret = ret[skip_frames:]
+    assert ret.shape[0] == num_frames
+
+    gop_cache.put((self.fn, frame_b, pix_fmt), ret)
+    return ret
+
   def _get_one(self, num, pix_fmt):
     assert num < self.frame_count
 
-    if (num, pix_fmt) in self.frame_cache:
-      return self.frame_cache[(num, pix_fmt)]
+    frame_b = self._lookup_gop(num)[0]
+    gop = gop_cache.get((self.fn, frame_b, pix_fmt))
+    if gop is not None:
+      return gop[num - frame_b]
 
     with self.cache_lock:
-      if (num, pix_fmt) in self.frame_cache:
-        return self.frame_cache[(num, pix_fmt)]
+      gop = gop_cache.get((self.fn, frame_b, pix_fmt))
+      if gop is None:
+        gop = self._decode_gop(num, pix_fmt)
+      return gop[num - frame_b]
 
-      frame_b, num_frames, skip_frames, rawdat = self.get_gop(num)
-
-      ret = decompress_video_data(rawdat, self.vid_fmt, self.w, self.h, pix_fmt)
-      ret = ret[skip_frames:]
-      assert ret.shape[0] == num_frames
-
-      for i in range(ret.shape[0]):
-        self.frame_cache[(frame_b+i, pix_fmt)] = ret[i]
+  def _frame_shape(self, pix_fmt):
+    if pix_fmt == "yuv420p":
+      return (self.w*self.h*3//2,)
+    elif pix_fmt == "rgb24":
+      return (self.h, self.w, 3)
+    elif pix_fmt == "yuv444p":
+      return (3, self.h, self.w)
+    raise ValueError(f"Unsupported pixel format {pix_fmt!r}")
+
+  def get_batch(self, frame_ids, pix_fmt="yuv420p", out=None):
+    """Returns the frames in frame_ids as one (len(frame_ids), ...) array. Every
+       GOP that's needed is decoded once, missing ones in parallel."""
+    assert self.frame_count is not None
 
-      return self.frame_cache[(num, pix_fmt)]
+    frame_ids = np.asarray(frame_ids, dtype=np.int64)
+    if len(frame_ids) and (frame_ids.min() < 0 or frame_ids.max() >= self.frame_count):
+      raise ValueError(f"frame ids out of range [0, {self.frame_count})")
+
+    shape = (len(frame_ids),) + self._frame_shape(pix_fmt)
+    if out is None:
+      out = np.empty(shape, dtype=np.uint8)
+    assert out.shape == shape, (out.shape, shape)
+
+    starts = {f: self._lookup_gop(f)[0] for f in set(frame_ids.tolist())}
+    gops = {b: gop_cache.get((self.fn, b, pix_fmt)) for b in set(starts.values())}
+    missing = [b for b, gop in gops.items() if gop is None]
+    if len(missing) == 1:
+      gops[missing[0]] = self._decode_gop(missing[0], pix_fmt)
+    elif len(missing) > 1:
+      # every decode is its own ffmpeg process, threads are enough to run them in parallel
+      with ThreadPoolExecutor(max_workers=min(DECODE_WORKERS, len(missing))) as pool:
+        for b, gop in zip(missing, pool.map(lambda b: self._decode_gop(b, pix_fmt), missing)):
+          gops[b] = gop
+
+    for i, f in enumerate(frame_ids.tolist()):
+      b = starts[f]
+      out[i] = gops[b][f - b]
+    return out
 
   def get(self, num, count=1, pix_fmt="yuv420p"):
     assert self.frame_count is not None
@@ -0,0 +1,201 @@
+import os
+import bz2
+import mmap
+import struct
+import urllib.parse
+import capnp
+import numpy as np
+
+from cereal import log as capnp_log
+from common.file_helpers import atomic_write_in_dir, mkdirs_exists_ok
+from tools.lib.filereader import FileReader
+from tools.lib.url_file import CACHE_DIR, CACHE_SIZE_LIMIT, CacheLRU, hash_256
+
+# Sidecar index for raw (decompressed) rlogs. One row per capnp message in the stream,
+# enough to seek by time or by service without decoding any Event.
+INDEX_VERSION = 1
+INDEX_DTYPE = np.dtype([('offset', '<u8'), ('size', '<u4'), ('logMonoTime', '<u8'), ('which', '<u2')])
+NO_WHICH = 0xffff
+
+NO_TRAVERSAL_LIMIT = 2**64-1
+
+# decompressed logs and their indexes, least recently used ones are evicted past CACHE_SIZE_LIMIT
+LOG_CACHE_DIR = os.path.join(CACHE_DIR, "logs")
+_lru = CacheLRU(LOG_CACHE_DIR, CACHE_SIZE_LIMIT)
+
+
+def _event_union():
+  node = capnp_log.Event.schema.node
+  fields = {f.name: f.discriminantValue for f in node.struct.fields if f.discriminantValue != NO_WHICH}
+  return node.struct.discriminantOffset, fields
+
+# discriminant offset is in units of 16 bits within the data section of the Event struct
+EVENT_DISCRIMINANT_OFFSET, EVENT_WHICH = _event_union()
+EVENT_WHICH_NAMES = {v: k for k, v in EVENT_WHICH.items()}
+
+
+def message_bounds(dat, pos):
+  """Returns (header_size, message_size) of the capnp message framed at pos."""
+  num_segments = struct.unpack_from('<I', dat, pos)[0] + 1
+  sizes = struct.unpack_from(f'<{num_segments}I', dat, pos + 4)
+  header = (4 * (num_segments + 1) + 7) & ~7
+  return header, header + 8 * sum(sizes)
+
+
+def peek_event(dat, pos, header):
+  """Reads logMonoTime and the union discriminant straight from the root struct of
+     the message at pos. Returns None when the root is not a plain struct pointer."""
+  ptr = struct.unpack_from('<Q', dat, pos + header)[0]
+  if ptr & 3 != 0:
+    return None
+
+  offset = (ptr >> 2) & 0x3fffffff
+  if offset & 0x20000000:
+    offset -= 0x40000000
+  data_size = ((ptr >> 32) & 0xffff) * 8
+  data = pos + header + 8 + offset * 8
+
+  mono_time = struct.unpack_from('<Q', dat, data)[0] if data_size >= 8 else 0
+  disc_pos = EVENT_DISCRIMINANT_OFFSET * 2
+  which = struct.unpack_from('<H', dat, data + disc_pos)[0] if disc_pos + 2 <= data_size else 0
+  return mono_time, which
+
+
+def decode_event(dat):
+  return capnp_log.Event.from_bytes(dat, traversal_limit_in_words=NO_TRAVERSAL_LIMIT)
+
+
+def iter_messages(dat):
+  """Walks the capnp framing of a raw log, yields (pos, size, logMonoTime, which) per message.
+     logMonoTime and which are None if the message needs a full decode to read them."""
+  pos, end = 0, len(dat)
+  while pos + 8 <= end:
+    header, size = message_bounds(dat, pos)
+    if pos + size > end:
+      # truncated message at the end of the log
+      break
+
+    peeked = peek_event(dat, pos, header)
+    if peeked is None:
+      yield pos, size, None, None
+    else:
+      yield (pos, size) + peeked
+    pos += size
+
+
+def _which(ev):
+  try:
+    return EVENT_WHICH[ev.which()]
+  except (capnp.lib.capnp.KjException, KeyError):
+    return NO_WHICH
+
+
+def build_index(dat):
+  rows = []
+  for pos, size, mono_time, which in iter_messages(dat):
+    if which is None:
+      ev = decode_event(dat[pos:pos+size])
+      mono_time, which = ev.logMonoTime, _which(ev)
+    rows.append((pos, size, mono_time, which))
+  return np.array(rows, dtype=INDEX_DTYPE)
+
+
+def service_discriminants(services):
+  return [EVENT_WHICH[s] for s in services]
+
+
+def read_filtered(dat, services):
+  """Decodes only the Events of the given services, everything else is skipped
+     based on the union discriminant without building a capnp object."""
+  wanted = set(service_discriminants(services))
+  ents = []
+  for pos, size, _, which in iter_messages(dat):
+    if which is None or which in wanted:
+      ev = decode_event(dat[pos:pos+size])
+      if which is not None or _which(ev) in wanted:
+        ents.append(ev)
+  return ents
+
+
+def source_stamp(fn):
+  # remote files are immutable, local ones are checked by size and mtime
+  if os.path.exists(fn):
+    st = os.stat(fn)
+    return st.st_size, st.st_mtime_ns
+  return 0, 0
+
+
+def _mmap(path):
+  with open(path, "rb") as f:
+    if os.fstat(f.fileno()).st_size == 0:
+      return b""
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def open_indexed_log(fn, cache=True):
+  """Returns (buf, index) for a log, where buf is the memory-mapped decompressed stream.
+
+     The decompressed stream and the index are written to LOG_CACHE_DIR on first
+     use, so later opens only mmap and load the index.
+  """
+  _, ext = os.path.splitext(urllib.parse.urlparse(fn).path)
+  if ext not in ("", ".bz2"):
+    raise Exception(f"unknown extension {ext}")
+
+  mkdirs_exists_ok(LOG_CACHE_DIR)
+  cache_prefix = os.path.join(LOG_CACHE_DIR, hash_256(os.path.abspath(fn) if os.path.exists(fn) else fn))
+  index_path = cache_prefix + ".idx.npz"
+  raw_path = fn if ext == "" and os.path.exists(fn) else cache_prefix + ".raw"
+  stamp = (INDEX_VERSION,) + source_stamp(fn)
+
+  if cache and os.path.exists(index_path) and os.path.exists(raw_path):
+    with np.load(index_path) as cached:
+      if tuple(cached['stamp']) == stamp:
+        _lru.touch(index_path)
+        _lru.touch(raw_path)
+        return _mmap(raw_path), cached['index']
+
+  if raw_path == fn:
+    buf = _mmap(raw_path)
+  else:
+    with FileReader(fn) as f:
+      dat = f.read()
+    if ext == ".bz2":
+      dat = bz2.decompress(dat)
+
+    if not cache:
+      return dat, build_index(dat)
+
+    with atomic_write_in_dir(raw_path, mode="wb", overwrite=True) as f:
+      f.write(dat)
+    # an evicted log that is still mapped stays readable until it's unmapped
+    buf = _mmap(raw_path)
+    _lru.added(len(dat))
+    del dat
+
+  index = build_index(buf)
+  if cache:
+    with atomic_write_in_dir(index_path, mode="wb", overwrite=True) as f:
+      np.savez(f, index=index, stamp=np.array(stamp, dtype=np.int64))
+    _lru.added(os.path.getsize(index_path))
+  return buf, index
+
+
+class LazyEvents:
+  """Sequence of Events over a raw log buffer, each Event is only decoded when accessed."""
+  def __init__(self, buf, index):
+    self._buf = buf
+    self.index = index
+
+  def __len__(self):
+    return len(self.index)
+
+  def __getitem__(self, i):
+    if isinstance(i, slice):
+      return LazyEvents(self._buf, self.index[i])
+    off, size = int(self.index['offset'][i]), int(self.index['size'][i])
+    return decode_event(self._buf[off:off+size])
+
+  def __iter__(self):
+    for i in range(len(self.index)):
+      yield self[i]
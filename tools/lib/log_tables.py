@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import shutil
+import numpy as np
+from collections import defaultdict
+from functools import reduce
+
+import capnp
+
+from cereal import log as capnp_log
+from common.file_helpers import atomic_write_in_dir, mkdirs_exists_ok
+from tools.lib.log_index import source_stamp
+from tools.lib.logreader import LogReader
+from tools.lib.url_file import CACHE_DIR, hash_256
+
+# Per-service columnar tables of a segment, one .npy per scalar field:
+#   <COMMA_CACHE>/tables/<sha>/carState/vEgo.npy
+#   <COMMA_CACHE>/tables/<sha>/carState/logMonoTime.npy
+# meta.json is written last and lists the complete services.
+TABLES_VERSION = 2
+TABLES_DIR = os.path.join(CACHE_DIR, "tables")
+
+
+SCALAR_TYPES = ('bool', 'int8', 'int16', 'int32', 'int64', 'uint8', 'uint16', 'uint32', 'uint64', 'float32', 'float64')
+
+
+def _scalar_paths(schema, prefix=()):
+  # (path, type) of the scalar fields of a struct schema, nested structs and groups flattened
+  for name, field in schema.fields.items():
+    if field.proto.which() == 'group':
+      yield from _scalar_paths(field.schema, prefix + (name,))
+      continue
+
+    typ = field.proto.slot.type.which()
+    if typ == 'struct':
+      yield from _scalar_paths(field.schema, prefix + (name,))
+    elif typ in SCALAR_TYPES:
+      yield prefix + (name,), typ
+
+
+def _service_rows(service, evs):
+  """Returns (struct schema, [(event, struct)]) of a service, list services get one row
+     per element. None for services without struct data (text, data and scalar services)."""
+  field = capnp_log.Event.schema.fields[service]
+  typ = field.proto.slot.type
+  if typ.which() == 'struct':
+    return field.schema, [(ev, getattr(ev, service)) for ev in evs]
+  if typ.which() == 'list' and typ.list.elementType.which() == 'struct':
+    return field.schema.elementType, [(ev, m) for ev in evs for m in getattr(ev, service)]
+  return None
+
+
+def _column(values, typ):
+  if any(v is None for v in values):
+    # field was missing in some messages (e.g. a different union member was set)
+    return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+  if typ == 'bool':
+    return np.array(values, dtype=np.bool_)
+  if typ == 'uint64':
+    return np.array(values, dtype=np.uint64)
+  if typ.startswith(('int', 'uint')):
+    return np.array(values, dtype=np.int64)
+  return np.array(values, dtype=np.float64)
+
+
+def _get(msg, path):
+  try:
+    return reduce(getattr, path, msg)
+  except (AttributeError, capnp.lib.capnp.KjException):
+    return None
+
+
+def events_to_tables(events):
+  """Converts Events into {service: {column: array}}. Columns are the scalar fields
+     of each service's schema, with nested structs flattened to dotted names. List
+     services like can get one row per element, logMonoTime and valid repeated."""
+  by_service = defaultdict(list)
+  for ev in events:
+    try:
+      by_service[ev.which()].append(ev)
+    except capnp.lib.capnp.KjException:
+      pass
+
+  tables = {}
+  for service, evs in by_service.items():
+    service_rows = _service_rows(service, evs)
+    if service_rows is None:
+      continue
+
+    schema, rows = service_rows
+    table = {
+      'logMonoTime': np.array([ev.logMonoTime for ev, _ in rows], dtype=np.uint64),
+      'valid': np.array([ev.valid for ev, _ in rows], dtype=np.bool_),
+    }
+    for path, typ in _scalar_paths(schema):
+      table['.'.join(path)] = _column([_get(m, path) for _, m in rows], typ)
+    tables[service] = table
+  return tables
+
+
+def tables_path(fn):
+  return os.path.join(TABLES_DIR, hash_256(fn))
+
+
+def _read_meta(path, fn):
+  try:
+    with open(os.path.join(path, "meta.json")) as f:
+      meta = json.load(f)
+  except (OSError, ValueError):
+    return None
+  if meta['version'] != TABLES_VERSION or meta['stamp'] != list(source_stamp(fn)):
+    return None
+  return meta
+
+
+def export_tables(fn, services=None):
+  """Writes the columnar tables of a segment to the cache, skipping services that are
+     already there. With services=None every service in the segment is exported."""
+  path = tables_path(fn)
+  meta = _read_meta(path, fn)
+  if meta is None:
+    shutil.rmtree(path, ignore_errors=True)
+    meta = {'version': TABLES_VERSION, 'stamp': list(source_stamp(fn)), 'complete': False, 'services': {}}
+
+  if services is None:
+    if meta['complete']:
+      return path
+  else:
+    services = [s for s in services if s not in meta['services']]
+    if not services:
+      return path
+
+  tables = events_to_tables(LogReader(fn, services=services))
+  for service, table in tables.items():
+    service_dir = os.path.join(path, service)
+    mkdirs_exists_ok(service_dir)
+    for name, col in table.items():
+      with atomic_write_in_dir(os.path.join(service_dir, name + ".npy"), mode="wb", overwrite=True) as f:
+        np.save(f, col)
+    meta['services'][service] = list(table.keys())
+
+  # remember services that aren't in this segment so they aren't looked for again
+  for service in (services or []):
+    meta['services'].setdefault(service, [])
+
+  if services is None:
+    meta['complete'] = True
+  mkdirs_exists_ok(path)
+  with atomic_write_in_dir(os.path.join(path, "meta.json"), mode="w", overwrite=True) as f:
+    json.dump(meta, f)
+  return path
+
+
+def load_tables(fn, services=None):
+  """Returns {service: {column: memory-mapped array}} for a segment, exporting it first if needed."""
+  path = export_tables(fn, services)
+  meta = _read_meta(path, fn)
+  wanted = [s for s in (meta['services'] if services is None else services) if meta['services'].get(s)]
+  return {s: {name: np.load(os.path.join(path, s, name + ".npy"), mmap_mode='r') for name in meta['services'][s]}
+          for s in wanted}
+
+
+if __name__ == "__main__":
+  for fn in sys.argv[1:]:
+    print(export_tables(fn))
@@ -2,32 +2,103 @@
 import os
 import sys
 import bz2
+import heapq
+import bisect
+import itertools
 import urllib.parse
 import capnp
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 
 from cereal import log as capnp_log
 from tools.lib.filereader import FileReader
+from tools.lib.log_index import EVENT_WHICH, EVENT_WHICH_NAMES, LazyEvents, open_indexed_log, \
+                                read_filtered, service_discriminants
 from tools.lib.route import Route, SegmentName
 
+# number of segments fetched and decompressed ahead of the current one, 0 reads serially
+PREFETCH = int(os.getenv("LOGREADER_PREFETCH", str(min(4, os.cpu_count() or 1))))
+
+
+def read_log_bytes(fn):
+  _, ext = os.path.splitext(urllib.parse.urlparse(fn).path)
+  with FileReader(fn) as f:
+    dat = f.read()
+
+  # old rlogs weren't bz2 compressed
+  if ext == ".bz2":
+    dat = bz2.decompress(dat)
+  elif ext != "":
+    raise Exception(f"unknown extension {ext}")
+  return dat
+
+
+def _prefetch_log(fn, lazy):
+  # runs in a worker process, capnp objects can't be sent back so only the raw log is
+  if lazy:
+    open_indexed_log(fn)
+    return None
+  return read_log_bytes(fn)
+
+
 # this is an iterator itself, and uses private variables from LogReader
 class MultiLogIterator:
-  def __init__(self, log_paths, sort_by_time=False):
+  def __init__(self, log_paths, sort_by_time=False, lazy=False, services=None, prefetch=PREFETCH):
     self._log_paths = log_paths
     self.sort_by_time = sort_by_time
+    self.lazy = lazy
+    self.services = services
+    self.prefetch = prefetch
+    self._pool = None
+    self._futures = {}
 
     self._first_log_idx = next(i for i in range(len(log_paths)) if log_paths[i] is not None)
     self._current_log = self._first_log_idx
     self._idx = 0
     self._log_readers = [None]*len(log_paths)
-    self.start_time = self._log_reader(self._first_log_idx)._ts[0]
+    # sorted by time, the segments are merged on logMonoTime: heap of (logMonoTime, segment, idx)
+    # with the next event of each open segment, later segments are opened once they overlap
+    self._heap = None
+    self._next_log = None
+    self._merge_from = 0
+    # with a services filter the first segments may not have any events
+    self.start_time = next(self._log_reader(i)._ts[0] for i in range(self._first_log_idx, len(log_paths))
+                           if log_paths[i] is not None and len(self._log_reader(i)._ts))
+
+  def _schedule_prefetch(self, i):
+    if self._pool is None:
+      self._pool = ProcessPoolExecutor(max_workers=self.prefetch)
+
+    # drop what's behind us, a seek may have skipped it
+    for j in [j for j in self._futures if j < i]:
+      self._futures.pop(j).cancel()
+
+    for j in range(i, min(i + self.prefetch + 1, len(self._log_paths))):
+      if self._log_paths[j] is not None and self._log_readers[j] is None and j not in self._futures:
+        self._futures[j] = self._pool.submit(_prefetch_log, self._log_paths[j], self.lazy)
 
   def _log_reader(self, i):
     if self._log_readers[i] is None and self._log_paths[i] is not None:
       log_path = self._log_paths[i]
-      self._log_readers[i] = LogReader(log_path, sort_by_time=self.sort_by_time)
+      dat = None
+      if self.prefetch > 0:
+        self._schedule_prefetch(i)
+        dat = self._futures.pop(i).result()
+      self._log_readers[i] = LogReader(log_path, sort_by_time=self.sort_by_time, lazy=self.lazy, services=self.services, dat=dat)
 
     return self._log_readers[i]
 
+  def close(self):
+    if self._pool is not None:
+      for f in self._futures.values():
+        f.cancel()
+      self._futures = {}
+      self._pool.shutdown(wait=False)
+      self._pool = None
+
+  def __del__(self):
+    self.close()
+
   def __iter__(self):
     return self
 
@@ -40,18 +111,79 @@ class MultiLogIterator:
       self._current_log = next(i for i in range(self._current_log + 1, len(self._log_readers) + 1)
                                if i == len(self._log_readers) or self._log_paths[i] is not None)
       if self._current_log == len(self._log_readers):
+        self.close()
         raise StopIteration
 
+  def _skip_empty(self):
+    # with a services filter segments may not have any events
+    while len(self._log_reader(self._current_log)._ents) == 0:
+      self._inc()
+
+  def _merge_start(self, first, last, mono_time=0):
+    # merges segments from first on, starting at their first event at or after mono_time
+    self._heap = []
+    self._merge_from = mono_time
+    self._next_log = first
+    while self._next_log <= last:
+      if self._log_paths[self._next_log] is not None:
+        self._merge_push(self._next_log, self._log_reader(self._next_log).mono_time_index(mono_time))
+      self._next_log += 1
+
+  def _merge_push(self, i, idx):
+    lr = self._log_reader(i)
+    if idx < len(lr._ents):
+      heapq.heappush(self._heap, (lr._ts[idx], i, idx))
+
+  def _merge_open(self):
+    # segments start in order, only the next one can have events before the current
+    while self._next_log < len(self._log_paths):
+      if self._log_paths[self._next_log] is not None:
+        lr = self._log_reader(self._next_log)
+        if self._heap and len(lr._ts) and lr._ts[0] > self._heap[0][0]:
+          break
+        self._merge_push(self._next_log, lr.mono_time_index(self._merge_from))
+      self._next_log += 1
+
+  def _merge_next(self):
+    if self._heap is None:
+      self._merge_start(self._first_log_idx, self._first_log_idx)
+    self._merge_open()
+    if not self._heap:
+      self.close()
+      raise StopIteration
+
+    _, i, idx = heapq.heappop(self._heap)
+    self._merge_push(i, idx + 1)
+    self._current_log, self._idx = i, idx + 1
+    return self._log_reader(i)._ents[idx]
+
   def __next__(self):
-    while 1:
-      lr = self._log_reader(self._current_log)
-      ret = lr._ents[self._idx]
+    if self.sort_by_time:
+      return self._merge_next()
+
+    if self._current_log == len(self._log_paths):
+      raise StopIteration
+    self._skip_empty()
+    ret = self._log_reader(self._current_log)._ents[self._idx]
+    try:
       self._inc()
-      return ret
+    except StopIteration:
+      pass  # ret is the last event, the next call stops
+    return ret
 
   def tell(self):
     # returns seconds from start of log
-    return (self._log_reader(self._current_log)._ts[self._idx] - self.start_time) * 1e-9
+    if self.sort_by_time:
+      if self._heap is None:
+        self._merge_start(self._first_log_idx, self._first_log_idx)
+      self._merge_open()
+      return (self._heap[0][0] - self.start_time) * 1e-9 if self._heap else float('inf')
+
+    lr = self._log_reader(self._current_log)
+    if len(lr._ts) == 0:
+      # no events to go by, the segment's minute
+      return self._current_log * 60.
+    return (lr._ts[self._idx] - self.start_time) * 1e-9
 
   def seek(self, ts):
     # seek to nearest minute
@@ -59,38 +191,89 @@ class MultiLogIterator:
     if minute >= len(self._log_paths) or self._log_paths[minute] is None:
       return False
 
+    if self.sort_by_time:
+      # the previous segment can still have events after ts
+      self._merge_start(max(minute - 1, 0), minute, self.start_time + int(ts * 1e9))
+      self._merge_open()
+      return bool(self._heap)
+
     self._current_log = minute
 
-    # HACK: O(n) seek afterward
-    self._idx = 0
-    while self.tell() < ts:
-      self._inc()
+    # bisect within the minute, only steps forward if ts is past its last event
+    lr = self._log_reader(minute)
+    self._idx = max(0, min(lr.mono_time_index(self.start_time + int(ts * 1e9)), len(lr._ents) - 1))
+    try:
+      self._skip_empty()
+      while self.tell() < ts:
+        self._inc()
+        self._skip_empty()
+    except StopIteration:
+      return False
     return True
 
   def reset(self):
-    self.__init__(self._log_paths, sort_by_time=self.sort_by_time)
+    self.close()
+    self.__init__(self._log_paths, sort_by_time=self.sort_by_time, lazy=self.lazy, services=self.services,
+                  prefetch=self.prefetch)
 
 class LogReader:
-  def __init__(self, fn, canonicalize=True, only_union_types=False, sort_by_time=False):
+  def __init__(self, fn, canonicalize=True, only_union_types=False, sort_by_time=False, lazy=False, services=None, dat=None):
     data_version = None
-    _, ext = os.path.splitext(urllib.parse.urlparse(fn).path)
-    with FileReader(fn) as f:
-      dat = f.read()
+    self._ts_max = None
 
-    if ext == "":
-      # old rlogs weren't bz2 compressed
-      ents = capnp_log.Event.read_multiple_bytes(dat)
-    elif ext == ".bz2":
-      dat = bz2.decompress(dat)
-      ents = capnp_log.Event.read_multiple_bytes(dat)
+    if lazy:
+      # memory-mapped stream plus a cached index, Events are decoded on access
+      buf, index = open_indexed_log(fn)
+      init_data = np.flatnonzero(index['which'] == EVENT_WHICH['initData'])
+      if len(init_data):
+        data_version = LazyEvents(buf, index)[int(init_data[0])].initData.version
+      if only_union_types:
+        index = index[np.isin(index['which'], list(EVENT_WHICH_NAMES))]
+      if services is not None:
+        index = index[np.isin(index['which'], service_discriminants(services))]
+      if sort_by_time:
+        index = index[np.argsort(index['logMonoTime'], kind='stable')]
+      self._ents = LazyEvents(buf, index)
+      self._ts = index['logMonoTime'].astype(np.int64)
+      self.data_version = data_version
+      self._only_union_types = False
+      return
+
+    # dat is the already decompressed log when it was prefetched
+    if dat is None:
+      dat = read_log_bytes(fn)
+
+    if services is not None:
+      # only build Events for the requested services
+      ents = read_filtered(dat, services)
+      del dat
     else:
-      raise Exception(f"unknown extension {ext}")
+      ents = capnp_log.Event.read_multiple_bytes(dat)
 
     self._ents = list(sorted(ents, key=lambda x: x.logMonoTime) if sort_by_time else ents)
     self._ts = [x.logMonoTime for x in self._ents]
     self.data_version = data_version
     self._only_union_types = only_union_types
 
+  def mono_time_index(self, mono_time):
+    """Returns the index of the first event at or after mono_time, in iteration order."""
+    if getattr(self, '_ts_max', None) is None:
+      # logMonoTime isn't strictly ordered in a log, bisect over its running max instead
+      if isinstance(self._ts, np.ndarray):
+        self._ts_max = np.maximum.accumulate(self._ts)
+      else:
+        self._ts_max = list(itertools.accumulate(self._ts, max))
+
+    if isinstance(self._ts_max, np.ndarray):
+      return int(np.searchsorted(self._ts_max, mono_time, side='left'))
+    return bisect.bisect_left(self._ts_max, mono_time)
+
+  def which_indices(self, which):
+    """Returns the indices of all events of one service, in iteration order."""
+    if isinstance(self._ents, LazyEvents):
+      return np.flatnonzero(self._ents.index['which'] == EVENT_WHICH[which])
+    return np.array([i for i, ent in enumerate(self._ents) if ent.which() == which], dtype=np.int64)
+
   def __iter__(self):
     for ent in self._ents:
       if self._only_union_types:
@@ -103,13 +286,13 @@ class LogReader:
         yield ent
 
 
-def logreader_from_route_or_segment(r, sort_by_time=False):
+def logreader_from_route_or_segment(r, sort_by_time=False, lazy=False, services=None):
   sn = SegmentName(r, allow_route_name=True)
   route = Route(sn.route_name.canonical_name)
   if sn.segment_num < 0:
-    return MultiLogIterator(route.log_paths(), sort_by_time)
+    return MultiLogIterator(route.log_paths(), sort_by_time, lazy=lazy, services=services)
   else:
-    return LogReader(route.log_paths()[sn.segment_num], sort_by_time)
+    return LogReader(route.log_paths()[sn.segment_num], sort_by_time=sort_by_time, lazy=lazy, services=services)
 
 
 if __name__ == "__main__":
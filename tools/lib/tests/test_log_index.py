@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+import os
+import bz2
+import random
+import shutil
+import tempfile
+import unittest
+import capnp
+from unittest import mock
+
+os.environ["COMMA_CACHE"] = "/tmp/__test_cache__"
+from cereal import log as capnp_log
+from tools.lib import log_index
+from tools.lib.log_index import EVENT_WHICH, LOG_CACHE_DIR, build_index, open_indexed_log
+from tools.lib.logreader import LogReader, MultiLogIterator
+
+
+def make_log(n=300):
+  init = capnp_log.Event.new_message(logMonoTime=10**9)
+  init.init('initData').version = "0.8.13"
+  msgs = [init]
+  for i in range(n):
+    service = random.choice(["carState", "controlsState", "can", "sendcan"])
+    msg = capnp_log.Event.new_message(logMonoTime=10**9 + i * 10**7 + random.randint(0, 3 * 10**7))
+    if service in ("can", "sendcan"):
+      can = msg.init(service, random.randint(1, 8))
+      for c in can:
+        c.address = random.randint(0, 0x7ff)
+        c.dat = bytes(random.randint(0, 8))
+    else:
+      msg.init(service)
+    msgs.append(msg)
+  return b"".join(m.to_bytes() for m in msgs)
+
+
+class TestLogIndex(unittest.TestCase):
+  def setUp(self):
+    shutil.rmtree(LOG_CACHE_DIR, ignore_errors=True)
+    self.tmp = tempfile.mkdtemp()
+    self.raw = make_log()
+    self.fn = os.path.join(self.tmp, "rlog.bz2")
+    with open(self.fn, "wb") as f:
+      f.write(bz2.compress(self.raw))
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp)
+
+  def test_index_matches_decode(self):
+    index = build_index(self.raw)
+    ents = list(capnp_log.Event.read_multiple_bytes(self.raw))
+    self.assertEqual(len(index), len(ents))
+    self.assertEqual(int(index['offset'][-1] + index['size'][-1]), len(self.raw))
+    for row, ev in zip(index, ents):
+      self.assertEqual(row['logMonoTime'], ev.logMonoTime)
+      self.assertEqual(row['which'], EVENT_WHICH[ev.which()])
+
+  def test_every_service(self):
+    # the discriminant is read from the real Event schema, check it for every union member
+    msgs = []
+    for name in EVENT_WHICH:
+      msg = capnp_log.Event.new_message(logMonoTime=len(msgs))
+      try:
+        msg.init(name)
+      except capnp.lib.capnp.KjException:
+        try:
+          msg.init(name, 1)
+        except capnp.lib.capnp.KjException:
+          continue
+      msgs.append((name, msg))
+
+    self.assertGreater(len(msgs), 50)
+    index = build_index(b"".join(m.to_bytes() for _, m in msgs))
+    self.assertEqual([int(w) for w in index['which']], [EVENT_WHICH[name] for name, _ in msgs])
+    self.assertEqual([int(t) for t in index['logMonoTime']], list(range(len(msgs))))
+
+  def test_lazy_reader(self):
+    for sort_by_time in (False, True):
+      eager = LogReader(self.fn, sort_by_time=sort_by_time)
+      # second lazy open is served from the cached index
+      for _ in range(2):
+        lazy = LogReader(self.fn, sort_by_time=sort_by_time, lazy=True)
+        self.assertEqual(len(lazy._ents), len(eager._ents))
+        for a, b in zip(lazy, eager):
+          self.assertEqual(a.as_builder().to_bytes(), b.as_builder().to_bytes())
+
+        self.assertEqual(list(lazy._ts), list(eager._ts))
+        self.assertEqual(lazy.data_version, "0.8.13")
+        self.assertTrue(os.listdir(LOG_CACHE_DIR))
+        self.assertEqual(list(lazy.which_indices("carState")), list(eager.which_indices("carState")))
+        for t in (0, eager._ts[len(eager._ts) // 2], eager._ts[-1], 10**12):
+          self.assertEqual(lazy.mono_time_index(t), eager.mono_time_index(t))
+
+  def test_cache_eviction(self):
+    fns = []
+    for i in range(3):
+      fn = os.path.join(self.tmp, f"rlog{i}.bz2")
+      shutil.copy(self.fn, fn)
+      fns.append(fn)
+
+    # room for about two decompressed logs
+    with mock.patch.object(log_index._lru, 'limit', int(2.5 * len(self.raw))), mock.patch.object(log_index._lru, 'size', None):
+      for fn in fns:
+        open_indexed_log(fn)
+      raws = [f for f in os.listdir(LOG_CACHE_DIR) if f.endswith(".raw")]
+      self.assertEqual(len(raws), 2)
+
+      # evicted logs are decompressed again
+      buf, index = open_indexed_log(fns[0])
+      self.assertEqual(bytes(buf), self.raw)
+
+  def test_services_filter(self):
+    services = ["carState", "can"]
+    expected = [m.as_builder().to_bytes() for m in LogReader(self.fn) if m.which() in services]
+    for lazy in (False, True):
+      lr = LogReader(self.fn, lazy=lazy, services=services)
+      self.assertEqual([m.as_builder().to_bytes() for m in lr], expected)
+
+    with self.assertRaises(KeyError):
+      LogReader(self.fn, services=["notAService"])
+
+
+class TestMultiLogIterator(unittest.TestCase):
+  def setUp(self):
+    shutil.rmtree(LOG_CACHE_DIR, ignore_errors=True)
+    self.tmp = tempfile.mkdtemp()
+    self.paths = []
+    for seg in range(3):
+      msgs = []
+      # the last second of a segment overlaps the start of the next one
+      for t in sorted(random.uniform(seg * 60, seg * 60 + 61) for _ in range(200)):
+        msg = capnp_log.Event.new_message(logMonoTime=10**9 + int(t * 1e9))
+        msg.init(random.choice(["carState", "controlsState"]))
+        msgs.append(msg)
+      random.shuffle(msgs[:20])
+      fn = os.path.join(self.tmp, f"{seg}_rlog.bz2")
+      with open(fn, "wb") as f:
+        f.write(bz2.compress(b"".join(m.to_bytes() for m in msgs)))
+      self.paths.append(fn)
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp)
+
+  def test_merged_stream(self):
+    in_order = [m.logMonoTime for fn in self.paths for m in LogReader(fn)]
+    self.assertNotEqual(in_order, sorted(in_order))
+    for prefetch in (0, 2):
+      self.assertEqual([m.logMonoTime for m in MultiLogIterator(self.paths, prefetch=prefetch)], in_order)
+      self.assertEqual([m.logMonoTime for m in MultiLogIterator(self.paths, sort_by_time=True, prefetch=prefetch)], sorted(in_order))
+
+  def test_merged_seek(self):
+    times = sorted(m.logMonoTime for fn in self.paths for m in LogReader(fn))
+    for ts in (0, 30, 60.5, 61, 119.9, 150):
+      lr = MultiLogIterator(self.paths, sort_by_time=True, prefetch=0)
+      self.assertTrue(lr.seek(ts))
+      self.assertGreaterEqual(lr.tell(), ts)
+      expected = [t for t in times if t >= lr.start_time + int(ts * 1e9)]
+      self.assertEqual([m.logMonoTime for m in lr], expected)
+    self.assertFalse(MultiLogIterator(self.paths, sort_by_time=True, prefetch=0).seek(200))
+
+
+if __name__ == "__main__":
+  unittest.main()
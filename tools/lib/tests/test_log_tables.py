@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+import os
+import bz2
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+os.environ["COMMA_CACHE"] = "/tmp/__test_cache__"
+from cereal import log as capnp_log
+from tools.lib.log_tables import TABLES_DIR, load_tables
+
+
+class TestLogTables(unittest.TestCase):
+  def setUp(self):
+    shutil.rmtree(TABLES_DIR, ignore_errors=True)
+    self.tmp = tempfile.mkdtemp()
+    self.fn = os.path.join(self.tmp, "rlog.bz2")
+
+    msgs = []
+    for i in range(100):
+      cs = capnp_log.Event.new_message(logMonoTime=i * 10**7, valid=bool(i % 3))
+      cs.init('carState')
+      cs.carState.vEgo = i * 0.5
+      cs.carState.cruiseState.enabled = i > 50
+      msgs.append(cs)
+      ctrl = capnp_log.Event.new_message(logMonoTime=i * 10**7 + 1)
+      ctrl.init('controlsState')
+      ctrl.controlsState.curvature = -i * 0.001
+      msgs.append(ctrl)
+      can = capnp_log.Event.new_message(logMonoTime=i * 10**7 + 2)
+      can.init('can', 2)
+      for j, c in enumerate(can.can):
+        c.address, c.src, c.dat = 0x100 + j, j, bytes([i, j])
+      msgs.append(can)
+    with open(self.fn, "wb") as f:
+      f.write(bz2.compress(b"".join(m.to_bytes() for m in msgs)))
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp)
+
+  def test_tables(self):
+    for _ in range(2):
+      tables = load_tables(self.fn, services=['carState', 'controlsState', 'radarState'])
+      self.assertEqual(set(tables), {'carState', 'controlsState'})
+
+      cs = tables['carState']
+      self.assertIsInstance(cs['vEgo'], np.memmap)
+      np.testing.assert_allclose(cs['vEgo'], np.arange(100) * 0.5)
+      np.testing.assert_equal(cs['cruiseState.enabled'], np.arange(100) > 50)
+      np.testing.assert_equal(cs['valid'], np.arange(100) % 3 != 0)
+      np.testing.assert_equal(cs['logMonoTime'], np.arange(100) * 10**7)
+      np.testing.assert_allclose(tables['controlsState']['curvature'], -np.arange(100) * 0.001, rtol=1e-6)
+
+    tables = load_tables(self.fn)
+    self.assertEqual(set(tables), {'carState', 'controlsState', 'can'})
+
+    # one row per CAN message, columns come from the schema
+    can = tables['can']
+    self.assertEqual(set(can), {'logMonoTime', 'valid', 'address', 'busTime', 'src'})
+    np.testing.assert_equal(can['address'], np.tile([0x100, 0x101], 100))
+    np.testing.assert_equal(can['src'], np.tile([0, 1], 100))
+    np.testing.assert_equal(can['logMonoTime'], np.repeat(np.arange(100) * 10**7 + 2, 2))
+
+    # schema columns exist even when the first message doesn't set them
+    self.assertIn('steeringAngleDeg', tables['carState'])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -1,12 +1,14 @@
 #!/usr/bin/env python
+import os
 import unittest
 import requests
 import tempfile
 
 from collections import defaultdict
 import numpy as np
-from tools.lib.framereader import FrameReader
+from tools.lib.framereader import FrameReader, GOPCache
 from tools.lib.logreader import LogReader
+from tools.lib.video_index import VideoIndexStore
 
 
 class TestReaders(unittest.TestCase):
@@ -52,6 +54,13 @@ class TestReaders(unittest.TestCase):
       assert np.all(frame_first_30[0] == frame_0[0])
       assert np.all(frame_first_30[15] == frame_15[0])
 
+      batch = f.get_batch([15, 0, 1199, 15])
+      self.assertEqual(batch.shape, (4, f.w*f.h*3//2))
+      assert np.all(batch[0] == frame_15[0])
+      assert np.all(batch[1] == frame_0[0])
+      assert np.all(batch[2] == f.get(1199, 1)[0])
+      assert np.all(batch[3] == batch[0])
+
     with tempfile.NamedTemporaryFile(suffix=".hevc") as fp:
       r = requests.get("https://github.com/commaai/comma2k19/blob/master/Example_1/b0c9d2329ad1606b%7C2018-08-02--08-34-47/40/video.hevc?raw=true")
       fp.write(r.content)
@@ -63,5 +72,41 @@ class TestReaders(unittest.TestCase):
     fr_url = FrameReader("https://github.com/commaai/comma2k19/blob/master/Example_1/b0c9d2329ad1606b%7C2018-08-02--08-34-47/40/video.hevc?raw=true")
     _check_data(fr_url)
 
+  def test_gop_cache(self):
+    cache = GOPCache(3 * 100)
+    for i in range(3):
+      cache.put(("fn", i, "yuv420p"), np.zeros(100, dtype=np.uint8))
+    self.assertIsNotNone(cache.get(("fn", 0, "yuv420p")))
+
+    # least recently used GOP is evicted first
+    cache.put(("fn", 3, "yuv420p"), np.zeros(100, dtype=np.uint8))
+    self.assertIsNone(cache.get(("fn", 1, "yuv420p")))
+    self.assertIsNotNone(cache.get(("fn", 0, "yuv420p")))
+    self.assertEqual(cache.nbytes, 300)
+
+    # a GOP bigger than the budget is still kept on its own
+    cache.put(("fn", 4, "yuv420p"), np.zeros(1000, dtype=np.uint8))
+    self.assertEqual(list(cache.gops), [("fn", 4, "yuv420p")])
+
+  def test_video_index_store(self):
+    with tempfile.TemporaryDirectory() as tmp, tempfile.NamedTemporaryFile(suffix=".hevc") as vid:
+      store = VideoIndexStore(os.path.join(tmp, "video_index.db"))
+      self.assertNotIn(vid.name, store)
+      self.assertIsNone(store.get(vid.name))
+
+      index = np.array([[2, 0], [1, 100], [2, 200], [0xFFFFFFFF, 300]], dtype=np.uint32)
+      store.put(vid.name, 2, {'index': index, 'iframes': np.array([0, 2]), 'global_prefix': b"prefix", 'probe': {'streams': []}})
+      frame_type, index_data = VideoIndexStore(os.path.join(tmp, "video_index.db")).get(vid.name)
+      self.assertEqual(frame_type, 2)
+      np.testing.assert_equal(index_data['index'], index)
+      np.testing.assert_equal(index_data['iframes'], [0, 2])
+      self.assertEqual(index_data['global_prefix'], b"prefix")
+      self.assertEqual(index_data['probe'], {'streams': []})
+
+      # a modified file has to be indexed again
+      vid.write(b"\x00")
+      vid.flush()
+      self.assertNotIn(vid.name, store)
+
 if __name__ == "__main__":
   unittest.main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+import os
+import re
+import shutil
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+os.environ["COMMA_CACHE"] = "/tmp/__test_url_file_cache__"
+from tools.lib.url_file import URLFile, CACHE_DIR
+
+DATA = os.urandom(10_500)
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+  fail_next = 0
+  requests = 0
+
+  def log_message(self, *args):
+    pass
+
+  def do_HEAD(self):
+    self.send_response(200)
+    self.send_header("Content-Length", str(len(DATA)))
+    self.end_headers()
+
+  def do_GET(self):
+    RangeHandler.requests += 1
+    if RangeHandler.fail_next > 0:
+      RangeHandler.fail_next -= 1
+      self.send_error(500)
+      return
+
+    m = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+    if m is None:
+      self.send_response(200)
+      body = DATA
+    else:
+      start = int(m.group(1))
+      end = int(m.group(2)) + 1 if m.group(2) else len(DATA)
+      self.send_response(206)
+      body = DATA[start:end]
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+
+@mock.patch("tools.lib.url_file.CHUNK_SIZE", 1000)
+class TestURLFile(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    cls.server = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+    cls.url = f"http://127.0.0.1:{cls.server.server_address[1]}/rlog.bz2"
+
+  @classmethod
+  def tearDownClass(cls):
+    cls.server.shutdown()
+
+  def setUp(self):
+    shutil.rmtree(CACHE_DIR, ignore_errors=True)
+    os.makedirs(CACHE_DIR)
+    RangeHandler.fail_next = 0
+
+  def test_ranges(self):
+    for cache in (True, False):
+      for start, ll in [(0, None), (0, 10), (999, 2), (1500, 4000), (10_000, 1000), (len(DATA), 10)]:
+        f = URLFile(self.url, cache=cache, readahead=0)
+        f.seek(start)
+        self.assertEqual(f.read(ll), DATA[start:start + ll if ll is not None else None])
+
+  def test_cached_reads_skip_network(self):
+    URLFile(self.url, cache=True).read()
+    requests = RangeHandler.requests
+    f = URLFile(self.url, cache=True)
+    f.seek(2500)
+    self.assertEqual(f.read(3000), DATA[2500:5500])
+    self.assertEqual(RangeHandler.requests, requests)
+
+  def test_retry_after_failure(self):
+    RangeHandler.fail_next = 2
+    f = URLFile(self.url, cache=True, workers=1, readahead=0)
+    self.assertEqual(f.read(), DATA)
+
+  def test_lru_eviction(self):
+    with mock.patch.object(URLFile._lru, "limit", 4000):
+      URLFile(self.url, cache=True).read()
+      URLFile._lru.added(0)
+      self.assertLessEqual(sum(os.path.getsize(os.path.join(CACHE_DIR, fn)) for fn in os.listdir(CACHE_DIR)), 4000)
+
+      # evicted chunks are downloaded again
+      self.assertEqual(URLFile(self.url, cache=True).read(), DATA)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -1,11 +1,14 @@
 # pylint: skip-file
 
 import os
+import stat
 import time
+import random
 import tempfile
 import threading
 import urllib.parse
 import pycurl
+from concurrent.futures import ThreadPoolExecutor
 from hashlib import sha256
 from io import BytesIO
 from tenacity import retry, wait_random_exponential, stop_after_attempt
@@ -15,6 +18,12 @@ K = 1000
 CHUNK_SIZE = 1000 * K
 
 CACHE_DIR = os.environ.get("COMMA_CACHE", "/tmp/comma_download_cache/")
+#  Least recently used chunks are evicted once the cache grows past this many bytes
+CACHE_SIZE_LIMIT = int(os.environ.get("COMMA_CACHE_SIZE_LIMIT", str(10 * 1000 * 1000 * K)))
+#  Concurrent range requests per file, and chunks fetched ahead of sequential reads
+DOWNLOAD_WORKERS = int(os.environ.get("URLFILE_WORKERS", "4"))
+READAHEAD_CHUNKS = int(os.environ.get("URLFILE_READAHEAD", "2"))
+DOWNLOAD_RETRIES = 3
 
 
 def hash_256(link):
@@ -22,24 +31,78 @@ def hash_256(link):
   return hsh
 
 
+class CacheLRU:
+  """Keeps the files directly in CACHE_DIR under CACHE_SIZE_LIMIT. Files are
+     touched when read, so the oldest mtime is the least recently used."""
+  def __init__(self, path, limit):
+    self.path = path
+    self.limit = limit
+    self.size = None
+    self.lock = threading.Lock()
+
+  def _scan(self):
+    entries = []
+    for fn in os.listdir(self.path):
+      full_path = os.path.join(self.path, fn)
+      try:
+        st = os.stat(full_path)
+      except FileNotFoundError:
+        continue
+      if stat.S_ISREG(st.st_mode):
+        entries.append((st.st_mtime, st.st_size, full_path))
+    return entries
+
+  def touch(self, path):
+    try:
+      os.utime(path)
+    except OSError:
+      pass
+
+  def added(self, nbytes):
+    with self.lock:
+      if self.size is None:
+        self.size = sum(size for _, size, _ in self._scan())
+      else:
+        self.size += nbytes
+
+      if self.size > self.limit:
+        self.evict()
+
+  def evict(self):
+    # rescan, the estimate drifts when other processes share the cache
+    entries = sorted(self._scan())
+    self.size = sum(size for _, size, _ in entries)
+    target = self.limit * 0.9
+    for _, size, full_path in entries:
+      if self.size <= target:
+        break
+      try:
+        os.remove(full_path)
+      except FileNotFoundError:
+        pass
+      self.size -= size
+
+
 class URLFile:
   _tlocal = threading.local()
+  _lru = CacheLRU(CACHE_DIR, CACHE_SIZE_LIMIT)
+  _pools = {}
+  _inflight = {}
+  _inflight_lock = threading.Lock()
 
-  def __init__(self, url, debug=False, cache=None):
+  def __init__(self, url, debug=False, cache=None, workers=DOWNLOAD_WORKERS, readahead=READAHEAD_CHUNKS):
     self._url = url
     self._pos = 0
     self._length = None
     self._local_file = None
     self._debug = debug
+    self._workers = workers
+    self._readahead = readahead
     #  True by default, false if FILEREADER_CACHE is defined, but can be overwritten by the cache input
     self._force_download = not int(os.environ.get("FILEREADER_CACHE", "0"))
     if cache is not None:
       self._force_download = not cache
 
-    try:
-      self._curl = self._tlocal.curl
-    except AttributeError:
-      self._curl = self._tlocal.curl = pycurl.Curl()
     mkdirs_exists_ok(CACHE_DIR)
 
   def __enter__(self):
@@ -51,6 +114,21 @@ class URLFile:
       self._local_file.close()
       self._local_file = None
 
+  @property
+  def _curl(self):
+    # downloads run on pool threads, every thread gets its own handle
+    try:
+      return self._tlocal.curl
+    except AttributeError:
+      self._tlocal.curl = pycurl.Curl()
+      return self._tlocal.curl
+
+  @classmethod
+  def _pool(cls, workers):
+    if workers not in cls._pools:
+      cls._pools[workers] = ThreadPoolExecutor(max_workers=workers)
+    return cls._pools[workers]
+
   @retry(wait=wait_random_exponential(multiplier=1, max=5), stop=stop_after_attempt(3), reraise=True)
   def get_length_online(self):
     c = self._curl
@@ -77,57 +155,110 @@ class URLFile:
 
     self._length = self.get_length_online()
     if not self._force_download:
-      with atomic_write_in_dir(file_length_path, mode="w") as file_length:
+      with atomic_write_in_dir(file_length_path, mode="w", overwrite=True) as file_length:
         file_length.write(str(self._length))
     return self._length
 
+  def _chunk_path(self, chunk_number):
+    #  chunk numbers are formatted as floats to stay compatible with existing caches
+    return os.path.join(CACHE_DIR, hash_256(self._url) + "_" + str(float(chunk_number)))
+
+  def _fetch_chunk(self, chunk_number, path):
+    start = chunk_number * CHUNK_SIZE
+    data = self._download_range(start, min(start + CHUNK_SIZE, self.get_length()))
+    with atomic_write_in_dir(path, mode="wb", overwrite=True) as new_cached_file:
+      new_cached_file.write(data)
+    self._lru.added(len(data))
+    return data
+
+  def _submit_chunk(self, chunk_number):
+    path = self._chunk_path(chunk_number)
+    with self._inflight_lock:
+      future = self._inflight.get(path)
+      if future is None:
+        future = self._pool(self._workers).submit(self._fetch_chunk, chunk_number, path)
+        self._inflight[path] = future
+        future.add_done_callback(lambda _: self._inflight.pop(path, None))
+    return future
+
+  def _get_chunk(self, chunk_number):
+    """Returns the cached chunk, or a future for its download."""
+    path = self._chunk_path(chunk_number)
+    try:
+      with open(path, "rb") as cached_file:
+        data = cached_file.read()
+      self._lru.touch(path)
+      return data
+    except FileNotFoundError:
+      return self._submit_chunk(chunk_number)
+
   def read(self, ll=None):
     if self._force_download:
       return self.read_aux(ll=ll)
 
+    length = self.get_length()
     file_begin = self._pos
-    file_end = self._pos + ll if ll is not None else self.get_length()
-    #  We have to align with chunks we store. Position is the begginiing of the latest chunk that starts before or at our file
-    position = (file_begin // CHUNK_SIZE) * CHUNK_SIZE
-    response = b""
-    while True:
-      self._pos = position
-      chunk_number = self._pos / CHUNK_SIZE
-      file_name = hash_256(self._url) + "_" + str(chunk_number)
-      full_path = os.path.join(CACHE_DIR, str(file_name))
-      data = None
-      #  If we don't have a file, download it
-      if not os.path.exists(full_path):
-        data = self.read_aux(ll=CHUNK_SIZE)
-        with atomic_write_in_dir(full_path, mode="wb") as new_cached_file:
-          new_cached_file.write(data)
-      else:
-        with open(full_path, "rb") as cached_file:
-          data = cached_file.read()
+    file_end = min(self._pos + ll, length) if ll is not None else length
+    if file_begin >= file_end:
+      return b""
 
-      response += data[max(0, file_begin - position): min(CHUNK_SIZE, file_end - position)]
+    #  Missing chunks are downloaded in parallel, already cached ones are read meanwhile
+    first_chunk, last_chunk = file_begin // CHUNK_SIZE, (file_end - 1) // CHUNK_SIZE
+    chunks = [self._get_chunk(n) for n in range(first_chunk, last_chunk + 1)]
 
-      position += CHUNK_SIZE
-      if position >= file_end:
-        self._pos = file_end
-        return response
+    #  Start on the next chunks so sequential readers don't wait on the network
+    num_chunks = (length + CHUNK_SIZE - 1) // CHUNK_SIZE
+    for n in range(last_chunk + 1, min(last_chunk + 1 + self._readahead, num_chunks)):
+      if not os.path.exists(self._chunk_path(n)):
+        self._submit_chunk(n)
+
+    response = []
+    for n, chunk in zip(range(first_chunk, last_chunk + 1), chunks):
+      data = chunk if isinstance(chunk, bytes) else chunk.result()
+      position = n * CHUNK_SIZE
+      response.append(data[max(0, file_begin - position): min(CHUNK_SIZE, file_end - position)])
+
+    self._pos = file_end
+    return b"".join(response)
 
-  @retry(wait=wait_random_exponential(multiplier=1, max=5), stop=stop_after_attempt(3), reraise=True)
   def read_aux(self, ll=None):
-    download_range = False
-    headers = ["Connection: keep-alive"]
+    end = None
     if self._pos != 0 or ll is not None:
-      if ll is None:
-        end = self.get_length() - 1
-      else:
-        end = min(self._pos + ll, self.get_length()) - 1
+      end = self.get_length() if ll is None else min(self._pos + ll, self.get_length())
       if self._pos >= end:
         return b""
-      headers.append(f"Range: bytes={self._pos}-{end}")
+
+    ret = self._download_range(self._pos, end)
+    self._pos += len(ret)
+    return ret
+
+  def _download_range(self, start, end):
+    """Downloads [start, end), end=None reads to the end of the file. When a
+       transfer breaks off it's resumed from the last received byte."""
+    dat = bytearray()
+    for attempt in range(DOWNLOAD_RETRIES):
+      buf = BytesIO()
+      try:
+        self._perform(start + len(dat), end, buf)
+        return bytes(dat + buf.getvalue())
+      except Exception:
+        #  _perform only leaves the body of a broken off transfer of the requested range in buf
+        dat += buf.getvalue()
+        if end is not None and start + len(dat) >= end:
+          return bytes(dat)
+        if attempt == DOWNLOAD_RETRIES - 1:
+          raise
+        time.sleep(random.uniform(0, min(5, 2 ** attempt)))
+
+  def _perform(self, start, end, dats):
+    download_range = False
+    headers = ["Connection: keep-alive"]
+    if start != 0 or end is not None:
+      headers.append(f"Range: bytes={start}-{end - 1 if end is not None else ''}")
       download_range = True
 
-    dats = BytesIO()
     c = self._curl
+    c.reset()
     c.setopt(pycurl.URL, self._url)
     c.setopt(pycurl.WRITEDATA, dats)
     c.setopt(pycurl.NOSIGNAL, 1)
@@ -151,24 +282,30 @@ class URLFile:
       c.setopt(pycurl.DEBUGFUNCTION, test)
       t1 = time.time()
 
-    c.perform()
+    try:
+      c.perform()
+    except pycurl.error:
+      if c.getinfo(pycurl.RESPONSE_CODE) != (206 if download_range else 200):
+        dats.seek(0)
+        dats.truncate()
+      raise
 
     if self._debug:
       t2 = time.time()
       if t2 - t1 > 0.1:
-        print(f"get {self._url} {headers!r} {t2 - t1:.f} slow")
+        print(f"get {self._url} {headers!r} {t2 - t1:.2f} slow")
 
     response_code = c.getinfo(pycurl.RESPONSE_CODE)
+    if response_code != (206 if download_range else 200):
+      body = repr(dats.getvalue())[:500]
+      dats.seek(0)
+      dats.truncate()
     if response_code == 416:  # Requested Range Not Satisfiable
-      raise Exception(f"Error, range out of bounds {response_code} {headers} ({self._url}): {repr(dats.getvalue())[:500]}")
+      raise Exception(f"Error, range out of bounds {response_code} {headers} ({self._url}): {body}")
     if download_range and response_code != 206:  # Partial Content
-      raise Exception(f"Error, requested range but got unexpected response {response_code} {headers} ({self._url}): {repr(dats.getvalue())[:500]}")
+      raise Exception(f"Error, requested range but got unexpected response {response_code} {headers} ({self._url}): {body}")
     if (not download_range) and response_code != 200:  # OK
-      raise Exception(f"Error {response_code} {headers} ({self._url}): {repr(dats.getvalue())[:500]}")
-
-    ret = dats.getvalue()
-    self._pos += len(ret)
-    return ret
+      raise Exception(f"Error {response_code} {headers} ({self._url}): {body}")
 
   def seek(self, pos):
     self._pos = pos
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import sqlite3
+import threading
+import numpy as np
+
+from common.file_helpers import mkdirs_exists_ok
+from tools.lib.cache import DEFAULT_CACHE_DIR
+from tools.lib.url_file import hash_256
+
+# One SQLite database holding the frame index, GOP boundaries and ffprobe output of
+# every video that was opened, so FrameReader doesn't need vidindex/ffprobe again.
+VIDEO_INDEX_VERSION = 1
+VIDEO_INDEX_DB = os.getenv("VIDEO_INDEX_DB", os.path.join(DEFAULT_CACHE_DIR, "video_index.db"))
+
+
+def video_key(fn):
+  # remote files never change, local ones are keyed by size and mtime as well
+  if os.path.exists(fn):
+    st = os.stat(fn)
+    return f"{hash_256(os.path.abspath(fn))}_{st.st_size}_{st.st_mtime_ns}"
+  return hash_256(fn)
+
+
+class VideoIndexStore:
+  def __init__(self, path=VIDEO_INDEX_DB):
+    mkdirs_exists_ok(os.path.dirname(path))
+    self.lock = threading.Lock()
+    self.db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+    with self.db:
+      self.db.execute("""CREATE TABLE IF NOT EXISTS videos (
+        key TEXT PRIMARY KEY,
+        version INTEGER NOT NULL,
+        frame_type INTEGER NOT NULL,
+        frame_index BLOB NOT NULL,
+        iframes BLOB NOT NULL,
+        global_prefix BLOB NOT NULL,
+        probe TEXT NOT NULL
+      )""")
+
+  def get(self, fn):
+    """Returns (frame_type, index_data) for a video, or None if it isn't indexed yet."""
+    with self.lock:
+      row = self.db.execute("SELECT frame_type, frame_index, iframes, global_prefix, probe FROM videos WHERE key = ? AND version = ?",
+                            (video_key(fn), VIDEO_INDEX_VERSION)).fetchone()
+    if row is None:
+      return None
+
+    frame_type, frame_index, iframes, prefix, probe = row
+    return frame_type, {
+      'index': np.frombuffer(frame_index, dtype=np.uint32).reshape(-1, 2),
+      'iframes': np.frombuffer(iframes, dtype=np.int64),
+      'global_prefix': prefix,
+      'probe': json.loads(probe),
+    }
+
+  def put(self, fn, frame_type, index_data):
+    """index_data is what index_stream returns, plus the GOP start frames in 'iframes'."""
+    index = np.ascontiguousarray(index_data['index'], dtype=np.uint32)
+    iframes = np.ascontiguousarray(index_data['iframes'], dtype=np.int64)
+    with self.lock, self.db:
+      self.db.execute("INSERT OR REPLACE INTO videos VALUES (?, ?, ?, ?, ?, ?, ?)",
+                      (video_key(fn), VIDEO_INDEX_VERSION, int(frame_type), index.tobytes(), iframes.tobytes(),
+                       bytes(index_data['global_prefix']), json.dumps(index_data['probe'])))
+
+  def __contains__(self, fn):
+    with self.lock:
+      row = self.db.execute("SELECT 1 FROM videos WHERE key = ? AND version = ?", (video_key(fn), VIDEO_INDEX_VERSION)).fetchone()
+    return row is not None
+
+
+_store = None
+
+def get_store():
+  global _store
+  if _store is None:
+    _store = VideoIndexStore()
+  return _store
+
+
+if __name__ == "__main__":
+  from tools.lib.framereader import index_dir
+  for path in sys.argv[1:]:
+    print(f"indexed {index_dir(path)} videos in {path}")